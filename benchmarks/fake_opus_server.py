@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""
+A local stand-in for the OPUS API server used by the benchmarks.
+
+It serves synthetic fields.json (with an ETag for conditional requests),
+data.json, files.json, images.json and meta/* responses, grayscale browse
+images and product files (with HEAD and Range support), for a fixed number
+of observations with a configurable per-request latency and maximum page
+size.
+Only the parts of the API used by this package are implemented, and
+searches are only honored for the synthetic "observationduration" and
+"time" (in Julian dates) range fields and "target" mult field.
+
+Run it by itself with:
+
+    python benchmarks/fake_opus_server.py --port 8000 --rows 100000
+
+or in a child process with FakeOPUSServerProcess. GET /stats.json returns the
+number of requests served so far.
+"""
+
+import argparse
+from datetime import datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+_TARGETS = ['SATURN', 'TITAN', 'RHEA', 'DIONE', 'TETHYS', 'ENCELADUS',
+            'MIMAS', 'IAPETUS']
+_PAGING_PARAMS = ('startobs', 'limit', 'cols', 'types')
+
+def make_fields(num_surfacegeo_targets=50):
+    """Return a synthetic fields.json 'data' dict."""
+    fields = {}
+    def _add(fieldid, f_type, category='General Constraints',
+             units=None, label=None):
+        fields[fieldid] = {'category': category,
+                           'type': f_type,
+                           'label': label or fieldid,
+                           'full_label': label or fieldid,
+                           'search_label': label or fieldid,
+                           'full_search_label': label or fieldid,
+                           'default_units': None if units is None
+                                                 else units[0],
+                           'available_units': units,
+                           'slug': fieldid,
+                           'old_slug': fieldid}
+    _add('opusid', 'string')
+    _add('target', 'multiple')
+    _add('planet', 'multiple')
+    _add('instrument', 'multiple')
+    _add('volumeid', 'string')
+    _add('time1', 'range_time', units=['ymdhms', 'jd', 'et'])
+    _add('time2', 'range_time', units=['ymdhms', 'jd', 'et'])
+    _add('observationduration', 'range_float',
+         units=['seconds', 'milliseconds'])
+    _add('levels', 'range_integer')
+    for target_num in range(num_surfacegeo_targets):
+        target = f'target{target_num}'
+        for root in ('centerdistance', 'centerresolution', 'phase'):
+            for suffix in ('1', '2'):
+                _add(f'SURFACEGEO{target}_{root}{suffix}', 'range_float',
+                     category=f'Surface Geometry [{target.upper()}]',
+                     units=['km', 'm'],
+                     label=f'{root} [{target.upper()}]')
+    return fields
+
+class FakeOPUSData(object):
+    """The synthetic observations served by the fake server."""
+    def __init__(self, num_rows, num_surfacegeo_targets=50):
+        self.num_rows = num_rows
+        self.fields = make_fields(num_surfacegeo_targets)
+        self._select_cache = {}
+        self._select_lock = threading.Lock()
+
+    def set_num_rows(self, num_rows):
+        """Change the number of observations, as if the archive changed."""
+        with self._select_lock:
+            self.num_rows = num_rows
+            self._select_cache.clear()
+
+    def opusid(self, idx):
+        return f'co-iss-n{1454725799+idx}'
+
+    def time_jd(self, idx):
+        """Return the time of an observation as a Julian date."""
+        value = datetime.fromisoformat(self.value(idx, 'time1'))
+        return ((value - datetime(2000, 1, 1, 12)).total_seconds() / 86400. +
+                2451545.)
+
+    def value(self, idx, fieldid):
+        if fieldid == 'opusid':
+            return self.opusid(idx)
+        if fieldid == 'target':
+            return _TARGETS[idx % len(_TARGETS)]
+        if fieldid in ('planet',):
+            return 'SATURN'
+        if fieldid == 'instrument':
+            return 'COISS'
+        if fieldid == 'volumeid':
+            return f'COISS_{2001+idx//10000}'
+        if fieldid.startswith('time'):
+            secs = idx * 37
+            return (f'2004-{1+secs//2592000%12:02d}-{1+secs//86400%28:02d}T'
+                    f'{secs//3600%24:02d}:{secs//60%60:02d}:{secs%60:02d}.089')
+        if fieldid == 'observationduration':
+            return None if idx % 97 == 0 else f'{(idx % 1000) * 0.25:.3f}'
+        if fieldid == 'levels':
+            return str(idx % 4096)
+        return f'{(idx * 7919) % 100000 / 3.:.4f}'
+
+    def select(self, params):
+        """Return the list of observation indexes matching a search."""
+        key = tuple(sorted((key, val) for key, val in params.items()
+                           if key not in _PAGING_PARAMS))
+        with self._select_lock:
+            indexes = self._select_cache.get(key)
+        if indexes is None:
+            indexes = self._select(params)
+            with self._select_lock:
+                self._select_cache[key] = indexes
+        return indexes
+
+    def _select(self, params):
+        indexes = range(self.num_rows)
+        if 'target' in params:
+            targets = params['target'].split(',')
+            indexes = [idx for idx in indexes
+                       if _TARGETS[idx % len(_TARGETS)] in targets]
+        lo = params.get('observationduration1')
+        hi = params.get('observationduration2')
+        if lo is not None or hi is not None:
+            lo = -1e300 if lo is None else float(lo)
+            hi = 1e300 if hi is None else float(hi)
+            indexes = [idx for idx in indexes
+                       if idx % 97 != 0 and lo <= (idx % 1000) * 0.25 <= hi]
+        lo = params.get('time1')
+        hi = params.get('time2')
+        if lo is not None or hi is not None:
+            if params.get('unit-time') != 'jd':
+                raise ValueError('Fake time searches must be in jd')
+            lo = -1e300 if lo is None else float(lo)
+            hi = 1e300 if hi is None else float(hi)
+            indexes = [idx for idx in indexes
+                       if lo <= self.time_jd(idx) <= hi]
+        if 'opusid' in params:
+            wanted = set(params['opusid'].split(','))
+            indexes = [idx for idx in indexes if self.opusid(idx) in wanted]
+        return indexes
+
+class FakeOPUSHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send the headers and body in one write; otherwise Nagle's algorithm
+    # and delayed ACKs add ~40 ms to every keep-alive response
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, obj, status=200, headers=None):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for key, val in (headers or {}).items():
+            self.send_header(key, val)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_image(self, path):
+        """Send a 100x100 grayscale PGM image derived from the path."""
+        seed = sum(path.encode('utf-8')) % 256
+        body = (b'P5 100 100 255\n' +
+                bytes((seed+i) % 256 for i in range(100*100)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/x-portable-graymap')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def product_body(path):
+        """Return the synthetic contents of the product file at path."""
+        seed = sum(path.encode('utf-8'))
+        return bytes((seed+i*7) % 256 for i in range(1000 + seed % 4000))
+
+    def _send_product(self, path, head=False):
+        """Send a product file, honoring a "Range: bytes=N-" header."""
+        body = self.product_body(path)
+        total = len(body)
+        status = 200
+        byte_range = self.headers.get('Range')
+        if byte_range is not None and byte_range.startswith('bytes='):
+            start = int(byte_range[len('bytes='):].partition('-')[0])
+            if start >= total:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{total}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+            body = body[start:]
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range',
+                             f'bytes {total-len(body)}-{total-1}/{total}')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        path = urlparse(self.path).path
+        if path.startswith('/volumes/'):
+            self._send_product(path, head=True)
+            return
+        self.send_response(404)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/stats.json':
+            with server.stats_lock:
+                self._send_json({'num_requests': server.num_requests})
+            return
+        with server.stats_lock:
+            server.num_requests += 1
+            failure = None
+            if server.failures and self.path.startswith('/api/'):
+                failure = server.failures.pop(0)
+        if server.latency:
+            time.sleep(server.latency)
+        if failure is not None:
+            status, retry_after = failure
+            self._send_json({'error': 'injected failure'}, status=status,
+                            headers=(None if retry_after is None
+                                     else {'Retry-After': retry_after}))
+            return
+        url = urlparse(self.path)
+        params = {key: vals[-1] for key, vals in parse_qs(url.query).items()}
+        path = url.path
+        data = server.data
+        if path.startswith('/browse/'):
+            self._send_image(path)
+            return
+        if path.startswith('/volumes/'):
+            self._send_product(path)
+            return
+        if not path.startswith('/api/'):
+            self._send_json({'error': 'not found'}, status=404)
+            return
+        path = path[5:]
+
+        if path == 'fields.json':
+            etag = '"' + hashlib.sha1(json.dumps(data.fields, sort_keys=True)
+                                      .encode('utf-8')).hexdigest() + '"'
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self._send_json({'data': data.fields}, headers={'ETag': etag})
+            return
+
+        indexes = data.select(params)
+        if path == 'meta/result_count.json':
+            self._send_json({'data': [{'result_count': len(indexes)}]})
+            return
+        if path.startswith('meta/mults/'):
+            fieldid = path[len('meta/mults/'):-len('.json')]
+            mults = {}
+            for idx in indexes:
+                val = data.value(idx, fieldid)
+                mults[val] = mults.get(val, 0) + 1
+            self._send_json({'field_id': fieldid, 'mults': mults})
+            return
+        if path.startswith('meta/range/endpoints/'):
+            fieldid = path[len('meta/range/endpoints/'):-len('.json')]
+            vals = [data.value(idx, fieldid+'1') if fieldid == 'time'
+                    else data.value(idx, fieldid) for idx in indexes]
+            if fieldid == 'time':
+                # Times are returned in ymdhms, which sorts as text
+                nums = [val for val in vals if val is not None]
+            else:
+                nums = [float(val) for val in vals if val is not None]
+            self._send_json({'min': None if not nums else str(min(nums)),
+                             'max': None if not nums else str(max(nums)),
+                             'nulls': len(vals)-len(nums),
+                             'units': None})
+            return
+
+        startobs = int(params.get('startobs', 1))
+        limit = min(int(params.get('limit', 100)), server.max_page_size)
+        page = indexes[startobs-1:startobs-1+limit]
+        ret = {'start_obs': startobs, 'limit': limit, 'count': len(page),
+               'available': len(indexes)}
+        if path == 'data.json':
+            cols = params.get('cols', 'opusid').split(',')
+            ret['columns'] = cols
+            ret['page'] = [[data.value(idx, col) for col in cols]
+                           for idx in page]
+        elif path == 'files.json':
+            base = f'{server.url}/volumes/COISS_2xxx'
+            ret['data'] = {data.opusid(idx): {
+                               'coiss_raw': [f'{base}/N{idx}_1.IMG',
+                                             f'{base}/N{idx}_1.LBL'],
+                               'coiss_calib': [f'{base}/N{idx}_1_CALIB.IMG',
+                                               f'{base}/N{idx}_1_CALIB.LBL']}
+                           for idx in page}
+            if 'types' in params:
+                types = params['types'].split(',')
+                ret['data'] = {opusid: {product_type: urls
+                                        for product_type, urls
+                                        in products.items()
+                                        if product_type in types}
+                               for opusid, products in ret['data'].items()}
+        elif path.startswith('images'):
+            base = f'{server.url}/browse/COISS_2xxx'
+            ret['data'] = {data.opusid(idx): {
+                               'alt_text': f'N{idx}_1_thumb.jpg',
+                               'url': f'{base}/N{idx}_1_thumb.jpg',
+                               'width': 100, 'height': 100}
+                           for idx in page}
+        else:
+            self._send_json({'error': 'not found'}, status=404)
+            return
+        self._send_json(ret)
+
+class FakeOPUSServer(ThreadingHTTPServer):
+    """A threaded HTTP server answering OPUS API requests from FakeOPUSData.
+
+    Use it as a context manager to run it on a background thread:
+
+        with FakeOPUSServer(num_rows=10000, latency=0.02) as server:
+            api = OPUSAPI(server=server.url)
+    """
+    daemon_threads = True
+
+    def __init__(self, num_rows=10000, latency=0., max_page_size=1000,
+                 num_surfacegeo_targets=50, host='127.0.0.1', port=0):
+        super(FakeOPUSServer, self).__init__((host, port), FakeOPUSHandler)
+        self.data = FakeOPUSData(num_rows, num_surfacegeo_targets)
+        self.latency = latency
+        self.max_page_size = max_page_size
+        self.num_requests = 0
+        self.stats_lock = threading.Lock()
+        # (status, Retry-After) for each upcoming API request to fail
+        self.failures = []
+        self._thread = None
+
+    def fail_requests(self, count, status=503, retry_after=None):
+        """Make the next count API requests fail with an HTTP status."""
+        with self.stats_lock:
+            self.failures += [(status, retry_after)] * count
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+class FakeOPUSServerProcess(object):
+    """A FakeOPUSServer running in a child process.
+
+    Timings and memory measured in the parent then only include the client,
+    and the client and server don't compete for the same GIL. Use it as a
+    context manager:
+
+        with FakeOPUSServerProcess(num_rows=10000, latency=0.02) as server:
+            api = OPUSAPI(server=server.url)
+    """
+    def __init__(self, num_rows=10000, latency=0., max_page_size=1000,
+                 host='127.0.0.1'):
+        self._args = [sys.executable, os.path.abspath(__file__),
+                      '--host', host, '--port', '0',
+                      '--rows', str(num_rows),
+                      '--latency', str(latency),
+                      '--max-page-size', str(max_page_size)]
+        self._process = None
+        self.url = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen(self._args, stdout=subprocess.PIPE,
+                                         text=True)
+        # The child prints its URL once it is listening
+        line = self._process.stdout.readline()
+        if not line:
+            self._process.wait()
+            raise RuntimeError('Fake OPUS server failed to start')
+        self.url = line.split()[-1]
+        return self
+
+    def __exit__(self, *args):
+        self._process.terminate()
+        self._process.wait()
+        self._process.stdout.close()
+
+    @property
+    def num_requests(self):
+        """Return the number of requests the server has answered."""
+        with urlopen(self.url + '/stats.json') as r:
+            return json.load(r)['num_requests']
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a fake OPUS API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--latency', type=float, default=0.)
+    parser.add_argument('--max-page-size', type=int, default=1000)
+    args = parser.parse_args()
+    server = FakeOPUSServer(num_rows=args.rows, latency=args.latency,
+                            max_page_size=args.max_page_size,
+                            host=args.host, port=args.port)
+    print(f'Serving fake OPUS API at {server.url}', flush=True)
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
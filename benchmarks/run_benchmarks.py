@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the OPUS API client run against a local fake OPUS server.
+
+Usage:
+
+    python benchmarks/run_benchmarks.py [--rows N] [--latency SECS]
+                                        [--page-size N] [--workers N]
+                                        [--json]
+
+Each benchmark reports its wall-clock time, rows/s and requests/s (where
+meaningful) and the peak memory allocated by Python while it ran. The fake
+server runs in a child process so these only measure the client.
+"""
+
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from opusapi import OPUSAPI, Query, MultQuery, OR, RangeQuery, StringQuery
+
+from fake_opus_server import FakeOPUSServerProcess
+
+_METADATA_FIELDS = ['opusid', 'time1', 'observationduration', 'target',
+                    'levels', 'volumeid']
+
+def _measure(name, func, server=None, rows=None, repeat=1, count_rows=False):
+    """Run func repeat times and return a result dict.
+
+    If count_rows is True, func returns the number of rows it processed.
+    """
+    gc.collect()
+    start_requests = 0 if server is None else server.num_requests
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        ret = func()
+    elapsed = time.perf_counter() - start_time
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if count_rows:
+        rows = ret
+    result = {'name': name,
+              'seconds': elapsed,
+              'calls_per_sec': repeat / elapsed if elapsed > 0 else None,
+              'rows_per_sec': None,
+              'requests_per_sec': None,
+              'peak_mb': peak / 1024 / 1024}
+    if rows is not None and elapsed > 0:
+        result['rows_per_sec'] = rows * repeat / elapsed
+    if server is not None and elapsed > 0:
+        result['requests_per_sec'] = ((server.num_requests-start_requests) /
+                                      elapsed)
+    return result
+
+def bench_paging(server, page_size, workers):
+    api = OPUSAPI(server=server.url)
+    api.raw_fields
+    results = []
+    def _serial():
+        return sum(1 for _ in api.get_metadata(fields=_METADATA_FIELDS,
+                                               paging_limit=page_size))
+    results.append(_measure('paging serial', _serial, server=server,
+                            count_rows=True))
+    def _prefetch():
+        return sum(1 for _ in api.get_metadata(fields=_METADATA_FIELDS,
+                                               paging_limit=page_size,
+                                               max_workers=workers))
+    results.append(_measure(f'paging max_workers={workers}', _prefetch,
+                            server=server, count_rows=True))
+    def _files():
+        return sum(1 for _ in api.get_files(paging_limit=page_size))
+    results.append(_measure('paging files.json', _files, server=server,
+                            count_rows=True))
+    return results
+
+def bench_fields(server):
+    api = OPUSAPI(server=server.url)
+    raw_fields = api.raw_fields
+    def _fields():
+        new_api = OPUSAPI(server=server.url)
+        new_api._raw_fields_cache = raw_fields
+        new_api.fields
+        return len(new_api.fields)
+    def _fields_as_df():
+        new_api = OPUSAPI(server=server.url)
+        new_api._raw_fields_cache = raw_fields
+        return len(new_api.fields_as_df)
+    def _download_fields():
+        return len(OPUSAPI(server=server.url).raw_fields)
+    return [_measure('fields.json download+parse', _download_fields,
+                     server=server, repeat=5),
+            _measure('_get_fields/fields', _fields, repeat=20),
+            _measure('fields_as_df', _fields_as_df, repeat=20)]
+
+def bench_query(server):
+    api = OPUSAPI(server=server.url)
+    api.fields
+    query = Query(MultQuery('target', ['SATURN', 'TITAN', 'RHEA']),
+                  RangeQuery('observationduration', 1, 100),
+                  OR(StringQuery('volumeid', 'COISS_2001'),
+                     StringQuery('volumeid', 'COISS_2002'),
+                     StringQuery('volumeid', 'COISS_2003')))
+    compiled = query.compile(opusapi=api)
+    def _params():
+        return len(query.get_api_params(opusapi=api))
+    def _compiled_params():
+        return len(compiled.get_api_params(opusapi=api))
+    return [_measure('Query.get_api_params', _params, repeat=10000),
+            _measure('CompiledQuery.get_api_params', _compiled_params,
+                     repeat=10000)]
+
+def bench_dataframe(server, page_size):
+    api = OPUSAPI(server=server.url)
+    api.fields
+    page = list(api.get_metadata(fields=_METADATA_FIELDS, limit=page_size,
+                                 paging_limit=page_size))
+    def _convert():
+        return len(api._convert_metadata_page(page, _METADATA_FIELDS))
+    def _get_df():
+        return len(api.get_metadata_df(fields=_METADATA_FIELDS,
+                                       paging_limit=page_size))
+    return [_measure(f'convert {len(page)}-row page', _convert,
+                     rows=len(page), repeat=20),
+            _measure('get_metadata_df', _get_df, server=server,
+                     count_rows=True)]
+
+def _format(val, fmt):
+    if val is None:
+        return format('-', '>'+fmt.split('.')[0])
+    return format(val, fmt)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run OPUS API benchmarks')
+    parser.add_argument('--rows', type=int, default=20000,
+                        help='number of synthetic observations')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='fake server latency per request in seconds')
+    parser.add_argument('--page-size', type=int, default=500)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON')
+    args = parser.parse_args()
+
+    with FakeOPUSServerProcess(num_rows=args.rows, latency=args.latency,
+                               max_page_size=max(1000, args.page_size)) \
+            as server:
+        results = []
+        results += bench_paging(server, args.page_size, args.workers)
+        results += bench_fields(server)
+        results += bench_query(server)
+        results += bench_dataframe(server, args.page_size)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"benchmark":36s} {"seconds":>9s} {"calls/s":>10s} '
+          f'{"rows/s":>11s} {"requests/s":>11s} {"peak MB":>8s}')
+    for result in results:
+        print(f'{result["name"]:36s} {result["seconds"]:9.3f} '
+              f'{_format(result["calls_per_sec"], "10.1f")} '
+              f'{_format(result["rows_per_sec"], "11.0f")} '
+              f'{_format(result["requests_per_sec"], "11.1f")} '
+              f'{result["peak_mb"]:8.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,25 @@
+from opusapi.transport import *
+from opusapi.fieldcache import *
+from opusapi.cache import *
+from opusapi.metrics import *
+from opusapi.governor import *
+from opusapi.download import *
+from opusapi.imagestack import *
+from opusapi.paging import *
 from opusapi.opusapiraw import *
 from opusapi.opusapi import *
 from opusapi.query import *
+from opusapi.resultset import *
+from opusapi.units import *
+from opusapi.shard import *
+from opusapi.planner import *
+from opusapi.mirror import *
+from opusapi.harvest import *
+
+def __getattr__(name):
+    # The async client needs aiohttp, which the rest of the package doesn't,
+    # so it is only imported when it is first used
+    if name in ('AsyncOPUSAPI', 'hide_paging_async'):
+        from opusapi import asyncopusapi
+        return getattr(asyncopusapi, name)
+    raise AttributeError(f"module 'opusapi' has no attribute '{name}'")
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+"""
+AsyncOPUSAPI class
+"""
+
+import asyncio
+from collections import deque
+from functools import wraps
+import warnings
+
+import aiohttp
+
+from .fieldcache import FieldCache
+from .opusapi import OPUSAPI
+
+_DEFAULT_MAX_CONCURRENCY = 10
+_DEFAULT_CONNECT_TIMEOUT = 10.
+_DEFAULT_READ_TIMEOUT = 120.
+
+async def _fetch_pages_async(self, method, query, startobs, limit,
+                             paging_limit, prefetch_pages, method_kwargs):
+    """Fetch pages as tasks on the event loop but yield them in order.
+
+    If prefetch_pages is None the pages are fetched one after another.
+    Otherwise the first page is fetched by itself to learn how many results
+    are available and then at most prefetch_pages of the remaining pages are
+    outstanding at any time. The number of simultaneous HTTP requests is
+    further limited by the client's concurrency semaphore.
+    """
+    page_limit = paging_limit
+    if limit is not None:
+        page_limit = min(paging_limit, limit)
+    ret = await method(self, query, startobs, page_limit, **method_kwargs)
+    yield ret
+    returned_count = ret['count']
+    if returned_count == 0:
+        return
+
+    if prefetch_pages is None:
+        count = returned_count
+        startobs += returned_count
+        while ((limit is None or count < limit) and
+               startobs <= ret['available']):
+            page_limit = paging_limit
+            if limit is not None:
+                page_limit = min(paging_limit, limit-count)
+            ret = await method(self, query, startobs, page_limit,
+                               **method_kwargs)
+            yield ret
+            returned_count = ret['count']
+            if returned_count == 0:
+                return
+            count += returned_count
+            startobs += returned_count
+        return
+
+    last_obs = ret['available']
+    if limit is not None:
+        last_obs = min(last_obs, startobs+limit-1)
+    step = min(paging_limit, returned_count)
+    offsets = iter(range(startobs+returned_count, last_obs+1, step))
+
+    pending = deque()
+    def _submit(next_startobs):
+        page_limit = min(step, last_obs-next_startobs+1)
+        pending.append((next_startobs, page_limit, asyncio.ensure_future(
+            method(self, query, next_startobs, page_limit, **method_kwargs))))
+    try:
+        for next_startobs in offsets:
+            _submit(next_startobs)
+            if len(pending) >= prefetch_pages:
+                break
+        while pending:
+            page_startobs, page_limit, task = pending.popleft()
+            ret = await task
+            next_startobs = next(offsets, None)
+            if next_startobs is not None:
+                _submit(next_startobs)
+            yield ret
+            # Fill in the rest of a short page's window (see
+            # _fetch_pages_prefetch)
+            returned_count = ret['count']
+            while returned_count < page_limit:
+                page_startobs += returned_count
+                page_limit -= returned_count
+                if returned_count == 0 or page_startobs > ret['available']:
+                    return
+                ret = await method(self, query, page_startobs, page_limit,
+                                   **method_kwargs)
+                yield ret
+                returned_count = ret['count']
+    finally:
+        for _, _, task in pending:
+            task.cancel()
+        # Let the cancelled tasks finish so none are left pending
+        await asyncio.gather(*[task for _, _, task in pending],
+                             return_exceptions=True)
+
+def hide_paging_async(data_name):
+    """Automatically retrieve pages from OPUS and yield them in one async
+    stream.
+
+    The decorated coroutine accepts these additional keyword arguments:
+
+        paging_limit    The number of results to request per page
+                        (defaults to 100).
+        prefetch_pages  If specified, the maximum number of pages that may be
+                        outstanding at once. Results are still yielded in
+                        order.
+    """
+    def _hide_paging(method):
+        @wraps(method)
+        async def _impl(self, query=None, startobs=1, limit=None,
+                        paging_limit=100, prefetch_pages=None,
+                        **method_kwargs):
+            if startobs < 1:
+                raise ValueError
+            if limit is not None and limit < 1:
+                raise ValueError
+            if paging_limit is None:
+                paging_limit = 100
+            if paging_limit < 1:
+                raise ValueError
+            if prefetch_pages is not None and prefetch_pages < 1:
+                raise ValueError
+            await self.load_fields()
+            if query is not None:
+                query = query.compile(opusapi=self)
+            pages = _fetch_pages_async(self, method, query, startobs, limit,
+                                       paging_limit, prefetch_pages,
+                                       method_kwargs)
+            count = 0
+            try:
+                async for ret in pages:
+                    data = ret[data_name]
+                    if isinstance(data, dict):
+                        # For files.json and images.json
+                        for opusid, fields in data.items():
+                            yield {opusid: fields}
+                            count += 1
+                            if limit is not None and count >= limit:
+                                break
+                    else:
+                        # For data.json
+                        for datum in data:
+                            yield datum
+                            count += 1
+                            if limit is not None and count >= limit:
+                                break
+                    if limit is not None and count >= limit:
+                        break
+            finally:
+                await pages.aclose()
+        return _impl
+    return _hide_paging
+
+class AsyncOPUSAPI(object):
+    """AsyncOPUSAPI is an asyncio-native version of OPUSAPI.
+
+       All API calls are coroutines and all paged calls are async generators,
+       so many independent searches can be multiplexed on one event loop.
+       The number of simultaneous HTTP requests made by one client is limited
+       by a semaphore. Only the calls below are provided; use OPUSAPI for
+       the others (DataFrames, exports, downloads, etc.).
+
+       The field properties (fields, fields_as_df, etc.) are the same as in
+       OPUSAPI, but the fields must be loaded with "await load_fields()"
+       before they are used. All coroutines below load the fields as needed.
+
+       The client should be closed with "await close()" or used as an
+       "async with" context manager.
+    """
+    def __init__(self, server=None, default_fields=None, verbose=False,
+                 max_concurrency=None, session=None, connect_timeout=None,
+                 read_timeout=None, field_cache=None):
+        """Constructor for the AsyncOPUSAPI class.
+
+        :param server: If specified, will override the OPUS API server to talk
+            to (defaults to opus.pds-rings.seti.org).
+        :param default_fields: If specified, will override the default metadata
+            fields to return if none of specified in future method calls
+            (defaults to ['opusid']).
+        :param verbose: If specified, provides verbose debugging output.
+        :param max_concurrency: If specified, the maximum number of HTTP
+            requests this client will have outstanding at once
+            (defaults to 10).
+        :param session: If specified, the aiohttp.ClientSession to use. A
+            session passed in this way is not closed by close().
+        :param connect_timeout: If specified, the timeout in seconds to
+            establish a connection (defaults to 10).
+        :param read_timeout: If specified, the timeout in seconds to wait for
+            data from the server (defaults to 120).
+        :param field_cache: If specified, a FieldCache used to keep the OPUS
+            field registry on disk so that it is shared between processes.
+        """
+        # The field registry is kept by an OPUSAPI that never makes HTTP
+        # requests itself; its fields are always loaded by load_fields
+        self._registry = OPUSAPI(server=server,
+                                 default_fields=default_fields,
+                                 verbose=verbose,
+                                 field_cache=field_cache)
+        self._server = self._registry._server
+        self._verbose = verbose
+        if max_concurrency is None:
+            max_concurrency = _DEFAULT_MAX_CONCURRENCY
+        if max_concurrency < 1:
+            raise ValueError
+        if connect_timeout is None:
+            connect_timeout = _DEFAULT_CONNECT_TIMEOUT
+        if read_timeout is None:
+            read_timeout = _DEFAULT_READ_TIMEOUT
+        self._max_concurrency = max_concurrency
+        self._session = session
+        self._owns_session = session is None
+        self._timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout,
+                                              sock_read=read_timeout)
+        self._semaphore = None
+        self._fields_lock = None
+
+    def __str__(self):
+        return self._server
+
+    def __repr__(self):
+        return 'AsyncOPUSAPI for server '+self._server
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Close the underlying HTTP session if it is owned by this client."""
+        if self._session is not None and self._owns_session:
+            await self._session.close()
+            self._session = None
+
+    async def _call_opus_api_async_response(self, endpoint, return_format,
+                                            params={}, headers=None):
+        """Make a call to the OPUS sever and return the status, headers and
+        decoded body (None for a 304 response)."""
+        if self._semaphore is None:
+            # Created here so they are bound to the running event loop
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=self._timeout)
+        request_url = self._server+'/api/'+endpoint+'.'+return_format
+        if params is not None:
+            params = {key: str(val) for key, val in params.items()}
+        if self._verbose:
+            print(f'OPUSAPI request {request_url} params {params}')
+        async with self._semaphore:
+            async with self._session.get(request_url, params=params,
+                                         headers=headers) as r:
+                if r.status >= 400:
+                    raise RuntimeError(f'OPUSAPI request failed: {request_url} ' +
+                                       f' with params {params}')
+                if r.status == 304:
+                    return r.status, r.headers, None
+                return r.status, r.headers, await r.json(content_type=None)
+
+    async def _call_opus_api_async(self, endpoint, return_format, params={}):
+        """Make a call to the OPUS sever for a specific endpoint."""
+        _, _, res = await self._call_opus_api_async_response(
+                                        endpoint, return_format, params=params)
+        return res
+
+    async def _load_raw_fields_async(self):
+        """Retrieve the raw fields, using the field cache if there is one."""
+        registry = self._registry
+        field_cache = registry.field_cache
+        if field_cache is None:
+            fields_json = await self._call_opus_api_async('fields', 'json')
+            return registry._clean_raw_fields(fields_json['data'])
+
+        entry = field_cache.load(self._server)
+        if entry is not None and field_cache.is_fresh(entry):
+            registry._field_cache_entry = entry
+            return entry['raw_fields']
+
+        try:
+            status, headers, fields_json = \
+                await self._call_opus_api_async_response(
+                        'fields', 'json',
+                        headers=FieldCache.validation_headers(entry))
+        except (RuntimeError, aiohttp.ClientError, asyncio.TimeoutError):
+            if entry is None:
+                raise
+            warnings.warn('Unable to revalidate OPUS fields; using stale '
+                          'cached copy')
+            registry._field_cache_entry = entry
+            return entry['raw_fields']
+
+        if status == 304 and entry is not None:
+            try:
+                entry = field_cache.touch(entry)
+            except OSError as e:
+                warnings.warn(f'Unable to update OPUS field cache: {e}')
+            registry._field_cache_entry = entry
+            return entry['raw_fields']
+
+        fields_ret = registry._clean_raw_fields(fields_json['data'])
+        try:
+            registry._field_cache_entry = field_cache.store(
+                                            self._server, fields_ret,
+                                            headers=headers)
+        except OSError as e:
+            warnings.warn(f'Unable to update OPUS field cache: {e}')
+        return fields_ret
+
+    async def load_fields(self):
+        """Retrieve the set of OPUS fields if they are not already loaded."""
+        if self._registry._raw_fields_cache is not None:
+            return
+        if self._fields_lock is None:
+            self._fields_lock = asyncio.Lock()
+        async with self._fields_lock:
+            if self._registry._raw_fields_cache is not None:
+                return
+            self._registry._raw_fields_cache = \
+                await self._load_raw_fields_async()
+
+    def _loaded_registry(self):
+        """Return the field registry, which must already be loaded."""
+        if self._registry._raw_fields_cache is None:
+            raise RuntimeError('OPUS fields are not loaded; call '
+                               '"await load_fields()" first')
+        return self._registry
+
+    @property
+    def field_cache(self):
+        """Return the FieldCache or None if there isn't one."""
+        return self._registry.field_cache
+
+    @property
+    def default_fields(self):
+        return self._registry.default_fields
+
+    @property
+    def raw_fields(self):
+        """Return the raw set of OPUS fields as a dict indexed by fieldid."""
+        return self._loaded_registry().raw_fields
+
+    @property
+    def raw_fields_as_df(self):
+        """Return the raw set of OPUS fields as a DataFrame indexed by fieldid."""
+        return self._loaded_registry().raw_fields_as_df
+
+    @property
+    def fields(self):
+        """Return the analyzed set of OPUS fields as a dict indexed by fieldid."""
+        return self._loaded_registry().fields
+
+    @property
+    def fields_as_df(self):
+        """Return the analyzed set of OPUS fields as a DataFrame indexed by fieldid."""
+        return self._loaded_registry().fields_as_df
+
+    @property
+    def surfacegeo_targets(self):
+        """Return the list of targets that surface geometry is available for."""
+        return self._loaded_registry().surfacegeo_targets
+
+    @property
+    def surfacegeo_fields(self):
+        """Return the available surface geometry metadata fields."""
+        return self._loaded_registry().surfacegeo_fields
+
+    @property
+    def surfacegeo_fields_as_df(self):
+        """Return the available surface geometry metadata fields."""
+        return self._loaded_registry().surfacegeo_fields_as_df
+
+    @property
+    def unit_converter(self):
+        """Return a UnitConverter for the units in the OPUS field registry."""
+        return self._loaded_registry().unit_converter
+
+    def make_surfacegeo_field(self, target, field_root):
+        """Construct a fieldid from a target name and fieldid root."""
+        return self._loaded_registry().make_surfacegeo_field(target,
+                                                             field_root)
+
+    def _normalize_fields(self, fields):
+        return self._loaded_registry()._normalize_fields(fields)
+
+    def _normalize_product_types(self, product_types):
+        return self._registry._normalize_product_types(product_types)
+
+    async def _get_query_params(self, query):
+        if query is None:
+            return None
+        await self.load_fields()
+        return query.get_api_params(opusapi=self)
+
+    ### Meta API Calls
+
+    async def get_count_raw(self, query=None):
+        """Return the raw result count from a search."""
+        params = await self._get_query_params(query)
+        res = await self._call_opus_api_async('meta/result_count', 'json',
+                                              params=params)
+        return res['data']
+
+    async def get_mults_raw(self, fieldid, query=None):
+        """Return the available values from a multiple choice field along with
+        their result count from a search."""
+        params = await self._get_query_params(query)
+        res = await self._call_opus_api_async('meta/mults/'+fieldid, 'json',
+                                              params=params)
+        return res['mults']
+
+    async def get_range_endpoints_raw(self, fieldid, query=None):
+        """Return the endpoints for a range based on a search."""
+        params = await self._get_query_params(query)
+        res = await self._call_opus_api_async('meta/range/endpoints/'+fieldid,
+                                              'json', params=params)
+        return res
+
+    async def get_count(self, query=None):
+        """Return the result count from a search."""
+        res = await self.get_count_raw(query)
+        return int(res[0]['result_count'])
+
+    async def get_mults(self, fieldid, query=None):
+        """Return the available values from a multiple choice field along with
+        their result count from a search."""
+        await self.load_fields()
+        if fieldid not in self.fields:
+            raise RuntimeError(f'Field id "{fieldid}" unknown')
+        if self.fields[fieldid]['type'] != 'multiple':
+            raise RuntimeError(f'Field id "{fieldid}" is not type "multiple"')
+        return await self.get_mults_raw(fieldid, query=query)
+
+    async def get_range_endpoints(self, fieldid, query=None):
+        """Return the endpoints for a range based on a search."""
+        await self.load_fields()
+        if fieldid not in self.fields:
+            raise RuntimeError(f'Field id "{fieldid}" unknown')
+        if not self.fields[fieldid]['type'].startswith('range'):
+            raise RuntimeError(f'Field id "{fieldid}" is not type "range"')
+        res = await self.get_range_endpoints_raw(fieldid, query=query)
+        return res['min'], res['max'], res['nulls'], res['units']
+
+    ### Metadata, Files, Images API Calls
+
+    @hide_paging_async('page')
+    async def get_metadata_raw(self, query, startobs, limit, fields=None):
+        """Return the results of raw calls to data.json as an async generator.
+
+        See OPUSAPIRaw.get_metadata_raw for the format of the results.
+        """
+        params = {} if query is None else query.get_api_params(opusapi=self)
+        params['startobs'] = startobs
+        params['limit'] = limit
+        params['cols'] = self._normalize_fields(fields)
+        return await self._call_opus_api_async('data', 'json', params=params)
+
+    @hide_paging_async('data')
+    async def get_files_raw(self, query, startobs, limit, product_types=None):
+        """Return the results of raw calls to files.json as an async
+        generator.
+
+        See OPUSAPIRaw.get_files_raw for the format of the results.
+        """
+        params = {} if query is None else query.get_api_params(opusapi=self)
+        params['startobs'] = startobs
+        params['limit'] = limit
+        types = self._normalize_product_types(product_types)
+        if types is not None:
+            params['types'] = types
+        return await self._call_opus_api_async('files', 'json', params=params)
+
+    @hide_paging_async('data')
+    async def get_images_raw(self, query, startobs, limit, size=None):
+        """Return the results of raw calls to images.json as an async
+        generator.
+
+        See OPUSAPIRaw.get_images_raw for the format of the results.
+        """
+        params = {} if query is None else query.get_api_params(opusapi=self)
+        params['startobs'] = startobs
+        params['limit'] = limit
+        image_url = 'images'
+        if size is not None:
+            size = size.lower()
+            assert size in (None, 'thumb', 'small', 'med', 'full')
+            image_url += '/'+size
+        return await self._call_opus_api_async(image_url, 'json',
+                                               params=params)
+
+    async def get_metadata(self, query=None, startobs=1, limit=None,
+                           paging_limit=None, fields=None,
+                           prefetch_pages=None):
+        """Return the results of calls to data.json as an async generator."""
+        async for row in self.get_metadata_raw(query=query, startobs=startobs,
+                                               limit=limit,
+                                               paging_limit=paging_limit,
+                                               prefetch_pages=prefetch_pages,
+                                               fields=fields):
+            yield row
+
+    async def get_files(self, query=None, startobs=1, limit=None,
+                        paging_limit=None, product_types=None,
+                        prefetch_pages=None):
+        """Return the results of calls to files.json as an async generator."""
+        async for row in self.get_files_raw(query=query, startobs=startobs,
+                                            limit=limit,
+                                            paging_limit=paging_limit,
+                                            prefetch_pages=prefetch_pages,
+                                            product_types=product_types):
+            yield row
+
+    async def get_images(self, query=None, startobs=1, limit=None,
+                         paging_limit=None, size=None, prefetch_pages=None):
+        """Return the results of calls to images.json as an async generator."""
+        async for row in self.get_images_raw(query=query, startobs=startobs,
+                                             limit=limit,
+                                             paging_limit=paging_limit,
+                                             prefetch_pages=prefetch_pages,
+                                             size=size):
+            yield row
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS API response cache classes
+"""
+
+from collections import OrderedDict
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+_DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_DEFAULT_CACHE_TTL = 60 * 60
+
+def canonical_cache_key(server, endpoint, params):
+    """Return the cache key for a call to an endpoint on a server with
+    parameters.
+
+    The server's scheme and host are lowercased and any trailing slash is
+    removed. Parameters are sorted and their values converted to strings so
+    that equivalent searches (e.g. Query(A, B) and Query(B, A)) share a key.
+    """
+    parts = urlsplit(server)
+    server = urlunsplit((parts.scheme.lower(), parts.netloc.lower(),
+                         parts.path.rstrip('/'), '', ''))
+    key = server + '/api/' + endpoint
+    if not params:
+        return key
+    items = sorted((str(name), str(val)) for name, val in params.items())
+    return key + '?' + json.dumps(items, separators=(',', ':'))
+
+class _MemoryCache(object):
+    """A thread-safe LRU of response bodies bounded by their total size."""
+    def __init__(self, max_bytes):
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._num_bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def num_bytes(self):
+        return self._num_bytes
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, body = entry
+            if expires < now:
+                del self._entries[key]
+                self._num_bytes -= len(body)
+                return None
+            self._entries.move_to_end(key)
+            return body
+
+    def put(self, key, body, expires):
+        if len(body) > self._max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._num_bytes -= len(old[1])
+            self._entries[key] = (expires, body)
+            self._num_bytes += len(body)
+            while self._num_bytes > self._max_bytes:
+                _, (_, old_body) = self._entries.popitem(last=False)
+                self._num_bytes -= len(old_body)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._num_bytes = 0
+
+class _SQLiteCache(object):
+    """A response cache stored in an SQLite database on disk.
+
+    Each thread gets its own connection. The database uses write-ahead
+    logging so that multiple threads and processes can share it.
+    """
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        conn = self._connection()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS responses ('
+                         'key TEXT PRIMARY KEY, expires REAL, body BLOB)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        row = self._connection().execute(
+                    'SELECT expires, body FROM responses WHERE key=?',
+                    (key,)).fetchone()
+        if row is None or row[0] < now:
+            return None
+        return row[0], bytes(row[1])
+
+    def put(self, key, body, expires):
+        conn = self._connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO responses VALUES (?,?,?)',
+                         (key, expires, sqlite3.Binary(body)))
+
+    def purge_expired(self, now):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM responses WHERE expires<?', (now,))
+
+    def clear(self):
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM responses')
+
+class ResponseCache(object):
+    """ResponseCache keeps the bodies of OPUS API responses so that repeated
+       calls don't go back to the server.
+
+       There are two tiers: an in-memory LRU bounded by the total size of the
+       cached bodies, and an optional SQLite database on disk that may be
+       shared between processes. Entries expire after a TTL. Responses are
+       keyed by the server, the endpoint and the canonicalized search
+       parameters, so clients of different servers never share entries.
+
+       A ResponseCache may be shared by multiple OPUSAPIRaw instances and
+       threads.
+    """
+    def __init__(self, max_bytes=None, ttl=None, disk_path=None):
+        """Constructor for the ResponseCache class.
+
+        :param max_bytes: If specified, the maximum total size of the response
+            bodies kept in memory (defaults to 64 MB).
+        :param ttl: If specified, the number of seconds a response remains
+            valid (defaults to one hour).
+        :param disk_path: If specified, the path of an SQLite database used as
+            a second cache tier.
+        """
+        self._ttl = _DEFAULT_CACHE_TTL if ttl is None else ttl
+        if max_bytes is None:
+            max_bytes = _DEFAULT_CACHE_MAX_BYTES
+        self._memory = _MemoryCache(max_bytes)
+        self._disk = None if disk_path is None else _SQLiteCache(disk_path)
+        self._stats_lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    def __repr__(self):
+        return (f'ResponseCache(entries={len(self._memory)},'
+                f'bytes={self._memory.num_bytes},ttl={self._ttl})')
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    def get(self, server, endpoint, params):
+        """Return the cached response body for a call or None."""
+        key = canonical_cache_key(server, endpoint, params)
+        now = time.time()
+        body = self._memory.get(key, now)
+        if body is not None:
+            with self._stats_lock:
+                self._memory_hits += 1
+            return body
+        if self._disk is not None:
+            row = self._disk.get(key, now)
+            if row is not None:
+                expires, body = row
+                # Promote to the memory tier for the rest of its lifetime
+                self._memory.put(key, body, expires)
+                with self._stats_lock:
+                    self._disk_hits += 1
+                return body
+        with self._stats_lock:
+            self._misses += 1
+        return None
+
+    def put(self, server, endpoint, params, body):
+        """Cache the response body for a call."""
+        key = canonical_cache_key(server, endpoint, params)
+        expires = time.time() + self._ttl
+        self._memory.put(key, body, expires)
+        if self._disk is not None:
+            self._disk.put(key, body, expires)
+
+    def purge_expired(self):
+        """Remove expired entries from the disk tier."""
+        if self._disk is not None:
+            self._disk.purge_expired(time.time())
+
+    def clear(self):
+        """Remove all entries from both tiers and reset the statistics."""
+        self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+        with self._stats_lock:
+            self._memory_hits = 0
+            self._disk_hits = 0
+            self._misses = 0
+
+    @property
+    def stats(self):
+        """Return the cache hit and miss statistics as a dict."""
+        with self._stats_lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {'hits': hits,
+                    'memory_hits': self._memory_hits,
+                    'disk_hits': self._disk_hits,
+                    'misses': self._misses,
+                    'hit_rate': 0. if lookups == 0 else hits / lookups,
+                    'entries': len(self._memory),
+                    'bytes': self._memory.num_bytes,
+                    'evictions': self._memory.evictions}
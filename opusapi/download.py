@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS product download classes
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+from .transport import Transport
+
+_DEFAULT_DOWNLOAD_WORKERS = 4
+_DEFAULT_CHUNK_SIZE = 1024 * 1024
+_DEFAULT_PROGRESS_INTERVAL = 1.
+_PARTIAL_SUFFIX = '.part'
+
+# Ranges only make sense on the bytes as stored, so never let the server
+# compress product files on the fly
+_DOWNLOAD_HEADERS = {'Accept-Encoding': 'identity'}
+
+def _content_range_start(value):
+    """Return the first byte position of a Content-Range header or None."""
+    # e.g. "bytes 1000-4999/5000"
+    if value is None:
+        return None
+    unit, _, byte_range = value.strip().partition(' ')
+    if unit.lower() != 'bytes':
+        return None
+    try:
+        return int(byte_range.partition('-')[0])
+    except ValueError:
+        return None
+
+class DownloadProgress(object):
+    """A snapshot of the state of a ProductDownloader run."""
+    def __init__(self):
+        self.start_time = time.time()
+        self.files_queued = 0
+        self.files_done = 0
+        self.files_skipped = 0
+        self.files_resumed = 0
+        self.files_failed = 0
+        self.bytes_done = 0
+        self.failures = []
+
+    def __repr__(self):
+        return (f'DownloadProgress(files_done={self.files_done},'
+                f'files_skipped={self.files_skipped},'
+                f'files_failed={self.files_failed},'
+                f'files_queued={self.files_queued},'
+                f'bytes_done={self.bytes_done},'
+                f'bytes_per_second={self.bytes_per_second:.0f})')
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    @property
+    def bytes_per_second(self):
+        elapsed = self.elapsed
+        return 0. if elapsed <= 0 else self.bytes_done / elapsed
+
+    @property
+    def files_per_second(self):
+        elapsed = self.elapsed
+        return 0. if elapsed <= 0 else self.files_done / elapsed
+
+class ProductDownloader(object):
+    """ProductDownloader fetches files from URLs to local paths using a pool
+       of worker threads.
+
+       Files are streamed to a ".part" file next to the destination and
+       renamed into place when complete. If a ".part" file already exists
+       the download is resumed with an HTTP Range request; if the server
+       answers with a different range the file is downloaded from the start.
+       Destination files that already exist with the size reported by the
+       server are skipped.
+    """
+    def __init__(self, transport=None, max_workers=None, chunk_size=None,
+                 progress=None, progress_interval=None, max_queued=None):
+        """Constructor for the ProductDownloader class.
+
+        :param transport: If specified, the Transport to use for HTTP
+            requests. Its pool_maxsize should be at least max_workers.
+        :param max_workers: If specified, the number of files to download at
+            once (defaults to 4).
+        :param chunk_size: If specified, the number of bytes to read from the
+            network and write to disk at a time (defaults to 1 MB).
+        :param progress: If specified, a function called with a
+            DownloadProgress periodically and when the run is finished.
+        :param progress_interval: If specified, the minimum number of seconds
+            between calls to progress (defaults to 1).
+        :param max_queued: If specified, the maximum number of files waiting
+            to be downloaded before download() stops reading its input
+            (defaults to four times max_workers).
+        """
+        if max_workers is None:
+            max_workers = _DEFAULT_DOWNLOAD_WORKERS
+        if max_workers < 1:
+            raise ValueError
+        if transport is None:
+            transport = Transport(pool_maxsize=max_workers)
+        self._transport = transport
+        self._max_workers = max_workers
+        self._chunk_size = (_DEFAULT_CHUNK_SIZE if chunk_size is None
+                                                else chunk_size)
+        self._progress = progress
+        self._progress_interval = (_DEFAULT_PROGRESS_INTERVAL
+                                   if progress_interval is None
+                                   else progress_interval)
+        self._max_queued = max_workers*4 if max_queued is None else max_queued
+        self._lock = threading.Lock()
+        self._state = None
+        self._last_report = 0.
+
+    def _report(self, force=False):
+        if self._progress is None:
+            return
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_report < self._progress_interval:
+                return
+            self._last_report = now
+        self._progress(self._state)
+
+    def _add_bytes(self, num_bytes):
+        with self._lock:
+            self._state.bytes_done += num_bytes
+        self._report()
+
+    def _remote_size(self, url):
+        r = self._transport.head(url, headers=_DOWNLOAD_HEADERS)
+        if not r.ok:
+            return None
+        length = r.headers.get('Content-Length')
+        return None if length is None else int(length)
+
+    def download_one(self, url, dest):
+        """Download one URL to a local path.
+
+        Returns 'skipped', 'resumed' or 'downloaded'. Raises RuntimeError if
+        the server fails the request or the size doesn't match.
+        """
+        remote_size = self._remote_size(url)
+        if (remote_size is not None and os.path.exists(dest) and
+            os.path.getsize(dest) == remote_size):
+            return 'skipped'
+
+        directory = os.path.dirname(dest)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        part_path = dest + _PARTIAL_SUFFIX
+        offset = 0
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if remote_size is not None and offset > remote_size:
+                offset = 0
+
+        headers = dict(_DOWNLOAD_HEADERS)
+        if offset > 0:
+            if offset == remote_size:
+                os.replace(part_path, dest)
+                return 'resumed'
+            headers['Range'] = f'bytes={offset}-'
+        r = self._transport.get(url, headers=headers, stream=True)
+        if (r.status_code == 206 and
+            _content_range_start(r.headers.get('Content-Range')) != offset):
+            # Appending a range that doesn't start where the partial file
+            # ends would corrupt it, so start over
+            r.close()
+            offset = 0
+            r = self._transport.get(url, headers=_DOWNLOAD_HEADERS,
+                                    stream=True)
+        try:
+            if r.status_code == 206 and offset > 0:
+                mode = 'ab'
+                result = 'resumed'
+            elif r.ok:
+                # The server ignored the range, so start over
+                mode = 'wb'
+                offset = 0
+                result = 'downloaded'
+            else:
+                raise RuntimeError(f'Download failed: {url} '
+                                   f'status {r.status_code}')
+            size = offset
+            with open(part_path, mode) as fp:
+                for chunk in r.iter_content(chunk_size=self._chunk_size):
+                    fp.write(chunk)
+                    size += len(chunk)
+                    if self._state is not None:
+                        self._add_bytes(len(chunk))
+        finally:
+            r.close()
+
+        if remote_size is not None and size != remote_size:
+            raise RuntimeError(f'Download incomplete: {url} '
+                               f'({size} of {remote_size} bytes)')
+        os.replace(part_path, dest)
+        return result
+
+    def _download_task(self, url, dest):
+        try:
+            result = self.download_one(url, dest)
+        except Exception as e:
+            # Anything that goes wrong with one file is recorded so the rest
+            # of the run continues and the failure is reported
+            with self._lock:
+                self._state.files_failed += 1
+                self._state.failures.append((url, dest, str(e)))
+        else:
+            with self._lock:
+                if result == 'skipped':
+                    self._state.files_skipped += 1
+                else:
+                    self._state.files_done += 1
+                    if result == 'resumed':
+                        self._state.files_resumed += 1
+        self._report()
+
+    def download(self, urls_and_dests):
+        """Download (url, dest) pairs from an iterable using the worker pool.
+
+        The iterable is consumed lazily, so it may be a generator that is
+        still retrieving results from OPUS. Failed files are recorded in the
+        returned DownloadProgress instead of stopping the run; running the
+        same download again resumes or skips the files that already exist.
+        """
+        self._state = DownloadProgress()
+        self._last_report = 0.
+        slots = threading.BoundedSemaphore(self._max_queued)
+        def _release(future):
+            slots.release()
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            for url, dest in urls_and_dests:
+                slots.acquire()
+                with self._lock:
+                    self._state.files_queued += 1
+                future = executor.submit(self._download_task, url, dest)
+                future.add_done_callback(_release)
+        self._report(force=True)
+        return self._state
+
+def product_dest_path(dest, opusid, url):
+    """Return the local path for a product URL: dest/opusid/filename."""
+    filename = os.path.basename(urlparse(url).path)
+    return os.path.join(dest, opusid, filename)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS field registry disk cache
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+
+# Increment this whenever the format of a cache entry changes so that old
+# files are ignored instead of misinterpreted
+_FIELD_CACHE_VERSION = 2
+_DEFAULT_FIELD_CACHE_TTL = 24 * 60 * 60
+
+def _default_field_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME',
+                                os.path.join(os.path.expanduser('~'),
+                                             '.cache'))
+    return os.path.join(cache_home, 'opusapi')
+
+class FieldCache(object):
+    """FieldCache keeps the contents of fields.json on disk so that new
+       processes don't have to download and reparse it.
+
+       There is one cache file per OPUS server. Each file holds the raw field
+       registry, a digest of its contents and the HTTP validators (ETag and
+       Last-Modified) returned with it. Entries younger than the TTL are used
+       as-is; older entries are revalidated with a conditional request and
+       only downloaded again if the server reports a change.
+
+       Structures derived from the raw fields (such as the analyzed fields)
+       are kept in a separate file per name, tagged with the digest of the
+       raw fields they were derived from, so they are never written back
+       over the raw entry and are ignored once the raw fields change.
+
+       Files are written to a temporary name and atomically renamed into
+       place, so any number of processes may read and refresh the cache at
+       the same time.
+    """
+    def __init__(self, directory=None, ttl=None):
+        """Constructor for the FieldCache class.
+
+        :param directory: If specified, the directory to hold the cache files
+            (defaults to $XDG_CACHE_HOME/opusapi or ~/.cache/opusapi).
+        :param ttl: If specified, the number of seconds a cache entry is used
+            without revalidating it with the server (defaults to one day).
+        """
+        self._directory = (_default_field_cache_dir() if directory is None
+                                                      else directory)
+        self._ttl = _DEFAULT_FIELD_CACHE_TTL if ttl is None else ttl
+
+    def __repr__(self):
+        return f'FieldCache({repr(self._directory)},ttl={self._ttl})'
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def ttl(self):
+        return self._ttl
+
+    @staticmethod
+    def _server_hash(server):
+        return hashlib.sha1(server.encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, server):
+        return os.path.join(self._directory,
+                            f'fields-{self._server_hash(server)}'
+                            f'.v{_FIELD_CACHE_VERSION}.pickle')
+
+    def _derived_path(self, server, name):
+        return os.path.join(self._directory,
+                            f'fields-{self._server_hash(server)}'
+                            f'.v{_FIELD_CACHE_VERSION}.{name}.pickle')
+
+    @staticmethod
+    def _digest(raw_fields):
+        return hashlib.sha1(json.dumps(raw_fields, sort_keys=True)
+                            .encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, 'rb') as fp:
+                return pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError,
+                AttributeError, ImportError):
+            return None
+
+    def load(self, server):
+        """Return the cache entry for a server or None if there isn't a
+        usable one."""
+        entry = self._read(self._path(server))
+        if (not isinstance(entry, dict) or
+            entry.get('version') != _FIELD_CACHE_VERSION or
+            entry.get('server') != server):
+            return None
+        return entry
+
+    def is_fresh(self, entry):
+        """Return True if an entry may be used without revalidation."""
+        return time.time() - entry['fetched'] < self._ttl
+
+    @staticmethod
+    def validation_headers(entry):
+        """Return the headers to make a conditional request for an entry."""
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get('etag') is not None:
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified') is not None:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def _write(self, path, data):
+        os.makedirs(self._directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self._directory,
+                                        prefix='.fields-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def store(self, server, raw_fields, headers=None):
+        """Store a newly downloaded field registry and return its entry."""
+        headers = {} if headers is None else headers
+        entry = {'version': _FIELD_CACHE_VERSION,
+                 'server': server,
+                 'fetched': time.time(),
+                 'digest': self._digest(raw_fields),
+                 'etag': headers.get('ETag'),
+                 'last_modified': headers.get('Last-Modified'),
+                 'raw_fields': raw_fields}
+        self._write(self._path(server), entry)
+        return entry
+
+    def touch(self, entry):
+        """Mark an entry as freshly revalidated and return it.
+
+        If another process has stored a different registry in the meantime,
+        its entry is returned instead and nothing is written.
+        """
+        current = self.load(entry['server'])
+        if current is not None and current['digest'] != entry['digest']:
+            return current
+        entry['fetched'] = time.time()
+        self._write(self._path(entry['server']), entry)
+        return entry
+
+    def load_derived(self, entry, name):
+        """Return a structure derived from an entry's raw fields or None if
+        there isn't one for these raw fields."""
+        derived = self._read(self._derived_path(entry['server'], name))
+        if (not isinstance(derived, dict) or
+            derived.get('digest') != entry['digest']):
+            return None
+        return derived['value']
+
+    def store_derived(self, entry, name, value):
+        """Store a structure derived from an entry's raw fields."""
+        self._write(self._derived_path(entry['server'], name),
+                    {'digest': entry['digest'], 'value': value})
+
+    def clear(self, server):
+        """Remove the cache entry and derived structures for a server."""
+        path = self._path(server)
+        for derived_path in glob.glob(glob.escape(path[:-len('.pickle')]) +
+                                      '.*.pickle'):
+            try:
+                os.unlink(derived_path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS API rate limiting and retry governor class
+"""
+
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+import random
+import threading
+import time
+
+_DEFAULT_MAX_RETRIES = 5
+_DEFAULT_BACKOFF_BASE = 0.5
+_DEFAULT_BACKOFF_MAX = 60.
+_DEFAULT_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class Governor(object):
+    """Governor limits how fast and how many API calls are made and decides
+       how to retry the ones that fail.
+
+       Requests are admitted by a token bucket (a sustained rate with a
+       burst allowance) and a limit on how many may be outstanding at once.
+       Failed requests with a retryable HTTP status or a connection error
+       are retried with exponential backoff and full jitter, up to
+       max_retries times. If the server sends Retry-After, that delay is
+       used instead and all requests through the governor are held until it
+       has passed.
+
+       A Governor is meant to be shared by all of the clients (and threads)
+       talking to the same server so that together they stay under its
+       limits.
+    """
+    def __init__(self, rate=None, burst=None, max_concurrent=None,
+                 max_retries=None, backoff_base=None, backoff_max=None,
+                 retry_statuses=None):
+        """Constructor for the Governor class.
+
+        :param rate: If specified, the sustained number of requests per second
+            to allow. If not specified, the rate isn't limited.
+        :param burst: If specified, the number of requests that may be made at
+            once above the sustained rate (defaults to the rate, but at
+            least 1).
+        :param max_concurrent: If specified, the maximum number of requests
+            outstanding at once.
+        :param max_retries: If specified, the number of times to retry a failed
+            request (defaults to 5).
+        :param backoff_base: If specified, the delay in seconds before the
+            first retry; each later retry doubles it (defaults to 0.5). The
+            actual delay is chosen uniformly between 0 and this.
+        :param backoff_max: If specified, the longest delay in seconds between
+            retries (defaults to 60).
+        :param retry_statuses: If specified, the HTTP statuses to retry
+            (defaults to 429, 500, 502, 503 and 504).
+        """
+        if rate is not None and rate <= 0:
+            raise ValueError
+        self._rate = rate
+        self._burst = max(1., rate if burst is None else burst) if rate else None
+        self._tokens = self._burst
+        self._last_refill = time.monotonic()
+        self._semaphore = (None if max_concurrent is None
+                                else threading.BoundedSemaphore(max_concurrent))
+        self._max_retries = (_DEFAULT_MAX_RETRIES if max_retries is None
+                                                  else max_retries)
+        self._backoff_base = (_DEFAULT_BACKOFF_BASE if backoff_base is None
+                                                    else backoff_base)
+        self._backoff_max = (_DEFAULT_BACKOFF_MAX if backoff_max is None
+                                                  else backoff_max)
+        self._retry_statuses = frozenset(_DEFAULT_RETRY_STATUSES
+                                         if retry_statuses is None
+                                         else retry_statuses)
+        self._lock = threading.Lock()
+        self._blocked_until = 0.
+
+    def __repr__(self):
+        return (f'Governor(rate={self._rate},burst={self._burst},'
+                f'max_retries={self._max_retries})')
+
+    @property
+    def max_retries(self):
+        return self._max_retries
+
+    def _wait_for_token(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._blocked_until - now
+                if wait <= 0 and self._rate is None:
+                    return
+                if wait <= 0:
+                    self._tokens = min(self._burst,
+                                       self._tokens +
+                                       (now-self._last_refill) * self._rate)
+                    self._last_refill = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1-self._tokens) / self._rate
+            time.sleep(wait)
+
+    @contextmanager
+    def slot(self):
+        """Wait until a request may be made and hold a slot while it runs."""
+        self._wait_for_token()
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+        try:
+            yield
+        finally:
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def is_retryable_status(self, status):
+        return status in self._retry_statuses
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Return the delay in seconds from a Retry-After header or None."""
+        if value is None:
+            return None
+        try:
+            return max(0., float(value))
+        except ValueError:
+            pass
+        try:
+            retry_time = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_time is None:
+            return None
+        return max(0., retry_time.timestamp() - time.time())
+
+    def retry_delay(self, attempt, retry_after=None):
+        """Return how long to wait before retry number attempt (starting at
+        0). A Retry-After delay from the server holds all requests through
+        this governor."""
+        if retry_after is not None:
+            delay = min(retry_after, self._backoff_max)
+            with self._lock:
+                self._blocked_until = max(self._blocked_until,
+                                          time.monotonic() + delay)
+            return delay
+        cap = min(self._backoff_max, self._backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS resumable harvest job class
+"""
+
+import json
+import os
+import time
+import warnings
+
+from .query import CompiledQuery
+
+_HARVEST_STATE_VERSION = 1
+_DEFAULT_CHECKPOINT_INTERVAL = 10.
+_HARVEST_KINDS = ('metadata', 'files')
+
+class HarvestJob(object):
+    """HarvestJob pages through the results of a search into a JSON-lines
+       file and can be resumed where it left off after a crash.
+
+       Each line of the sink file is one result: a list of metadata values
+       for kind 'metadata' or {opusid: products} for kind 'files'. Every
+       checkpoint_interval seconds (and at the end) the sink is flushed to
+       disk and a small JSON state file is atomically replaced with the
+       job's definition (the compiled query parameters, fields and product
+       types), the next startobs, the sink's length in bytes, the number of
+       rows written and the result count when the job started.
+
+       Running a job whose state file exists resumes it: the sink is first
+       truncated to the length recorded at the last checkpoint, so rows
+       written after it are fetched and written again exactly once. If the
+       server's result count has changed since the job started a warning is
+       issued, because startobs-based paging may then skip or repeat rows.
+    """
+    def __init__(self, opusapi, state_path, sink_path, query=None,
+                 fields=None, kind='metadata', product_types=None,
+                 paging_limit=None, max_workers=None,
+                 checkpoint_interval=None):
+        """Constructor for the HarvestJob class.
+
+        :param opusapi: The OPUSAPI to use to talk to the server.
+        :param state_path: The path of the JSON state file.
+        :param sink_path: The path of the JSON-lines file to write results to.
+        :param query: If specified, the Query to harvest.
+        :param fields: If specified, the metadata fields to harvest (defaults
+            to the OPUSAPI default fields). Only used for kind 'metadata'.
+        :param kind: 'metadata' to harvest data.json or 'files' to harvest
+            files.json.
+        :param product_types: If specified, the product types to harvest.
+            Only used for kind 'files'.
+        :param paging_limit: If specified, the number of results to retrieve
+            per API call.
+        :param max_workers: If specified, the number of pages to fetch ahead
+            in parallel (see hide_paging).
+        :param checkpoint_interval: If specified, the minimum number of
+            seconds between checkpoints (defaults to 10).
+        """
+        if kind not in _HARVEST_KINDS:
+            raise ValueError
+        self._opusapi = opusapi
+        self._state_path = state_path
+        self._sink_path = sink_path
+        self._query = None if query is None else query.compile(opusapi=opusapi)
+        self._kind = kind
+        self._fields = (opusapi._normalize_fields(fields)
+                        if kind == 'metadata' else None)
+        self._product_types = (None if product_types is None
+                                    else list(product_types))
+        self._paging_limit = paging_limit
+        self._max_workers = max_workers
+        self._checkpoint_interval = (_DEFAULT_CHECKPOINT_INTERVAL
+                                     if checkpoint_interval is None
+                                     else checkpoint_interval)
+
+        definition = self._definition()
+        self._state = self._load_state()
+        if self._state is None:
+            self._state = {'version': _HARVEST_STATE_VERSION,
+                           'definition': definition,
+                           'startobs': 1,
+                           'sink_offset': 0,
+                           'rows': 0,
+                           'available': None,
+                           'done': False}
+        elif self._state['definition'] != definition:
+            raise RuntimeError(f'Harvest state "{state_path}" was created '
+                               'for a different query, fields or kind')
+
+    @classmethod
+    def resume(cls, opusapi, state_path, sink_path, **kwargs):
+        """Recreate a HarvestJob from its state file alone."""
+        with open(state_path, 'r') as fp:
+            definition = json.load(fp)['definition']
+        params = definition['params']
+        return cls(opusapi, state_path, sink_path,
+                   query=None if params is None else CompiledQuery(params),
+                   fields=definition['fields'], kind=definition['kind'],
+                   product_types=definition['product_types'], **kwargs)
+
+    def __repr__(self):
+        return (f'HarvestJob({repr(self._state_path)},'
+                f'{repr(self._sink_path)},rows={self.rows},'
+                f'done={self.done})')
+
+    def _definition(self):
+        return {'kind': self._kind,
+                'params': (None if self._query is None
+                                else self._query.get_api_params()),
+                'fields': self._fields,
+                'product_types': self._product_types}
+
+    def _load_state(self):
+        try:
+            with open(self._state_path, 'r') as fp:
+                state = json.load(fp)
+        except FileNotFoundError:
+            return None
+        if state.get('version') != _HARVEST_STATE_VERSION:
+            raise RuntimeError(f'Harvest state "{self._state_path}" has an '
+                               'unknown version')
+        return state
+
+    def _save_state(self):
+        tmp_path = self._state_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self._state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_path, self._state_path)
+
+    def _checkpoint(self, sink, startobs, rows):
+        sink.flush()
+        os.fsync(sink.fileno())
+        self._state['startobs'] = startobs
+        self._state['rows'] = rows
+        self._state['sink_offset'] = sink.tell()
+        self._save_state()
+
+    @property
+    def done(self):
+        """Return True if the harvest has finished."""
+        return self._state['done']
+
+    @property
+    def rows(self):
+        """Return the number of rows committed to the sink."""
+        return self._state['rows']
+
+    @property
+    def available(self):
+        """Return the result count when the job started or None."""
+        return self._state['available']
+
+    def _pages(self, startobs):
+        if self._kind == 'metadata':
+            return self._opusapi.get_metadata_raw(
+                            query=self._query, startobs=startobs,
+                            paging_limit=self._paging_limit,
+                            max_workers=self._max_workers, by_page=True,
+                            fields=self._fields)
+        return self._opusapi.get_files_raw(
+                        query=self._query, startobs=startobs,
+                        paging_limit=self._paging_limit,
+                        max_workers=self._max_workers, by_page=True,
+                        product_types=self._product_types)
+
+    def run(self):
+        """Run or resume the harvest until it finishes.
+
+        Returns the number of rows committed to the sink.
+        """
+        state = self._state
+        if state['done']:
+            return state['rows']
+
+        available = self._opusapi.get_count(self._query)
+        if state['available'] is None:
+            state['available'] = available
+        elif state['available'] != available:
+            warnings.warn(f'Result count changed from {state["available"]} '
+                          f'to {available} since the harvest started; '
+                          'results may be skipped or repeated')
+
+        sink_size = (os.path.getsize(self._sink_path)
+                     if os.path.exists(self._sink_path) else 0)
+        if sink_size < state['sink_offset']:
+            raise RuntimeError(f'Harvest sink "{self._sink_path}" is shorter '
+                               'than its last checkpoint')
+        mode = 'r+b' if os.path.exists(self._sink_path) else 'wb'
+        with open(self._sink_path, mode) as sink:
+            sink.truncate(state['sink_offset'])
+            sink.seek(state['sink_offset'])
+            startobs = state['startobs']
+            rows = state['rows']
+            last_checkpoint = time.monotonic()
+            for data in self._pages(startobs):
+                if isinstance(data, dict):
+                    # files.json
+                    lines = [json.dumps({opusid: products})
+                             for opusid, products in data.items()]
+                else:
+                    lines = [json.dumps(row) for row in data]
+                if lines:
+                    sink.write(('\n'.join(lines)+'\n').encode('utf-8'))
+                startobs += len(lines)
+                rows += len(lines)
+                now = time.monotonic()
+                if now - last_checkpoint >= self._checkpoint_interval:
+                    self._checkpoint(sink, startobs, rows)
+                    last_checkpoint = now
+            state['done'] = True
+            self._checkpoint(sink, startobs, rows)
+        return rows
+
+    def read_rows(self):
+        """Yield the rows committed to the sink."""
+        with open(self._sink_path, 'rb') as sink:
+            remaining = self._state['sink_offset']
+            for line in sink:
+                if remaining <= 0:
+                    break
+                remaining -= len(line)
+                yield json.loads(line)
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS browse image stack classes
+"""
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import io
+import json
+import multiprocessing
+import os
+import threading
+
+import numpy as np
+import requests
+
+from .transport import Transport
+
+_DEFAULT_IMAGE_WORKERS = 8
+_IMAGE_MODES = ('L', 'RGB')
+
+# Stacks opened by this decode worker process, by path
+_worker_stacks = {}
+
+def image_stack_index_path(path):
+    """Return the path of the OPUS ID index written next to an image stack."""
+    return os.path.splitext(path)[0] + '.opusids.json'
+
+def _decode_into_stack(path, idx, data, mode):
+    """Decode one image and write it into row idx of the stack at path.
+
+    This runs in a decode worker process, which maps the stack itself so
+    the pixels never have to be sent back to the parent.
+    """
+    from PIL import Image
+    stack = _worker_stacks.get(path)
+    if stack is None:
+        stack = np.load(path, mmap_mode='r+')
+        _worker_stacks[path] = stack
+    height, width = stack.shape[1:3]
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert(mode)
+        if image.size != (width, height):
+            image = image.resize((width, height), Image.BILINEAR)
+        stack[idx] = np.asarray(image, dtype=np.uint8)
+
+def load_image_stack(path):
+    """Map an image stack written by ImageStackFetcher without reading it.
+
+    Returns a tuple (stack, opusids): the read-only memory-mapped array and
+    the OPUS ID of each of its rows (None for rows that failed).
+    """
+    stack = np.load(path, mmap_mode='r')
+    with open(image_stack_index_path(path), 'r') as fp:
+        opusids = json.load(fp)
+    return stack, opusids
+
+class ImageStackFetcher(object):
+    """ImageStackFetcher downloads browse images and stores their pixels in
+       a memory-mapped NumPy .npy file of shape (N, height, width) for
+       grayscale or (N, height, width, 3) for RGB, with uint8 pixels.
+
+       Images are downloaded by a pool of threads and decoded (and resized
+       to height x width if needed) by a pool of processes that write
+       straight into the mapped file. The OPUS ID of each row is written to
+       a JSON index next to the stack (see image_stack_index_path). Requires
+       Pillow.
+
+       The decode processes are spawned rather than forked, because forking
+       from the download threads could copy locks held by other threads
+       into the children. As with any spawned process, scripts that fetch
+       stacks must guard their entry point with
+       if __name__ == '__main__'.
+    """
+    def __init__(self, transport=None, max_workers=None, decode_workers=None,
+                 mode='L'):
+        """Constructor for the ImageStackFetcher class.
+
+        :param transport: If specified, the Transport to use for HTTP
+            requests. Its pool_maxsize should be at least max_workers.
+        :param max_workers: If specified, the number of images to download at
+            once (defaults to 8).
+        :param decode_workers: If specified, the number of processes used to
+            decode images (defaults to the number of CPUs).
+        :param mode: 'L' for grayscale (the default) or 'RGB' for color.
+        """
+        if max_workers is None:
+            max_workers = _DEFAULT_IMAGE_WORKERS
+        if max_workers < 1:
+            raise ValueError
+        if mode not in _IMAGE_MODES:
+            raise ValueError
+        if transport is None:
+            transport = Transport(pool_maxsize=max_workers)
+        self._transport = transport
+        self._max_workers = max_workers
+        self._decode_workers = decode_workers
+        self._mode = mode
+
+    def _fetch_one(self, decoder, path, idx, url):
+        r = self._transport.get(url)
+        if not r.ok:
+            raise RuntimeError(f'Image download failed: {url} '
+                               f'status {r.status_code}')
+        # Wait for the decode so at most max_workers images are in flight
+        decoder.submit(_decode_into_stack, path, idx, r.content,
+                       self._mode).result()
+
+    def fetch(self, images, path, count, height, width):
+        """Download and decode images into a new stack at path.
+
+        :param images: An iterable of (opusid, url) pairs. It is consumed
+            lazily, and at most count images are stored.
+        :param path: The .npy file to create.
+        :param count: The number of rows to allocate.
+        :param height: The height of each row in pixels.
+        :param width: The width of each row in pixels.
+
+        Returns a tuple (stack, opusids, failures): the read-only stack, the
+        OPUS ID of each row (None for rows that failed or were not filled)
+        and a list of (opusid, url, error) for the images that failed.
+        """
+        try:
+            import PIL
+        except ImportError:
+            raise RuntimeError('ImageStackFetcher requires Pillow')
+        shape = (count, height, width)
+        if self._mode == 'RGB':
+            shape += (3,)
+        stack = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8,
+                                          shape=shape)
+        # Flush the header and zeroed rows so the decode workers can map it
+        del stack
+
+        opusids = [None] * count
+        failures = []
+        lock = threading.Lock()
+        slots = threading.BoundedSemaphore(self._max_workers*2)
+
+        def _task(idx, opusid, url):
+            try:
+                self._fetch_one(decoder, path, idx, url)
+            except (RuntimeError, OSError, ValueError,
+                    requests.RequestException) as e:
+                with lock:
+                    failures.append((opusid, url, str(e)))
+            else:
+                opusids[idx] = opusid
+            finally:
+                slots.release()
+
+        with ProcessPoolExecutor(
+                max_workers=self._decode_workers,
+                mp_context=multiprocessing.get_context('spawn')) as decoder:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                for idx, (opusid, url) in enumerate(images):
+                    if idx >= count:
+                        break
+                    slots.acquire()
+                    executor.submit(_task, idx, opusid, url)
+
+        tmp_index_path = image_stack_index_path(path) + '.tmp'
+        with open(tmp_index_path, 'w') as fp:
+            json.dump(opusids, fp)
+        os.replace(tmp_index_path, image_stack_index_path(path))
+        return np.load(path, mmap_mode='r'), opusids, failures
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS API request metrics classes
+"""
+
+import bisect
+import logging
+import threading
+
+# Upper bounds (in seconds) of the latency histogram buckets
+_DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.,
+                            2.5, 5., 10., 30., 60.)
+# Upper bounds (in bytes) of the response size histogram buckets
+_DEFAULT_SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                         16777216)
+
+class RequestEvent(object):
+    """The details of one call to the OPUS API.
+
+    Times are in seconds. connect_time is the time spent opening a new
+    connection (0 if a pooled one was reused) and is included in
+    first_byte_time, which runs from sending the request to receiving the
+    response headers. body_time is the time to read the body and
+    decode_time the time to parse the JSON. total_time covers everything
+    including retries.
+    """
+    def __init__(self, endpoint, url=None, params_size=0):
+        self.endpoint = endpoint
+        self.url = url
+        self.params_size = params_size
+        self.status = None
+        self.connect_time = None
+        self.first_byte_time = None
+        self.body_time = None
+        self.decode_time = None
+        self.total_time = None
+        self.num_bytes = 0
+        self.retries = 0
+        self.cached = False
+        self.error = None
+
+    def __repr__(self):
+        return (f'RequestEvent({repr(self.endpoint)},status={self.status},'
+                f'total_time={self.total_time},num_bytes={self.num_bytes},'
+                f'retries={self.retries},cached={self.cached})')
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+class Histogram(object):
+    """A cumulative histogram with fixed bucket upper bounds."""
+    def __init__(self, buckets):
+        self._buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._buckets)+1)
+        self.count = 0
+        self.sum = 0.
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        """Return (upper bound, count <= bound) pairs ending with +Inf."""
+        ret = []
+        total = 0
+        for bound, count in zip(self._buckets + (float('inf'),),
+                                self._counts):
+            total += count
+            ret.append((bound, total))
+        return ret
+
+    def quantile(self, q):
+        """Return the bucket upper bound containing quantile q."""
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        for bound, total in self.cumulative_counts():
+            if total >= rank:
+                return bound
+        return float('inf')
+
+class LoggingExporter(object):
+    """An exporter that logs each RequestEvent."""
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self._logger = (logging.getLogger('opusapi') if logger is None
+                                                     else logger)
+        self._level = level
+
+    def __call__(self, event):
+        if not self._logger.isEnabledFor(self._level):
+            return
+        self._logger.log(self._level,
+                         'OPUSAPI %s status=%s total=%.3fs connect=%s '
+                         'first_byte=%s body=%s decode=%s bytes=%d '
+                         'retries=%d cached=%s',
+                         event.endpoint, event.status,
+                         event.total_time or 0.,
+                         _fmt_time(event.connect_time),
+                         _fmt_time(event.first_byte_time),
+                         _fmt_time(event.body_time),
+                         _fmt_time(event.decode_time),
+                         event.num_bytes, event.retries, event.cached)
+
+def _fmt_time(val):
+    return '-' if val is None else f'{val:.3f}s'
+
+class Metrics(object):
+    """Metrics collects RequestEvents from one or more OPUSAPIRaw clients.
+
+       It keeps aggregate counters (overall and per endpoint) and histograms
+       of the request phases and response sizes, and passes each event to
+       its exporters. An exporter is any callable taking a RequestEvent,
+       for example a function or a LoggingExporter. The aggregates can be
+       read with snapshot() or dumped in the Prometheus text format with
+       prometheus_text().
+
+       A Metrics may be shared by multiple clients and threads.
+    """
+    def __init__(self, exporters=None, latency_buckets=None,
+                 size_buckets=None):
+        """Constructor for the Metrics class.
+
+        :param exporters: If specified, a list of callables to pass each
+            RequestEvent to.
+        :param latency_buckets: If specified, the upper bounds in seconds of
+            the time histogram buckets.
+        :param size_buckets: If specified, the upper bounds in bytes of the
+            response size histogram buckets.
+        """
+        self._exporters = [] if exporters is None else list(exporters)
+        self._latency_buckets = (_DEFAULT_LATENCY_BUCKETS
+                                 if latency_buckets is None
+                                 else latency_buckets)
+        self._size_buckets = (_DEFAULT_SIZE_BUCKETS if size_buckets is None
+                                                    else size_buckets)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clear all counters and histograms."""
+        with self._lock:
+            self._counters = {'requests': 0,
+                              'errors': 0,
+                              'cached': 0,
+                              'retries': 0,
+                              'bytes': 0}
+            self._endpoint_counters = {}
+            self._histograms = {
+                'total_seconds': Histogram(self._latency_buckets),
+                'connect_seconds': Histogram(self._latency_buckets),
+                'first_byte_seconds': Histogram(self._latency_buckets),
+                'body_seconds': Histogram(self._latency_buckets),
+                'decode_seconds': Histogram(self._latency_buckets),
+                'response_bytes': Histogram(self._size_buckets)}
+
+    def add_exporter(self, exporter):
+        """Add a callable to pass each RequestEvent to."""
+        self._exporters.append(exporter)
+
+    def record(self, event):
+        """Add a RequestEvent to the aggregates and export it."""
+        with self._lock:
+            counters = self._counters
+            counters['requests'] += 1
+            counters['retries'] += event.retries
+            counters['bytes'] += event.num_bytes
+            if event.error is not None:
+                counters['errors'] += 1
+            if event.cached:
+                counters['cached'] += 1
+            endpoint = self._endpoint_counters.setdefault(
+                            event.endpoint, {'requests': 0, 'errors': 0,
+                                             'bytes': 0, 'seconds': 0.})
+            endpoint['requests'] += 1
+            endpoint['bytes'] += event.num_bytes
+            endpoint['seconds'] += event.total_time or 0.
+            if event.error is not None:
+                endpoint['errors'] += 1
+            histograms = self._histograms
+            for name, val in (('total_seconds', event.total_time),
+                              ('connect_seconds', event.connect_time),
+                              ('first_byte_seconds', event.first_byte_time),
+                              ('body_seconds', event.body_time),
+                              ('decode_seconds', event.decode_time)):
+                if val is not None:
+                    histograms[name].observe(val)
+            if not event.cached and event.error is None:
+                histograms['response_bytes'].observe(event.num_bytes)
+        for exporter in self._exporters:
+            exporter(event)
+
+    def snapshot(self):
+        """Return the counters and histogram summaries as a dict."""
+        with self._lock:
+            histograms = {}
+            for name, hist in self._histograms.items():
+                histograms[name] = {'count': hist.count,
+                                    'sum': hist.sum,
+                                    'p50': hist.quantile(0.5),
+                                    'p90': hist.quantile(0.9),
+                                    'p99': hist.quantile(0.99)}
+            return {'counters': dict(self._counters),
+                    'endpoints': {endpoint: dict(counters)
+                                  for endpoint, counters
+                                  in self._endpoint_counters.items()},
+                    'histograms': histograms}
+
+    def prometheus_text(self, prefix='opusapi'):
+        """Return the aggregates in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, val in self._counters.items():
+                metric = f'{prefix}_{name}_total'
+                lines.append(f'# TYPE {metric} counter')
+                lines.append(f'{metric} {val}')
+            for name in ('requests', 'errors', 'bytes', 'seconds'):
+                metric = f'{prefix}_endpoint_{name}_total'
+                lines.append(f'# TYPE {metric} counter')
+                for endpoint, counters in self._endpoint_counters.items():
+                    label = endpoint.replace('\\', '\\\\').replace('"', '\\"')
+                    lines.append(f'{metric}{{endpoint="{label}"}} '
+                                 f'{counters[name]}')
+            for name, hist in self._histograms.items():
+                metric = f'{prefix}_{name}'
+                lines.append(f'# TYPE {metric} histogram')
+                for bound, count in hist.cumulative_counts():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append(f'{metric}_bucket{{le="{le}"}} {count}')
+                lines.append(f'{metric}_sum {hist.sum}')
+                lines.append(f'{metric}_count {hist.count}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,333 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS local mirror class
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import math
+import sqlite3
+import time
+import warnings
+
+from .shard import plan_range_shards, RangeShard, _shard_query
+
+_DEFAULT_MIRROR_SHARDS = 16
+_DEFAULT_MIRROR_WORKERS = 4
+# The last shard is split once it holds this many times the planned number
+# of results per shard, which is never taken to be less than
+# _MIN_MIRROR_SHARD_COUNT
+_MIRROR_SPLIT_FACTOR = 2
+_MIN_MIRROR_SHARD_COUNT = 1000
+
+_MIRROR_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS shards (
+    shard INTEGER PRIMARY KEY,
+    minimum REAL,
+    maximum REAL,
+    count INTEGER,
+    synced REAL
+);
+CREATE TABLE IF NOT EXISTS metadata (
+    opusid TEXT PRIMARY KEY,
+    shard INTEGER,
+    row TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    opusid TEXT PRIMARY KEY,
+    shard INTEGER,
+    products TEXT
+);
+CREATE INDEX IF NOT EXISTS metadata_shard ON metadata (shard);
+CREATE INDEX IF NOT EXISTS files_shard ON files (shard);
+"""
+
+class Mirror(object):
+    """Mirror keeps a local copy of the metadata and product files for a
+       query in an SQLite database and brings it up to date incrementally.
+
+       The query is split into shards along a range field (see
+       plan_range_shards) the first time it is synced, and the shard
+       boundaries and each shard's result count are stored with the data.
+       A later sync asks the server for the count of every shard
+       (concurrently) and only re-harvests the shards whose count changed,
+       adding new observations and removing ones that are gone. The last
+       shard has no upper bound, so new observations at the end of the
+       range (the usual case for time) land in it; once it has grown to
+       twice the planned size of a shard it is split again so later syncs
+       only re-harvest the newest piece.
+
+       A change that leaves a shard's count the same (e.g. an observation
+       replaced by another) isn't detected; use sync(full=True) to
+       re-harvest everything. Observations with no value for the shard
+       field are in no shard and can't be mirrored; sync warns if any are
+       missing.
+    """
+    def __init__(self, opusapi, path, query, fieldid, fields=None,
+                 product_types=None, num_shards=None, max_workers=None,
+                 qtype=None, unit=None, minimum=None, maximum=None):
+        """Constructor for the Mirror class.
+
+        :param opusapi: The OPUSAPI to use to talk to the server.
+        :param path: The path of the SQLite database.
+        :param query: The Query to mirror.
+        :param fieldid: The range field used to split the query into shards.
+        :param fields: If specified, the metadata fields to mirror (defaults
+            to the OPUSAPI default fields). 'opusid' is always included.
+        :param product_types: If specified, the product types to mirror from
+            files.json. If None, files are not mirrored.
+        :param num_shards: If specified, the number of shards to split the
+            query into on the first sync (defaults to 16).
+        :param max_workers: If specified, the number of shards to count or
+            harvest at once (defaults to 4).
+        :param qtype: If specified, the qtype of the shard range queries.
+        :param unit: If specified, the unit of the shard boundaries (see
+            plan_range_shards).
+        :param minimum: If specified, the lower end of the range of fieldid
+            to plan the shards over, in unit (see plan_range_shards).
+        :param maximum: If specified, the upper end of the range of fieldid
+            to plan the shards over, in unit.
+        """
+        self._opusapi = opusapi
+        self._path = path
+        self._query = query
+        self._fieldid = fieldid
+        fieldids = opusapi._normalize_fields(fields).split(',')
+        if 'opusid' not in fieldids:
+            fieldids = ['opusid'] + fieldids
+        self._fieldids = fieldids
+        # Stored as JSON, so a tuple must compare equal when reopened
+        self._product_types = (None if product_types is None
+                                    else list(product_types))
+        self._num_shards = (_DEFAULT_MIRROR_SHARDS if num_shards is None
+                                                   else num_shards)
+        self._max_workers = (_DEFAULT_MIRROR_WORKERS if max_workers is None
+                                                     else max_workers)
+        self._qtype = qtype
+        self._unit = unit
+        self._minimum = minimum
+        self._maximum = maximum
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_MIRROR_SCHEMA)
+        self._check_state()
+
+    def __repr__(self):
+        return f'Mirror({repr(self._path)},{repr(self._query)})'
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _get_state(self, key):
+        row = self._conn.execute('SELECT value FROM sync_state WHERE key=?',
+                                 (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _set_state(self, key, value):
+        self._conn.execute('INSERT OR REPLACE INTO sync_state VALUES (?,?)',
+                           (key, json.dumps(value)))
+
+    def _check_state(self):
+        """Make sure the database was created for this mirror definition."""
+        definition = {'query': repr(self._query),
+                      'fieldid': self._fieldid,
+                      'fields': self._fieldids,
+                      'product_types': self._product_types,
+                      'qtype': self._qtype,
+                      'unit': self._unit,
+                      'minimum': self._minimum,
+                      'maximum': self._maximum}
+        old_definition = self._get_state('definition')
+        if old_definition is None:
+            with self._conn:
+                self._set_state('definition', definition)
+        elif dict({'minimum': None, 'maximum': None},
+                  **old_definition) != definition:
+            raise RuntimeError(f'Mirror database "{self._path}" was created '
+                               'for a different query, fields or shard field')
+
+    def _load_shards(self):
+        rows = self._conn.execute('SELECT shard, minimum, maximum, count '
+                                  'FROM shards ORDER BY shard').fetchall()
+        # plan_range_shards may have picked the unit (e.g. for times)
+        unit = self._get_state('shard_unit')
+        if unit is None:
+            unit = self._unit
+        shards = []
+        for _, minimum, maximum, count in rows:
+            shard_query = _shard_query(self._query, self._fieldid, minimum,
+                                       maximum, self._qtype, unit)
+            shards.append((RangeShard(shard_query, self._fieldid, minimum,
+                                      maximum, None, qtype=self._qtype,
+                                      unit=unit), count))
+        return shards
+
+    def _store_shard_plan(self, first_shard_num, shards):
+        """Replace the shards from first_shard_num on with new ones."""
+        self._conn.execute('DELETE FROM shards WHERE shard>=?',
+                           (first_shard_num,))
+        for shard_num, shard in enumerate(shards, start=first_shard_num):
+            self._conn.execute('INSERT INTO shards VALUES (?,?,?,?,?)',
+                               (shard_num, shard.minimum, shard.maximum,
+                                None, None))
+
+    def _plan_shards(self):
+        shards = plan_range_shards(self._opusapi, self._query, self._fieldid,
+                                   self._num_shards, minimum=self._minimum,
+                                   maximum=self._maximum, qtype=self._qtype,
+                                   unit=self._unit,
+                                   max_workers=self._max_workers)
+        shard_count = max(shards[0].available / len(shards),
+                          _MIN_MIRROR_SHARD_COUNT)
+        with self._conn:
+            self._store_shard_plan(0, shards)
+            self._set_state('shard_unit', shards[0].unit)
+            self._set_state('shard_count', shard_count)
+        return [(shard, None) for shard in shards]
+
+    def _split_last_shard(self, shards, counts):
+        """Split the open-ended last shard if it has grown too large.
+
+        Returns the new shards and counts. The pieces have no stored count
+        so they are all harvested.
+        """
+        shard_count = self._get_state('shard_count')
+        last_shard = shards[-1][0]
+        if (shard_count is None or
+            counts[-1] <= shard_count * _MIRROR_SPLIT_FACTOR):
+            return shards, counts
+        pieces = plan_range_shards(self._opusapi, self._query, self._fieldid,
+                                   math.ceil(counts[-1] / shard_count),
+                                   minimum=last_shard.minimum,
+                                   qtype=self._qtype, unit=last_shard.unit,
+                                   max_workers=self._max_workers,
+                                   closed_minimum=(last_shard.minimum
+                                                   is not None))
+        if len(pieces) == 1:
+            return shards, counts
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            piece_counts = list(executor.map(
+                            lambda piece: self._opusapi.get_count(piece.query),
+                            pieces))
+        with self._conn:
+            self._store_shard_plan(len(shards)-1, pieces)
+        return (shards[:-1] + [(piece, None) for piece in pieces],
+                counts[:-1] + piece_counts)
+
+    def _harvest_shard(self, shard):
+        """Retrieve everything in one shard from the server."""
+        rows = list(self._opusapi.get_metadata(query=shard.query,
+                                               fields=self._fieldids))
+        products = None
+        if self._product_types is not None:
+            products = {}
+            for result in self._opusapi.get_files(
+                                    query=shard.query,
+                                    product_types=self._product_types):
+                products.update(result)
+        return rows, products
+
+    def _store_shard(self, shard_num, count, rows, products):
+        opusid_idx = self._fieldids.index('opusid')
+        with self._conn:
+            self._conn.execute('DELETE FROM metadata WHERE shard=?',
+                               (shard_num,))
+            self._conn.execute('DELETE FROM files WHERE shard=?',
+                               (shard_num,))
+            # An observation may match two adjacent shards; it belongs to
+            # the one that stored it most recently, so the newest copy wins
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO metadata VALUES (?,?,?)',
+                [(row[opusid_idx], shard_num, json.dumps(row))
+                 for row in rows])
+            if products is not None:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?,?,?)',
+                    [(opusid, shard_num, json.dumps(prods))
+                     for opusid, prods in products.items()])
+            self._conn.execute('UPDATE shards SET count=?, synced=? '
+                               'WHERE shard=?',
+                               (count, time.time(), shard_num))
+
+    def sync(self, full=False):
+        """Bring the mirror up to date with the server.
+
+        Returns a dict with the number of shards checked and re-harvested,
+        the number of observations stored and the number of results of the
+        query on the server.
+        """
+        shards = self._load_shards()
+        if not shards:
+            shards = self._plan_shards()
+
+        with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+            available = executor.submit(self._opusapi.get_count, self._query)
+            counts = list(executor.map(
+                            lambda shard: self._opusapi.get_count(shard[0].query),
+                            shards))
+            shards, counts = self._split_last_shard(shards, counts)
+            changed = [shard_num
+                       for shard_num, ((_, old_count), new_count)
+                       in enumerate(zip(shards, counts))
+                       if full or old_count != new_count]
+            harvests = executor.map(
+                            lambda shard_num:
+                                self._harvest_shard(shards[shard_num][0]),
+                            changed)
+            for shard_num, (rows, products) in zip(changed, harvests):
+                self._store_shard(shard_num, counts[shard_num], rows,
+                                  products)
+            available = available.result()
+
+        with self._conn:
+            self._set_state('last_sync', time.time())
+        num_observations = len(self)
+        if num_observations < available:
+            warnings.warn(f'Mirror holds {num_observations} of {available} '
+                          'results; results with no value for field id '
+                          f'"{self._fieldid}" are not mirrored')
+        return {'shards': len(shards),
+                'shards_synced': len(changed),
+                'observations': num_observations,
+                'available': available}
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM metadata').fetchone()[0]
+
+    @property
+    def fields(self):
+        """Return the metadata fieldids stored in the mirror."""
+        return list(self._fieldids)
+
+    @property
+    def last_sync(self):
+        """Return the time of the last successful sync or None."""
+        return self._get_state('last_sync')
+
+    def get_metadata(self):
+        """Yield the mirrored metadata rows in OPUS ID order."""
+        for (row,) in self._conn.execute('SELECT row FROM metadata '
+                                         'ORDER BY opusid'):
+            yield json.loads(row)
+
+    def get_files(self):
+        """Yield the mirrored files as {opusid: products} in OPUS ID order."""
+        for opusid, products in self._conn.execute(
+                                    'SELECT opusid, products FROM files '
+                                    'ORDER BY opusid'):
+            yield {opusid: json.loads(products)}
+
+    def get_metadata_df(self):
+        """Return the mirrored metadata as a typed DataFrame."""
+        return self._opusapi._convert_metadata_page(list(self.get_metadata()),
+                                                    self._fieldids)
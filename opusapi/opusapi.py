@@ -3,25 +3,195 @@
 OPUSAPI class
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
+import itertools
 import json
+import numpy as np
 import pandas as pd
 import requests
+from urllib.parse import quote_plus, urlencode
 import warnings
 
 from .util import CaseInsensitiveDict
-from .opusapiraw import OPUSAPIRaw
+from .download import ProductDownloader, product_dest_path
+from .imagestack import ImageStackFetcher
+from .opusapiraw import OPUSAPIRaw, hide_paging
+from .planner import plan_query
+from .query import OPUSIDQuery, Query
+from .resultset import ResultSet
+from .units import UnitConverter
+from .shard import (_DEFAULT_SHARD_WORKERS, harvest_shards,
+                    plan_range_shards)
+
+# Strings OPUS uses in data.json, besides null, to indicate that a field has
+# no value
+_OPUS_NULL_STRINGS = ['', 'N/A', 'NULL', 'None']
+
+_DEFAULT_EXPORT_ROW_GROUP_SIZE = 65536
+_DEFAULT_FACET_WORKERS = 8
+# Longest request URL to build when looking up OPUS IDs; most servers and
+# proxies accept at least 8 KB
+_DEFAULT_MAX_URL_LENGTH = 8000
+_DEFAULT_MAX_IDS_PER_REQUEST = 1000
+_DEFAULT_ID_LOOKUP_WORKERS = 4
+
+# The column kinds used when converting metadata to typed DataFrames
+_KIND_STRING = 'string'
+_KIND_CATEGORY = 'category'
+_KIND_FLOAT = 'float'
+_KIND_INT = 'int'
+_KIND_TIME = 'time'
+
+# The buffer dtype for each column kind; other kinds are kept as objects
+_KIND_DTYPES = {_KIND_FLOAT: np.float64,
+                _KIND_INT: np.int64,
+                _KIND_TIME: 'datetime64[ns]'}
+
+# The most rows to preallocate from the limit of a call; buffers grow past
+# this as pages arrive
+_MAX_PREALLOCATED_ROWS = 1000000
+
+def _check_parsed(col, bad, kind):
+    """Raise ValueError if any value of col failed to parse as kind."""
+    if bad.any():
+        raise ValueError(f'Malformed value for a {kind} field: '
+                         f'{col[bad][0]!r}')
+
+class _MetadataColumns(object):
+    """Typed per-column buffers that data.json pages are parsed into."""
+
+    def __init__(self, kinds, capacity=0):
+        """Preallocate the buffers.
+
+        :param kinds: The column kind of each field
+        :param capacity: The number of rows to preallocate
+        """
+        self._kinds = kinds
+        self._size = 0
+        self._capacity = capacity
+        self._values = [np.empty(capacity, dtype=_KIND_DTYPES.get(kind,
+                                                                  object))
+                        for kind in kinds]
+        self._nulls = [np.empty(capacity, dtype=bool) for _ in kinds]
+
+    def __len__(self):
+        return self._size
+
+    def _reserve(self, num_rows):
+        """Grow the buffers, doubling them, to hold num_rows more rows."""
+        needed = self._size + num_rows
+        if needed <= self._capacity:
+            return
+        capacity = max(needed, self._capacity*2)
+        for bufs in (self._values, self._nulls):
+            for i, buf in enumerate(bufs):
+                new_buf = np.empty(capacity, dtype=buf.dtype)
+                new_buf[:self._size] = buf[:self._size]
+                bufs[i] = new_buf
+        self._capacity = capacity
+
+    @staticmethod
+    def _parse_column(col, kind):
+        """Parse one object array of string metadata in place.
+
+        Returns the values, as the buffer dtype of the kind, and the mask of
+        the null values. Only None and the OPUS null strings are null; any
+        other value that can't be parsed as the kind (including a
+        non-integral value for an integer field) raises ValueError.
+        """
+        nulls = pd.isna(col)
+        nulls |= np.isin(col, _OPUS_NULL_STRINGS)
+        if kind in (_KIND_FLOAT, _KIND_INT):
+            # Parsing straight from the strings with numpy is much faster
+            # than pd.to_numeric; fall back to it for other spellings
+            # (such as '3e2' for an integer) and to find bad values
+            col[nulls] = '0'
+            try:
+                return col.astype(_KIND_DTYPES[kind]), nulls
+            except (TypeError, ValueError, OverflowError):
+                col[nulls] = None
+            vals = pd.to_numeric(col, errors='coerce').astype(np.float64)
+            bad = np.isnan(vals) & ~nulls
+            if kind == _KIND_INT:
+                vals[nulls] = 0
+                bad |= vals != np.trunc(vals)
+            _check_parsed(col, bad, kind)
+            if kind == _KIND_INT:
+                vals = vals.astype(np.int64)
+            return vals, nulls
+        col[nulls] = None
+        if kind == _KIND_TIME:
+            vals = pd.to_datetime(col, errors='coerce')
+            _check_parsed(col, pd.isna(vals) & ~nulls, kind)
+            return np.asarray(vals, dtype=_KIND_DTYPES[kind]), nulls
+        return col, nulls
+
+    def append_page(self, page):
+        """Parse the rows of one data.json page onto the end of the
+        buffers."""
+        num_rows = len(page)
+        if num_rows == 0:
+            return
+        self._reserve(num_rows)
+        start = self._size
+        stop = start + num_rows
+        for kind, values, nulls, vals in zip(self._kinds, self._values,
+                                             self._nulls, zip(*page)):
+            if values.dtype == object:
+                # Strings are parsed where they land in the buffer
+                col = values[start:stop]
+                col[:] = vals
+            else:
+                col = np.empty(num_rows, dtype=object)
+                col[:] = vals
+            values[start:stop], nulls[start:stop] = \
+                self._parse_column(col, kind)
+        self._size = stop
+
+    def to_frame(self, fieldids, categorical=True):
+        """Return the buffered rows as a typed DataFrame.
+
+        The DataFrame shares memory with the buffers where it can, so no
+        more pages should be appended.
+        """
+        data = {}
+        for fieldid, kind, values, nulls in zip(fieldids, self._kinds,
+                                                self._values, self._nulls):
+            values = values[:self._size]
+            nulls = nulls[:self._size]
+            if kind == _KIND_INT:
+                data[fieldid] = pd.arrays.IntegerArray(values, nulls)
+            elif kind == _KIND_FLOAT:
+                values[nulls] = np.nan
+                data[fieldid] = values
+            elif kind == _KIND_TIME:
+                values[nulls] = np.datetime64('NaT')
+                data[fieldid] = values
+            elif kind == _KIND_CATEGORY and categorical:
+                data[fieldid] = pd.Categorical(values)
+            else:
+                data[fieldid] = pd.Series(values, dtype=object, copy=False)
+        return pd.DataFrame(data, columns=fieldids)
 
 class OPUSAPI(OPUSAPIRaw):
-    def __init__(self, server=None, default_fields=None, verbose=False):
+    def __init__(self, server=None, default_fields=None, verbose=False,
+                 transport=None, field_cache=None, cache=None, metrics=None,
+                 governor=None):
         """Constructor for the OPUSAPI class."""
         super(OPUSAPI, self).__init__(server=server,
                                       default_fields=default_fields,
-                                      verbose=verbose)
+                                      verbose=verbose,
+                                      transport=transport,
+                                      field_cache=field_cache,
+                                      cache=cache,
+                                      metrics=metrics,
+                                      governor=governor)
         self._fields_cache = None
         self._fields_as_df_cache = None
         self._surfacegeo_targets_cache = None
         self._surfacegeo_fields_cache = None
+        self._unit_converter = None
 
     def __repr__(self):
         return 'OPUSAPI for server '+self._server
@@ -108,6 +278,14 @@ class OPUSAPI(OPUSAPIRaw):
         if self._fields_cache is not None:
             return self._fields_cache
 
+        # Make sure the raw fields (and the disk cache entry) are loaded
+        # before looking for derived structures
+        self.raw_fields
+        ret = self._get_derived_field_cache('fields')
+        if ret is not None:
+            self._fields_cache = ret
+            return self._fields_cache
+
         (fieldid_roots, categories, types, label1s, label2s,
          full_label1s, full_label2s, search_labels, full_search_labels,
          default_units, available_units) = self._get_fields()
@@ -139,8 +317,16 @@ class OPUSAPI(OPUSAPIRaw):
               }
 
         self._fields_cache = ret
+        self._set_derived_field_cache('fields', ret)
         return self._fields_cache
 
+    @property
+    def unit_converter(self):
+        """Return a UnitConverter for the units in the OPUS field registry."""
+        if self._unit_converter is None:
+            self._unit_converter = UnitConverter(self)
+        return self._unit_converter
+
     def _extract_fields_as_df(self, fields):
         """Convert fields into a DataFrame."""
         fieldids = fields.keys()
@@ -187,7 +373,11 @@ class OPUSAPI(OPUSAPIRaw):
         if self._fields_as_df_cache is not None:
             return self._fields_as_df_cache
 
-        ret_frame = self._extract_fields_as_df(self.fields)
+        fields = self.fields
+        ret_frame = self._get_derived_field_cache('fields_as_df')
+        if ret_frame is None:
+            ret_frame = self._extract_fields_as_df(fields)
+            self._set_derived_field_cache('fields_as_df', ret_frame)
 
         self._fields_as_df_cache = ret_frame
         return self._fields_as_df_cache
@@ -200,6 +390,12 @@ class OPUSAPI(OPUSAPIRaw):
 
         raw_fields = self.fields
 
+        cached = self._get_derived_field_cache('surfacegeo')
+        if cached is not None:
+            (self._surfacegeo_targets_cache,
+             self._surfacegeo_fields_cache) = cached
+            return cached
+
         target_dict = CaseInsensitiveDict()
         fields_dict = {}
         for fieldid, field in raw_fields.items():
@@ -220,6 +416,7 @@ class OPUSAPI(OPUSAPIRaw):
 
         self._surfacegeo_targets_cache = target_dict
         self._surfacegeo_fields_cache = fields_dict
+        self._set_derived_field_cache('surfacegeo', (target_dict, fields_dict))
 
         return (self._surfacegeo_targets_cache,
                 self._surfacegeo_fields_cache)
@@ -275,10 +472,78 @@ class OPUSAPI(OPUSAPIRaw):
         res = self.get_range_endpoints_raw(fieldid, query=query)
         return res['min'], res['max'], res['nulls'], res['units']
 
+    def get_facets(self, query=None, mult_fields=None, range_fields=None,
+                   max_workers=None):
+        """Return the result count, mults and range endpoints for a search.
+
+        The field types are checked and the query is compiled once, and then
+        get_mults for every mult_field, get_range_endpoints for every
+        range_field and get_count are all run concurrently, up to
+        max_workers (defaults to 8) at a time.
+
+        Returns a dict:
+            {'count': 1234,
+             'mults': {fieldid: {value: count, ...}, ...},
+             'ranges': {fieldid: {'min': ..., 'max': ..., 'nulls': count,
+                                  'units': ...}, ...}}
+        Counts are ints. Range endpoints are floats for numeric range fields
+        and strings for time fields (or None if there are no values).
+        """
+        mult_fields = [] if mult_fields is None else list(mult_fields)
+        range_fields = [] if range_fields is None else list(range_fields)
+        fields = self.fields
+        for fieldid in mult_fields + range_fields:
+            if fieldid not in fields:
+                raise RuntimeError(f'Field id "{fieldid}" unknown')
+        for fieldid in mult_fields:
+            if fields[fieldid]['type'] != 'multiple':
+                raise RuntimeError(f'Field id "{fieldid}" is not type '
+                                   '"multiple"')
+        for fieldid in range_fields:
+            if not fields[fieldid]['type'].startswith('range'):
+                raise RuntimeError(f'Field id "{fieldid}" is not type "range"')
+        if query is not None:
+            query = query.compile(opusapi=self)
+        if max_workers is None:
+            max_workers = _DEFAULT_FACET_WORKERS
+
+        def _endpoint(val, fieldid):
+            if val is None or 'time' in fields[fieldid]['type']:
+                return val
+            try:
+                return float(val)
+            except (TypeError, ValueError):
+                return val
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            count = executor.submit(self.get_count, query)
+            mults = [executor.submit(self.get_mults_raw, fieldid, query=query)
+                     for fieldid in mult_fields]
+            ranges = [executor.submit(self.get_range_endpoints_raw, fieldid,
+                                      query=query)
+                      for fieldid in range_fields]
+            ret = {'count': count.result(),
+                   'mults': {},
+                   'ranges': {}}
+            for fieldid, future in zip(mult_fields, mults):
+                ret['mults'][fieldid] = {val: int(val_count)
+                                         for val, val_count
+                                         in future.result().items()}
+            for fieldid, future in zip(range_fields, ranges):
+                res = future.result()
+                ret['ranges'][fieldid] = {
+                    'min': _endpoint(res['min'], fieldid),
+                    'max': _endpoint(res['max'], fieldid),
+                    'nulls': None if res['nulls'] is None
+                                  else int(res['nulls']),
+                    'units': res['units']}
+        return ret
+
     ### Metadata, Files, Images API Calls
 
     def get_metadata(self, query=None, startobs=1, limit=None,
-                     paging_limit=None, fields=None):
+                     paging_limit=None, fields=None, max_workers=None,
+                     prefetch_pages=None, adaptive=None, max_columns=None):
         """Return the results of calls to data.json.
 
         TODO XXX
@@ -289,12 +554,348 @@ class OPUSAPI(OPUSAPIRaw):
         Example:
             [['co-iss-n1454939333', '2004-02-08T13:25:41.089', '18'],
              ['co-iss-n1454939373', '2004-02-08T13:26:36.496', '2.6']]
+
+        If max_columns is given, each page of a request for more fields than
+        that is fetched as concurrent requests of at most max_columns columns
+        and stitched back together by OPUS ID.
         """
         return self.get_metadata_raw(query=query, startobs=startobs,
-                                     limit=limit, fields=fields)
+                                     limit=limit, paging_limit=paging_limit,
+                                     max_workers=max_workers,
+                                     prefetch_pages=prefetch_pages,
+                                     adaptive=adaptive, fields=fields,
+                                     max_columns=max_columns)
+
+    def search(self, query=None, fields=None, page_size=None,
+               max_pages=None):
+        """Return a lazy, random-access ResultSet of the data.json results of
+        a search.
+
+        Example:
+            results = opusapi.search(query, fields=['opusid', 'time1'])
+            len(results)            # One call to get_count
+            results[50000:50100]    # Only the page(s) holding these rows
+        """
+        return ResultSet(self, query=query, fields=fields,
+                         page_size=page_size, max_pages=max_pages)
+
+    def _metadata_column_kinds(self, fieldids):
+        """Return the column kind for each metadata fieldid."""
+        raw_fields = self.raw_fields
+        kinds = []
+        for fieldid in fieldids:
+            f_type = raw_fields[fieldid]['type']
+            if f_type == 'multiple':
+                kinds.append(_KIND_CATEGORY)
+            elif f_type.startswith('range'):
+                if 'time' in f_type:
+                    kinds.append(_KIND_TIME)
+                elif 'int' in f_type:
+                    kinds.append(_KIND_INT)
+                else:
+                    kinds.append(_KIND_FLOAT)
+            else:
+                kinds.append(_KIND_STRING)
+        return kinds
+
+    def _convert_metadata_page(self, page, fieldids, kinds=None,
+                               categorical=True):
+        """Convert one page of data.json results to a typed DataFrame."""
+        if kinds is None:
+            kinds = self._metadata_column_kinds(fieldids)
+        columns = _MetadataColumns(kinds, capacity=len(page))
+        columns.append_page(page)
+        return columns.to_frame(fieldids, categorical=categorical)
+
+    def get_metadata_df_batches(self, query=None, startobs=1, limit=None,
+                                paging_limit=None, fields=None,
+                                max_workers=None, prefetch_pages=None,
+                                adaptive=None, categorical=True,
+                                max_columns=None):
+        """Return the results of calls to data.json as a series of typed
+        DataFrames, one per page.
+
+        Columns are named by fieldid and typed from the OPUS field registry:
+        range fields become float64 (or nullable Int64 for integer ranges),
+        time fields become datetime64, and multiple choice fields become
+        categoricals (unless categorical is False). OPUS null values become
+        NaN/NaT/<NA>. Any other value that doesn't parse as its column's
+        type, including a non-integral value for an integer range, raises
+        ValueError rather than being silently dropped. Because each page
+        has its own categories, use get_metadata_df to get a single
+        DataFrame with shared categories. See get_metadata for max_columns.
+        """
+        fieldids = self._normalize_fields(fields).split(',')
+        kinds = self._metadata_column_kinds(fieldids)
+        for page in self.get_metadata_raw(query=query, startobs=startobs,
+                                          limit=limit,
+                                          paging_limit=paging_limit,
+                                          max_workers=max_workers,
+                                          prefetch_pages=prefetch_pages,
+                                          adaptive=adaptive, by_page=True,
+                                          fields=fields,
+                                          max_columns=max_columns):
+            yield self._convert_metadata_page(page, fieldids, kinds=kinds,
+                                              categorical=categorical)
+
+    def get_metadata_df(self, query=None, startobs=1, limit=None,
+                        paging_limit=None, fields=None, max_workers=None,
+                        prefetch_pages=None, adaptive=None, max_columns=None):
+        """Return the results of calls to data.json as one typed DataFrame.
+
+        See get_metadata_df_batches for how columns are typed and
+        get_metadata for max_columns.
+        """
+        fieldids = self._normalize_fields(fields).split(',')
+        kinds = self._metadata_column_kinds(fieldids)
+        # Every page is parsed straight into one set of typed buffers, so
+        # there are no per-page DataFrames to concatenate and the
+        # categories are built once
+        capacity = 0 if limit is None else min(limit,
+                                               _MAX_PREALLOCATED_ROWS)
+        columns = _MetadataColumns(kinds, capacity=capacity)
+        for page in self.get_metadata_raw(query=query, startobs=startobs,
+                                          limit=limit,
+                                          paging_limit=paging_limit,
+                                          max_workers=max_workers,
+                                          prefetch_pages=prefetch_pages,
+                                          adaptive=adaptive, by_page=True,
+                                          fields=fields,
+                                          max_columns=max_columns):
+            columns.append_page(page)
+        return columns.to_frame(fieldids)
+
+    def _metadata_arrow_schema(self, fieldids, kinds):
+        """Return the Arrow schema for exported metadata."""
+        import pyarrow as pa
+        arrow_types = {_KIND_STRING: pa.string(),
+                       _KIND_CATEGORY: pa.string(),
+                       _KIND_FLOAT: pa.float64(),
+                       _KIND_INT: pa.int64(),
+                       _KIND_TIME: pa.timestamp('ns')}
+        return pa.schema([pa.field(fieldid, arrow_types[kind])
+                          for fieldid, kind in zip(fieldids, kinds)])
+
+    def export_metadata(self, query=None, fields=None, path=None,
+                        format='parquet', startobs=1, limit=None,
+                        paging_limit=None, max_workers=None,
+                        prefetch_pages=None, adaptive=None,
+                        compression='snappy', row_group_size=None,
+                        max_columns=None):
+        """Stream the results of calls to data.json to a file on disk.
+
+        Each page is converted to a typed DataFrame (see
+        get_metadata_df_batches) and then to an Arrow record batch that is
+        appended to the output file, so memory use is proportional to the
+        page size and not the total number of results. Multiple choice
+        fields are written as strings.
+
+        :param path: The file to write.
+        :param format: 'parquet' to write a Parquet file or 'feather' to write
+            a Feather (Arrow IPC) file.
+        :param compression: The compression to use (defaults to 'snappy' for
+            Parquet; use None for Feather unless 'lz4' or 'zstd' is wanted).
+        :param row_group_size: If specified, the number of rows to collect
+            before writing them out as one Parquet row group or Feather
+            record batch (defaults to 65536). Memory use is proportional to
+            this. Very small row groups make the output slow to read.
+        :param max_columns: If specified, the most columns to request at once
+            (see get_metadata).
+
+        Returns the number of rows written. Requires pyarrow.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise RuntimeError('export_metadata requires pyarrow')
+        if path is None:
+            raise ValueError
+        format = format.lower()
+        if format not in ('parquet', 'feather'):
+            raise RuntimeError(f'Unknown export format "{format}"')
+
+        fieldids = self._normalize_fields(fields).split(',')
+        kinds = self._metadata_column_kinds(fieldids)
+        schema = self._metadata_arrow_schema(fieldids, kinds)
+
+        if format == 'parquet':
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(path, schema, compression=compression)
+            write_table = writer.write_table
+        else:
+            options = None
+            if compression not in (None, 'snappy'):
+                options = pa.ipc.IpcWriteOptions(compression=compression)
+            writer = pa.ipc.new_file(path, schema, options=options)
+            write_table = writer.write
+
+        if row_group_size is None:
+            row_group_size = _DEFAULT_EXPORT_ROW_GROUP_SIZE
+
+        num_rows = 0
+        pending_tables = []
+        pending_rows = 0
+        try:
+            for batch in self.get_metadata_df_batches(
+                                query=query, startobs=startobs, limit=limit,
+                                paging_limit=paging_limit, fields=fields,
+                                max_workers=max_workers,
+                                prefetch_pages=prefetch_pages,
+                                adaptive=adaptive, categorical=False,
+                                max_columns=max_columns):
+                pending_tables.append(pa.Table.from_pandas(
+                                            batch, schema=schema,
+                                            preserve_index=False))
+                pending_rows += len(batch)
+                num_rows += len(batch)
+                if pending_rows >= row_group_size:
+                    write_table(pa.concat_tables(pending_tables))
+                    pending_tables = []
+                    pending_rows = 0
+            if pending_tables:
+                write_table(pa.concat_tables(pending_tables))
+        finally:
+            writer.close()
+        return num_rows
+
+    def _chunk_opusids(self, opusids, base_params, max_url_length,
+                       max_ids_per_request):
+        """Split OPUS IDs into chunks whose data.json URLs fit in
+        max_url_length."""
+        base_length = (len(self._server+'/api/data.json?') +
+                       len(urlencode(base_params)) + len('&opusid='))
+        chunks = []
+        chunk = []
+        length = base_length
+        for opusid in opusids:
+            # Each ID after the first also needs an encoded comma
+            id_length = len(quote_plus(opusid)) + (3 if chunk else 0)
+            if chunk and (length+id_length > max_url_length or
+                          len(chunk) >= max_ids_per_request):
+                chunks.append(chunk)
+                chunk = []
+                length = base_length
+                id_length -= 3
+            chunk.append(opusid)
+            length += id_length
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def get_metadata_for_ids(self, opusids, fields=None, max_workers=None,
+                             max_url_length=None, max_ids_per_request=None):
+        """Return the metadata for a list of OPUS IDs.
+
+        The IDs are split into as few opusid searches as fit in
+        max_url_length (defaults to 8000) with at most max_ids_per_request
+        (defaults to 1000) each, and the searches are run concurrently, up to
+        max_workers (defaults to 4) at a time.
+
+        Returns a tuple (rows, missing). rows has one entry per input OPUS ID,
+        in the same order: the list of metadata for the requested fields (as
+        returned by get_metadata), or None if the ID was not found. missing
+        is the list of OPUS IDs that were not found. Whitespace around the
+        IDs is ignored, and an empty ID or one with a comma raises
+        ValueError.
+        """
+        opusids = [opusid.strip() for opusid in opusids]
+        fieldids = self._normalize_fields(fields).split(',')
+        strip_opusid = 'opusid' not in fieldids
+        if strip_opusid:
+            fieldids = ['opusid'] + fieldids
+        opusid_idx = fieldids.index('opusid')
+        if max_url_length is None:
+            max_url_length = _DEFAULT_MAX_URL_LENGTH
+        if max_ids_per_request is None:
+            max_ids_per_request = _DEFAULT_MAX_IDS_PER_REQUEST
+        if max_workers is None:
+            max_workers = _DEFAULT_ID_LOOKUP_WORKERS
+        if max_ids_per_request < 1 or max_workers < 1:
+            raise ValueError
+
+        unique_ids = list(dict.fromkeys(opusids))
+        base_params = {'startobs': 1, 'limit': max_ids_per_request,
+                       'cols': ','.join(fieldids)}
+        chunks = self._chunk_opusids(unique_ids, base_params, max_url_length,
+                                     max_ids_per_request)
+
+        def _lookup(chunk):
+            query = Query(OPUSIDQuery(chunk)).compile(opusapi=self)
+            return list(self.get_metadata_raw(query=query,
+                                              paging_limit=len(chunk),
+                                              fields=fieldids))
+
+        found = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for chunk_rows in executor.map(_lookup, chunks):
+                for row in chunk_rows:
+                    opusid = row[opusid_idx]
+                    if strip_opusid:
+                        row = row[1:]
+                    found[opusid] = row
+        rows = [found.get(opusid) for opusid in opusids]
+        missing = [opusid for opusid in unique_ids if opusid not in found]
+        return rows, missing
+
+    def get_metadata_sharded(self, query=None, fieldid=None, fields=None,
+                             num_shards=None, max_workers=None,
+                             paging_limit=None, minimum=None, maximum=None,
+                             qtype=None, unit=None, allow_missing=False):
+        """Return the results of calls to data.json, harvesting shards of the
+        query in parallel.
+
+        The query is split into num_shards pieces of roughly equal size along
+        the range field fieldid (see plan_range_shards) and the pieces are
+        paged concurrently. Rows are returned in shard order with duplicates
+        removed by OPUS ID. This avoids the deep startobs offsets of paging a
+        single huge query.
+
+        RuntimeError is raised if some results can't be harvested this way
+        (e.g. they have no value for fieldid) unless allow_missing is True;
+        see harvest_shards.
+        """
+        if fieldid is None:
+            raise RuntimeError('A range field id is required for sharding')
+        if num_shards is None:
+            num_shards = (_DEFAULT_SHARD_WORKERS if max_workers is None
+                                                 else max_workers)
+        shards = plan_range_shards(self, query, fieldid, num_shards,
+                                   minimum=minimum, maximum=maximum,
+                                   qtype=qtype, unit=unit,
+                                   max_workers=max_workers)
+        return harvest_shards(self, shards, fields=fields,
+                              max_workers=max_workers,
+                              paging_limit=paging_limit,
+                              allow_missing=allow_missing)
+
+    def plan_query(self, query, fields=None, max_url_length=None,
+                   max_values_per_term=None):
+        """Return a QueryPlan that splits a query into sub-queries that fit
+        in the server's limits. See plan_query."""
+        return plan_query(self, query, fields=fields,
+                          max_url_length=max_url_length,
+                          max_values_per_term=max_values_per_term)
+
+    def get_metadata_planned(self, query=None, fields=None, max_workers=None,
+                             paging_limit=None, max_url_length=None,
+                             max_values_per_term=None):
+        """Return the results of calls to data.json for a query too big for
+        one request.
+
+        The query is canonicalized and split by plan_query, the sub-queries
+        are run concurrently and the rows are merged with duplicates (by OPUS
+        ID) removed. Rows are in sub-query order, not the server's order for
+        the whole query.
+        """
+        plan = self.plan_query(query, fields=fields,
+                               max_url_length=max_url_length,
+                               max_values_per_term=max_values_per_term)
+        return plan.get_metadata(max_workers=max_workers,
+                                 paging_limit=paging_limit)
 
     def get_files(self, query=None, startobs=1, limit=None,
-                  paging_limit=None, product_types=None):
+                  paging_limit=None, product_types=None, max_workers=None,
+                  prefetch_pages=None, adaptive=None):
         """Return the results of raw calls to files.json.
 
         TODO XXX
@@ -312,10 +913,15 @@ class OPUSAPI(OPUSAPIRaw):
              }]
         """
         return self.get_files_raw(query=query, startobs=startobs,
-                                  limit=limit, product_types=product_types)
+                                  limit=limit, paging_limit=paging_limit,
+                                  max_workers=max_workers,
+                                  prefetch_pages=prefetch_pages,
+                                  adaptive=adaptive,
+                                  product_types=product_types)
 
     def get_images(self, query=None, startobs=1, limit=None,
-                   paging_limit=None, size=None):
+                   paging_limit=None, size=None, max_workers=None,
+                   prefetch_pages=None, adaptive=None):
         """Return the results of raw calls to images.json.
 
         TODO XXX
@@ -340,4 +946,207 @@ class OPUSAPI(OPUSAPIRaw):
               'width': 256}]
         """
         return self.get_images_raw(query=query, startobs=startobs,
-                                   limit=limit, size=size)
+                                   limit=limit, paging_limit=paging_limit,
+                                   max_workers=max_workers,
+                                   prefetch_pages=prefetch_pages,
+                                   adaptive=adaptive, size=size)
+
+    ### Product Downloads
+
+    def _iter_product_downloads(self, query, product_types, dest, startobs,
+                                limit, paging_limit, dest_path):
+        """Yield (url, local path) pairs for the products of a search."""
+        seen = set()
+        for result in self.get_files(query=query, startobs=startobs,
+                                     limit=limit, paging_limit=paging_limit,
+                                     product_types=product_types):
+            for opusid, products in result.items():
+                for product_type, urls in products.items():
+                    if not isinstance(urls, list):
+                        continue
+                    if (product_types is not None and
+                        product_type not in product_types):
+                        continue
+                    for url in urls:
+                        # The same file (e.g. a shared index) may be listed
+                        # for more than one observation or product type
+                        local_path = dest_path(dest, opusid, url)
+                        if local_path in seen:
+                            continue
+                        seen.add(local_path)
+                        yield url, local_path
+
+    def download_products(self, query=None, product_types=None, dest='.',
+                          startobs=1, limit=None, paging_limit=None,
+                          max_workers=None, progress=None,
+                          progress_interval=None, dest_path=None,
+                          transport=None):
+        """Download the product files for the results of a search.
+
+        Product URLs are read from files.json as the search is paged and
+        handed to a ProductDownloader, so downloads start before the search
+        is complete. Files already present with the right size are skipped
+        and partial files left by an earlier run are resumed.
+
+        :param product_types: If specified, a list of product types to
+            download (e.g. ['coiss_raw', 'coiss_calib']).
+        :param dest: The directory to download into.
+        :param max_workers: If specified, the number of files to download at
+            once (defaults to 4).
+        :param progress: If specified, a function called periodically with a
+            DownloadProgress.
+        :param dest_path: If specified, a function (dest, opusid, url) that
+            returns the local path for a product (defaults to
+            dest/opusid/filename).
+        :param transport: If specified, the Transport to use for the
+            downloads. Product files are usually on a different host than
+            the API server so a separate pool is used by default.
+
+        Returns the final DownloadProgress.
+        """
+        if dest_path is None:
+            dest_path = product_dest_path
+        downloader = ProductDownloader(transport=transport,
+                                       max_workers=max_workers,
+                                       progress=progress,
+                                       progress_interval=progress_interval)
+        return downloader.download(self._iter_product_downloads(
+                                        query, product_types, dest, startobs,
+                                        limit, paging_limit, dest_path))
+
+    ### Browse Image Stacks
+
+    def _iter_image_urls(self, query, startobs, limit, paging_limit, size):
+        """Yield (opusid, image info) pairs for the results of a search."""
+        for result in self.get_images(query=query, startobs=startobs,
+                                      limit=limit, paging_limit=paging_limit,
+                                      size=size):
+            if 'opusid' in result:
+                yield result['opusid'], result
+            else:
+                yield from result.items()
+
+    def get_image_stack(self, path, query=None, size='thumb', height=None,
+                        width=None, mode='L', startobs=1, limit=None,
+                        paging_limit=None, max_workers=None,
+                        decode_workers=None, transport=None):
+        """Download the browse images for a search into a memory-mapped
+        NumPy stack.
+
+        The stack is allocated for the search's result count (or limit) and
+        filled by an ImageStackFetcher as images.json is paged. Images that
+        aren't height x width are resized.
+
+        :param path: The .npy file to create. The OPUS ID of each row is
+            written next to it (see load_image_stack).
+        :param size: The browse image size: 'thumb', 'small', 'med' or
+            'full'.
+        :param height: If specified, the height of each row in pixels
+            (defaults to the height of the first image).
+        :param width: If specified, the width of each row in pixels (defaults
+            to the width of the first image).
+        :param mode: 'L' for grayscale (N x height x width) or 'RGB'
+            (N x height x width x 3).
+        :param max_workers: If specified, the number of images to download
+            at once (defaults to 8).
+        :param decode_workers: If specified, the number of processes used to
+            decode images (defaults to the number of CPUs).
+        :param transport: If specified, the Transport to use for the image
+            downloads.
+
+        Returns a tuple (stack, opusids, failures); see
+        ImageStackFetcher.fetch. Requires Pillow.
+        """
+        if size is None:
+            raise ValueError
+        count = max(0, self.get_count(query)-startobs+1)
+        if limit is not None:
+            count = min(count, limit)
+        images = self._iter_image_urls(query, startobs, count or None,
+                                       paging_limit, size)
+        first = next(images, None)
+        if first is not None:
+            images = itertools.chain([first], images)
+        if height is None:
+            height = 0 if first is None else int(first[1]['height'])
+        if width is None:
+            width = 0 if first is None else int(first[1]['width'])
+        fetcher = ImageStackFetcher(transport=transport,
+                                    max_workers=max_workers,
+                                    decode_workers=decode_workers, mode=mode)
+        return fetcher.fetch(((opusid, info['url'])
+                              for opusid, info in images),
+                             path, count, height, width)
+
+    ### Joined Observations
+
+    @staticmethod
+    def _index_by_opusid(data):
+        """Return files.json or images.json data as a dict indexed by OPUS ID."""
+        if isinstance(data, dict):
+            return data
+        return {datum['opusid']: datum for datum in data}
+
+    @hide_paging('data')
+    def _get_observations_raw(self, query, startobs, limit, fields=None,
+                              product_types=None, image_size=None):
+        """Return one page of joined metadata, files and images.
+
+        The files.json and images.json calls for the page window run on
+        separate threads while data.json runs on this one.
+        """
+        fieldids = self._normalize_fields(fields).split(',')
+        opusid_idx = fieldids.index('opusid')
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            files_future = executor.submit(self._get_files_page, query,
+                                           startobs, limit,
+                                           product_types=product_types)
+            images_future = executor.submit(self._get_images_page, query,
+                                            startobs, limit, size=image_size)
+            metadata = self._get_metadata_page(query, startobs, limit,
+                                               fields=fieldids)
+            files = self._index_by_opusid(files_future.result()['data'])
+            images = self._index_by_opusid(images_future.result()['data'])
+
+        records = []
+        for row in metadata['page']:
+            opusid = row[opusid_idx]
+            records.append({'opusid': opusid,
+                            'metadata': dict(zip(fieldids, row)),
+                            'files': files.get(opusid),
+                            'images': images.get(opusid)})
+        return {'data': records,
+                'count': metadata['count'],
+                'available': metadata['available']}
+
+    def get_observations(self, query=None, fields=None, product_types=None,
+                         image_size=None, startobs=1, limit=None,
+                         paging_limit=None, max_workers=None,
+                         prefetch_pages=None):
+        """Return joined metadata, product files and browse images for the
+        results of a search.
+
+        For each page window data.json, files.json and images.json are
+        requested concurrently and joined by OPUS ID, so the search is only
+        traversed once. Each element is a dict:
+
+            {'opusid': 'co-iss-n1454725799',
+             'metadata': {'opusid': 'co-iss-n1454725799', 'time1': ...},
+             'files': {'coiss_raw': [...], 'coiss_calib': [...], ...},
+             'images': {'url': ..., 'width': ..., ...}}
+
+        'files' or 'images' is None if the server returned nothing for that
+        OPUS ID. max_workers and prefetch_pages fetch several page windows
+        at once as for get_metadata.
+        """
+        fieldids = self._normalize_fields(fields).split(',')
+        if 'opusid' not in fieldids:
+            fieldids = ['opusid'] + fieldids
+        return self._get_observations_raw(query=query, startobs=startobs,
+                                          limit=limit,
+                                          paging_limit=paging_limit,
+                                          max_workers=max_workers,
+                                          prefetch_pages=prefetch_pages,
+                                          fields=fieldids,
+                                          product_types=product_types,
+                                          image_size=image_size)
@@ -3,35 +3,241 @@
 OPUSAPI class
 """
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from functools import wraps
+from itertools import islice
 import json
 import pandas as pd
+try:
+    import orjson
+except ImportError:
+    orjson = None
 import requests
+import threading
+import time
+from urllib.parse import urlencode
 import warnings
 
+from .fieldcache import FieldCache
+from .metrics import RequestEvent
+from .paging import AdaptivePaging
+from .transport import Transport
+
 _DEFAULT_OPUS_SERVER = 'https://opus.pds-rings.seti.org'
 _DEFAULT_FIELDS = ['opusid']
+# Threads shared by the column group requests of split data.json pages
+_DEFAULT_COLUMN_WORKERS = 8
+# orjson, if installed, decodes responses several times faster
+_json_loads = json.loads if orjson is None else orjson.loads
+# Request failures that are worth retrying with a Governor
+_RETRYABLE_EXCEPTIONS = (requests.ConnectionError, requests.Timeout,
+                         requests.exceptions.ChunkedEncodingError)
+
+class _RequestFailed(RuntimeError):
+    """An OPUS API request answered with an HTTP error status."""
+    def __init__(self, message, status_code):
+        super(_RequestFailed, self).__init__(message)
+        self.status_code = status_code
+
+def _is_transient_failure(e):
+    """Return True if a failed page may succeed if it's tried again (with a
+    smaller page size): a timeout, dropped connection, 429 or 5xx."""
+    if isinstance(e, _RequestFailed):
+        return e.status_code == 429 or e.status_code >= 500
+    return isinstance(e, _RETRYABLE_EXCEPTIONS)
+
+def _fetch_pages_serial(self, method, query, startobs, limit, paging_limit,
+                        method_kwargs):
+    """Fetch pages one after another, each one after the previous arrives."""
+    count = 0
+    while limit is None or count < limit:
+        page_limit = paging_limit
+        if limit is not None:
+            page_limit = min(paging_limit, limit-count)
+        ret = method(self, query, startobs, page_limit, **method_kwargs)
+        yield ret
+        returned_count = ret['count']
+        count += returned_count
+        available = ret['available']
+        startobs += returned_count
+        if startobs > available or returned_count == 0:
+            break
+
+def _fetch_pages_adaptive(self, method, query, startobs, limit, pager,
+                          method_kwargs):
+    """Fetch pages one after another, letting pager choose each page size."""
+    count = 0
+    while limit is None or count < limit:
+        page_limit = pager.limit
+        if limit is not None:
+            page_limit = min(page_limit, limit-count)
+        self._call_stats.num_bytes = None
+        start_time = time.monotonic()
+        try:
+            ret = method(self, query, startobs, page_limit, **method_kwargs)
+        except (RuntimeError, requests.RequestException) as e:
+            if not _is_transient_failure(e) or not pager.record_error():
+                raise
+            if self._verbose:
+                print(f'OPUSAPI page failed, retrying with limit {pager.limit}')
+            continue
+        elapsed = time.monotonic() - start_time
+        returned_count = ret['count']
+        pager.record(page_limit, returned_count, elapsed,
+                     self._call_stats.num_bytes,
+                     capped=(returned_count < page_limit and
+                             startobs+returned_count <= ret['available']))
+        yield ret
+        count += returned_count
+        available = ret['available']
+        startobs += returned_count
+        if startobs > available or returned_count == 0:
+            break
+
+def _fetch_pages_prefetch(self, method, query, startobs, limit, paging_limit,
+                          max_workers, prefetch_pages, method_kwargs):
+    """Fetch pages concurrently on a thread pool but yield them in order.
+
+    The first page is fetched by itself to learn how many results are
+    available; after that all remaining startobs offsets are known and at
+    most prefetch_pages of them are in flight (or completed but not yet
+    consumed) at any time. If a later page comes back short (the server's
+    page size cap went down or the results shrank) the rest of its window is
+    fetched serially before moving on, so no results are skipped.
+    """
+    page_limit = paging_limit
+    if limit is not None:
+        page_limit = min(paging_limit, limit)
+    ret = method(self, query, startobs, page_limit, **method_kwargs)
+    yield ret
+    returned_count = ret['count']
+    if returned_count == 0:
+        return
+    last_obs = ret['available']
+    if limit is not None:
+        last_obs = min(last_obs, startobs+limit-1)
+    # The server may cap the page size below what we asked for, so step by
+    # what it actually returned
+    step = min(paging_limit, returned_count)
+    offsets = iter(range(startobs+returned_count, last_obs+1, step))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    pending = deque()
+    def _submit(next_startobs):
+        page_limit = min(step, last_obs-next_startobs+1)
+        pending.append((next_startobs, page_limit,
+                        executor.submit(method, self, query, next_startobs,
+                                        page_limit, **method_kwargs)))
+    try:
+        for next_startobs in islice(offsets, prefetch_pages):
+            _submit(next_startobs)
+        while pending:
+            page_startobs, page_limit, future = pending.popleft()
+            ret = future.result()
+            next_startobs = next(offsets, None)
+            if next_startobs is not None:
+                _submit(next_startobs)
+            yield ret
+            returned_count = ret['count']
+            while returned_count < page_limit:
+                page_startobs += returned_count
+                page_limit -= returned_count
+                if returned_count == 0 or page_startobs > ret['available']:
+                    # The results ended early
+                    return
+                ret = method(self, query, page_startobs, page_limit,
+                             **method_kwargs)
+                yield ret
+                returned_count = ret['count']
+    finally:
+        for _, _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 def hide_paging(data_name):
-    """Automatically retrieve pages from OPUS and yield them in one stream."""
+    """Automatically retrieve pages from OPUS and yield them in one stream.
+
+    The decorated method accepts these additional keyword arguments:
+
+        paging_limit    The number of results to request per page
+                        (defaults to 100).
+        max_workers     If specified, fetch pages concurrently using this
+                        many threads. Results are still yielded in order.
+        prefetch_pages  If specified, the maximum number of pages that may be
+                        in flight or waiting to be consumed at once when
+                        fetching concurrently (defaults to twice
+                        max_workers). This bounds the memory used.
+        adaptive        If True or an AdaptivePaging, tune the page size
+                        for each page based on how long the previous pages
+                        took; paging_limit is then only the initial size.
+                        This can't be combined with concurrent fetching.
+        by_page         If True, yield the data from each page as a whole
+                        (a list for data.json or a dict indexed by OPUS ID
+                        for files.json and images.json) instead of one
+                        result at a time.
+
+    When fetching concurrently, max_workers should not exceed the
+    pool_maxsize of the Transport or connections will not be reused.
+    """
     # TODOAPI: The fact that we need to have a "data_name" here is an
     # inconsistency in the API.
     def _hide_paging(method):
         @wraps(method)
         def _impl(self, query=None, startobs=1, limit=None,
-                  paging_limit=100, **method_kwargs):
+                  paging_limit=100, max_workers=None, prefetch_pages=None,
+                  adaptive=None, by_page=False, **method_kwargs):
             if startobs < 1:
                 raise ValueError
             if limit is not None and limit < 1:
                 raise ValueError
             if paging_limit is None:
                 paging_limit = 100
+            if paging_limit < 1:
+                raise ValueError
+            if query is not None:
+                # Validate the query once instead of on every page
+                query = query.compile(opusapi=self)
+            if adaptive:
+                if max_workers is not None or prefetch_pages is not None:
+                    raise RuntimeError('Adaptive paging can not be used with '
+                                       'max_workers or prefetch_pages')
+                pager = (adaptive if isinstance(adaptive, AdaptivePaging)
+                                  else AdaptivePaging())
+                pager.start(paging_limit)
+                pages = _fetch_pages_adaptive(self, method, query, startobs,
+                                              limit, pager, method_kwargs)
+            elif max_workers is None and prefetch_pages is None:
+                pages = _fetch_pages_serial(self, method, query, startobs,
+                                            limit, paging_limit,
+                                            method_kwargs)
+            else:
+                if max_workers is None:
+                    max_workers = prefetch_pages
+                if prefetch_pages is None:
+                    prefetch_pages = max_workers * 2
+                if max_workers < 1 or prefetch_pages < 1:
+                    raise ValueError
+                pages = _fetch_pages_prefetch(self, method, query, startobs,
+                                              limit, paging_limit,
+                                              max_workers, prefetch_pages,
+                                              method_kwargs)
             count = 0
-            while limit is None or count < limit:
-                ret = method(self, query, startobs, paging_limit,
-                             **method_kwargs)
+            for ret in pages:
                 data = ret[data_name]
-                returned_count = ret['count']
+                if by_page:
+                    if limit is not None and count+len(data) > limit:
+                        if isinstance(data, dict):
+                            data = dict(islice(data.items(), limit-count))
+                        else:
+                            data = data[:limit-count]
+                    yield data
+                    count += len(data)
+                    if limit is not None and count >= limit:
+                        pages.close()
+                        break
+                    continue
                 # TODOAPI: The fact that we return both dicts and lists
                 # for different calls is an inconsistency in the API
                 if isinstance(data, dict):
@@ -48,9 +254,8 @@ def hide_paging(data_name):
                         count += 1
                         if limit is not None and count >= limit:
                             break
-                available = ret['available']
-                startobs += returned_count
-                if startobs > available:
+                if limit is not None and count >= limit:
+                    pages.close()
                     break
         return _impl
     return _hide_paging
@@ -60,8 +265,14 @@ class OPUSAPIRaw(object):
        raw results from API calls. It is generally not recommended to use
        such a low level in application programs, but instead to use classes
        that build on the raw results to provide a nicer interface.
+
+       Responses are decoded with orjson if it is installed, which is
+       several times faster than the standard json module; it is an
+       optional dependency (see requirements.txt).
     """
-    def __init__(self, server=None, default_fields=None, verbose=False):
+    def __init__(self, server=None, default_fields=None, verbose=False,
+                 transport=None, field_cache=None, cache=None, metrics=None,
+                 governor=None):
         """Constructor for the OPUSAPIRaw class.
 
         :param server: If specified, will override the OPUS API server to talk
@@ -70,8 +281,34 @@ class OPUSAPIRaw(object):
             fields to return if none of specified in future method calls
             (defaults to ['opusid']).
         :param verbose: If specified, provides verbose debugging output.
+        :param transport: If specified, the Transport to use for HTTP requests.
+            A Transport may be shared between multiple instances and threads.
+            If not specified, a new pooled Transport is created for this
+            instance when it makes its first HTTP request.
+        :param field_cache: If specified, a FieldCache used to keep the OPUS
+            field registry on disk so that it is shared between processes.
+        :param cache: If specified, a ResponseCache used to avoid repeating
+            identical API calls.
+        :param metrics: If specified, a Metrics that receives a RequestEvent
+            for every API call.
+        :param governor: If specified, a Governor that limits the rate and
+            concurrency of API calls and retries the ones that fail
+            transiently. A Governor may be shared between multiple
+            instances and threads. If not specified, calls are not limited
+            and failures are not retried.
         """
         self._verbose = verbose
+        self._governor = governor
+        self._cache = cache
+        self._metrics = metrics
+        # Per-thread information about the most recent API call
+        self._call_stats = threading.local()
+        self._transport = transport
+        self._owns_transport = transport is None
+        self._transport_lock = threading.Lock()
+        # Created on the first page split into column groups
+        self._column_executor = None
+        self._column_executor_lock = threading.Lock()
 
         if server is None:
             server = _DEFAULT_OPUS_SERVER
@@ -84,8 +321,12 @@ class OPUSAPIRaw(object):
 
         self._default_fields = (_DEFAULT_FIELDS if default_fields is None
                                                 else default_fields)
+        self._field_cache = field_cache
+        self._field_cache_entry = None
         self._raw_fields_cache = None
         self._raw_fields_as_df_cache = None
+        # Validated field lists, by the fields passed to _normalize_fields
+        self._normalized_fields_cache = {}
 
     def __str__(self):
         return self._server
@@ -93,26 +334,166 @@ class OPUSAPIRaw(object):
     def __repr__(self):
         return 'OPUSAPIRaw for server '+self._server
 
-    def _call_opus_api(self, endpoint, return_format, params={}):
-        """Make a call to the OPUS sever for a specific endpoint."""
+    def close(self):
+        """Release the threads and connections held by this instance.
+
+        A Transport passed to the constructor is left open. The instance
+        may still be used afterwards; it creates them again as needed.
+        """
+        with self._column_executor_lock:
+            if self._column_executor is not None:
+                self._column_executor.shutdown(wait=True)
+                self._column_executor = None
+        with self._transport_lock:
+            if self._owns_transport and self._transport is not None:
+                self._transport.close()
+                self._transport = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def transport(self):
+        """Return the Transport used for HTTP requests."""
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    self._transport = Transport()
+        return self._transport
+
+    def _request_opus_api(self, endpoint, return_format, params={},
+                          headers=None):
+        """Make a call to the OPUS sever and return the HTTP response, with
+        its body already read, and the RequestEvent for the call (None if
+        metrics are not being collected)."""
         request_url = self._server+'/api/'+endpoint+'.'+return_format
         if self._verbose:
             print(f'OPUSAPI request {request_url} params {params}')
-        r = requests.get(request_url, params=params)
+        event = None
+        if self._metrics is not None:
+            event = RequestEvent(endpoint+'.'+return_format, url=request_url,
+                                 params_size=len(urlencode(params or {})))
+        governor = self._governor
+        transport = self.transport
+        start_time = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt_start_time = time.perf_counter()
+            try:
+                with (nullcontext() if governor is None
+                                    else governor.slot()):
+                    r = transport.get(request_url, params=params,
+                                            headers=headers, stream=True)
+                    first_byte_time = time.perf_counter()
+                    body = r.content
+            except requests.RequestException as e:
+                if (governor is None or attempt >= governor.max_retries or
+                        not isinstance(e, _RETRYABLE_EXCEPTIONS)):
+                    if event is not None:
+                        event.error = repr(e)
+                        event.total_time = time.perf_counter() - start_time
+                        self._metrics.record(event)
+                    raise
+                delay = governor.retry_delay(attempt)
+            else:
+                if (r.ok or governor is None or
+                        attempt >= governor.max_retries or
+                        not governor.is_retryable_status(r.status_code)):
+                    break
+                delay = governor.retry_delay(
+                            attempt,
+                            governor.parse_retry_after(
+                                r.headers.get('Retry-After')))
+            if self._verbose:
+                print(f'OPUSAPI retrying {request_url} in {delay:.2f}s')
+            time.sleep(delay)
+            attempt += 1
+            if event is not None:
+                event.retries = attempt
+        end_time = time.perf_counter()
+        if event is not None:
+            event.status = r.status_code
+            event.connect_time = getattr(r, 'connect_time', None)
+            event.first_byte_time = first_byte_time - attempt_start_time
+            event.body_time = end_time - first_byte_time
+            event.total_time = end_time - start_time
+            # Count the bytes on the wire, which are compressed if the
+            # server used gzip
+            try:
+                event.num_bytes = r.raw.tell()
+            except AttributeError:
+                event.num_bytes = len(body)
         if not r.ok:
-            raise RuntimeError(f'OPUSAPI request failed: {request_url} ' +
-                               f' with params {params}')
-        return r.json()
+            if event is not None:
+                event.error = f'HTTP status {r.status_code}'
+                self._metrics.record(event)
+            raise _RequestFailed(f'OPUSAPI request failed: {request_url} ' +
+                                 f' with params {params}', r.status_code)
+        return r, event
+
+    def _call_opus_api_response(self, endpoint, return_format, params={},
+                                headers=None):
+        """Make a call to the OPUS sever and return the HTTP response."""
+        r, event = self._request_opus_api(endpoint, return_format,
+                                          params=params, headers=headers)
+        if event is not None:
+            self._metrics.record(event)
+        return r
+
+    def _call_opus_api(self, endpoint, return_format, params={}):
+        """Make a call to the OPUS sever for a specific endpoint."""
+        cache_endpoint = endpoint+'.'+return_format
+        if self._cache is not None:
+            body = self._cache.get(self._server, cache_endpoint, params)
+            if body is not None:
+                if self._verbose:
+                    print(f'OPUSAPI cached {cache_endpoint} params {params}')
+                self._call_stats.num_bytes = len(body)
+                if self._metrics is None:
+                    return _json_loads(body)
+                event = RequestEvent(cache_endpoint,
+                                     params_size=len(urlencode(params or {})))
+                event.cached = True
+                start_time = time.perf_counter()
+                ret = _json_loads(body)
+                event.decode_time = time.perf_counter() - start_time
+                event.total_time = event.decode_time
+                self._metrics.record(event)
+                return ret
+        r, event = self._request_opus_api(endpoint, return_format,
+                                          params=params)
+        body = r.content
+        self._call_stats.num_bytes = len(body)
+        decode_start_time = time.perf_counter()
+        ret = _json_loads(body)
+        if event is not None:
+            event.decode_time = time.perf_counter() - decode_start_time
+            event.total_time += event.decode_time
+            self._metrics.record(event)
+        if self._cache is not None:
+            self._cache.put(self._server, cache_endpoint, params, body)
+        return ret
 
     @property
-    def raw_fields(self):
-        """Return the raw set of OPUS fields as a dict indexed by fieldid."""
-        if self._raw_fields_cache is not None:
-            return self._raw_fields_cache
+    def metrics(self):
+        """Return the Metrics or None if there isn't one."""
+        return self._metrics
+
+    @property
+    def governor(self):
+        """Return the Governor or None if there isn't one."""
+        return self._governor
 
-        fields_json = self._call_opus_api('fields', 'json')
-        fields_ret = fields_json['data']
+    @property
+    def cache(self):
+        """Return the ResponseCache or None if there isn't one."""
+        return self._cache
 
+    @staticmethod
+    def _clean_raw_fields(fields_ret):
         # Get rid of unnecessary fields that are present for backwards
         # compatibility
         for raw_fieldid in fields_ret:
@@ -120,8 +501,76 @@ class OPUSAPIRaw(object):
                 del fields_ret[raw_fieldid]['slug']
             if 'old_slug' in fields_ret[raw_fieldid]:
                 del fields_ret[raw_fieldid]['old_slug']
+        return fields_ret
+
+    def _load_raw_fields(self):
+        """Retrieve the raw fields, using the field cache if there is one."""
+        if self._field_cache is None:
+            fields_json = self._call_opus_api('fields', 'json')
+            return self._clean_raw_fields(fields_json['data'])
+
+        entry = self._field_cache.load(self._server)
+        if entry is not None and self._field_cache.is_fresh(entry):
+            self._field_cache_entry = entry
+            return entry['raw_fields']
+
+        try:
+            r = self._call_opus_api_response(
+                        'fields', 'json',
+                        headers=FieldCache.validation_headers(entry))
+        except (RuntimeError, requests.RequestException):
+            if entry is None:
+                raise
+            warnings.warn('Unable to revalidate OPUS fields; using stale '
+                          'cached copy')
+            self._field_cache_entry = entry
+            return entry['raw_fields']
+
+        if r.status_code == 304 and entry is not None:
+            try:
+                entry = self._field_cache.touch(entry)
+            except OSError as e:
+                warnings.warn(f'Unable to update OPUS field cache: {e}')
+            self._field_cache_entry = entry
+            return entry['raw_fields']
+
+        fields_ret = self._clean_raw_fields(r.json()['data'])
+        try:
+            self._field_cache_entry = self._field_cache.store(
+                                            self._server, fields_ret,
+                                            headers=r.headers)
+        except OSError as e:
+            warnings.warn(f'Unable to update OPUS field cache: {e}')
+        return fields_ret
+
+    def _get_derived_field_cache(self, name):
+        """Return a structure derived from the fields from the disk cache."""
+        if self._field_cache_entry is None:
+            return None
+        return self._field_cache.load_derived(self._field_cache_entry, name)
+
+    def _set_derived_field_cache(self, name, value):
+        """Save a structure derived from the fields in the disk cache."""
+        if self._field_cache_entry is None:
+            return
+        try:
+            self._field_cache.store_derived(self._field_cache_entry, name,
+                                            value)
+        except OSError as e:
+            warnings.warn(f'Unable to update OPUS field cache: {e}')
 
-        self._raw_fields_cache = fields_ret
+    @property
+    def field_cache(self):
+        """Return the FieldCache or None if there isn't one."""
+        return self._field_cache
+
+    @property
+    def raw_fields(self):
+        """Return the raw set of OPUS fields as a dict indexed by fieldid."""
+        if self._raw_fields_cache is not None:
+            return self._raw_fields_cache
+
+        self._raw_fields_cache = self._load_raw_fields()
         return self._raw_fields_cache
 
     @property
@@ -187,13 +636,19 @@ class OPUSAPIRaw(object):
     def _normalize_fields(self, fields):
         if fields is None:
             fields = self.default_fields
+        key = fields if isinstance(fields, str) else tuple(fields)
+        ret = self._normalized_fields_cache.get(key)
+        if ret is not None:
+            return ret
         if isinstance(fields, str):
             fields = fields.split(',')
         raw_fields = self.raw_fields
         for field in fields:
             if field not in raw_fields:
                 raise RuntimeError(f'Unknown field id "{field}"')
-        return ','.join(fields)
+        ret = ','.join(fields)
+        self._normalized_fields_cache[key] = ret
+        return ret
 
     def _normalize_product_types(self, product_types):
         if product_types is None:
@@ -202,8 +657,125 @@ class OPUSAPIRaw(object):
         # and then validate them here
         return ','.join(product_types)
 
+    def _get_metadata_page(self, query, startobs, limit, fields=None,
+                           max_columns=None):
+        """Return the raw response for one page of data.json.
+
+        If max_columns is given and more distinct fields than that are
+        requested, the fields are split into several narrower requests for
+        the same page (see _get_metadata_page_split).
+        """
+        cols = self._normalize_fields(fields)
+        if max_columns is not None:
+            fieldids = cols.split(',')
+            if len(set(fieldids)) > max_columns:
+                return self._get_metadata_page_split(query, startobs, limit,
+                                                     fieldids, max_columns)
+        params = {} if query is None else query.get_api_params(opusapi=self)
+        params['startobs'] = startobs
+        params['limit'] = limit
+        params['cols'] = cols
+        res = self._call_opus_api('data', 'json', params=params)
+        return res
+
+    def _get_metadata_page_split(self, query, startobs, limit, fieldids,
+                                 max_columns):
+        """Return one page of data.json fetched as column groups.
+
+        The fields are split into groups of at most max_columns, each
+        including opusid, which are requested concurrently for the same page
+        window. The rows are stitched back together by OPUS ID in the order
+        of the first group and the columns in the requested order. A value
+        missing from a group (because the results changed between the
+        requests) is None.
+        """
+        if max_columns < 2:
+            raise ValueError
+        # Request each field once, even if it was asked for more than once
+        other_fieldids = [fieldid for fieldid in dict.fromkeys(fieldids)
+                          if fieldid != 'opusid']
+        group_size = max_columns - 1
+        groups = [['opusid'] + other_fieldids[idx:idx+group_size]
+                  for idx in range(0, len(other_fieldids), group_size)]
+        def _get_group(group):
+            res = self._get_metadata_page(query, startobs, limit,
+                                          fields=group)
+            # The size is recorded for the thread that made the call
+            return res, self._call_stats.num_bytes
+        results = []
+        num_bytes = 0
+        for res, group_bytes in self._get_column_executor().map(_get_group,
+                                                                groups):
+            results.append(res)
+            num_bytes += group_bytes or 0
+        # Report the size of the whole page on the calling thread
+        self._call_stats.num_bytes = num_bytes
+        rows_by_opusid = [{row[0]: row for row in res['page']}
+                          for res in results]
+        positions = {}
+        for idx, fieldid in enumerate(fieldids):
+            positions.setdefault(fieldid, []).append(idx)
+        page = []
+        for opusid in (row[0] for row in results[0]['page']):
+            row = [None] * len(fieldids)
+            for idx in positions.get('opusid', ()):
+                row[idx] = opusid
+            for group, group_rows in zip(groups, rows_by_opusid):
+                group_row = group_rows.get(opusid)
+                if group_row is None:
+                    continue
+                for fieldid, val in zip(group[1:], group_row[1:]):
+                    for idx in positions[fieldid]:
+                        row[idx] = val
+            page.append(row)
+        ret = dict(results[0])
+        ret['page'] = page
+        if all('columns' in res for res in results):
+            columns = [None] * len(fieldids)
+            for group, res in zip(groups, results):
+                for fieldid, column in zip(group, res['columns']):
+                    for idx in positions.get(fieldid, ()):
+                        columns[idx] = column
+            ret['columns'] = columns
+        return ret
+
+    def _get_column_executor(self):
+        """Return the thread pool used for the column group requests of
+        split pages, creating it once for this instance (until close)."""
+        if self._column_executor is None:
+            with self._column_executor_lock:
+                if self._column_executor is None:
+                    self._column_executor = ThreadPoolExecutor(
+                                    max_workers=_DEFAULT_COLUMN_WORKERS)
+        return self._column_executor
+
+    def _get_files_page(self, query, startobs, limit, product_types=None):
+        """Return the raw response for one page of files.json."""
+        params = {} if query is None else query.get_api_params(opusapi=self)
+        params['startobs'] = startobs
+        params['limit'] = limit
+        types = self._normalize_product_types(product_types)
+        if types is not None:
+            params['types'] = types
+        res = self._call_opus_api('files', 'json', params=params)
+        return res
+
+    def _get_images_page(self, query, startobs, limit, size=None):
+        """Return the raw response for one page of images.json."""
+        params = {} if query is None else query.get_api_params(opusapi=self)
+        params['startobs'] = startobs
+        params['limit'] = limit
+        image_url = 'images'
+        if size is not None:
+            size = size.lower()
+            assert size in (None, 'thumb', 'small', 'med', 'full')
+            image_url += '/'+size
+        res = self._call_opus_api(image_url, 'json', params=params)
+        return res
+
     @hide_paging('page')
-    def get_metadata_raw(self, query, startobs, limit, fields=None):
+    def get_metadata_raw(self, query, startobs, limit, fields=None,
+                         max_columns=None):
         """Return the results of raw calls to data.json.
 
         This returns a list. Each list element is a list of metadata
@@ -213,13 +785,12 @@ class OPUSAPIRaw(object):
         Example:
             [['co-iss-n1454939333', '2004-02-08T13:25:41.089', '18'],
              ['co-iss-n1454939373', '2004-02-08T13:26:36.496', '2.6']]
+
+        If max_columns is given, a request for more fields than that is
+        split into concurrent requests of at most max_columns columns each.
         """
-        params = {} if query is None else query.get_api_params(opusapi=self)
-        params['startobs'] = startobs
-        params['limit'] = limit
-        params['cols'] = self._normalize_fields(fields)
-        res = self._call_opus_api('data', 'json', params=params)
-        return res
+        return self._get_metadata_page(query, startobs, limit, fields=fields,
+                                       max_columns=max_columns)
 
     @hide_paging('data')
     def get_files_raw(self, query, startobs, limit, product_types=None):
@@ -238,14 +809,8 @@ class OPUSAPIRaw(object):
                 [...]
              }]
         """
-        params = {} if query is None else query.get_api_params(opusapi=self)
-        params['startobs'] = startobs
-        params['limit'] = limit
-        types = self._normalize_product_types(product_types)
-        if types is not None:
-            params['types'] = types
-        res = self._call_opus_api('files', 'json', params=params)
-        return res
+        return self._get_files_page(query, startobs, limit,
+                                    product_types=product_types)
 
     @hide_paging('data')
     def get_images_raw(self, query, startobs, limit, size=None):
@@ -271,13 +836,4 @@ class OPUSAPIRaw(object):
               'url': 'https://pds-rings.seti.org/ ... N1454725799_1_small.jpg',
               'width': 256}]
         """
-        params = {} if query is None else query.get_api_params(opusapi=self)
-        params['startobs'] = startobs
-        params['limit'] = limit
-        image_url = 'images'
-        if size is not None:
-            size = size.lower()
-            assert size in (None, 'thumb', 'small', 'med', 'full')
-            image_url += '/'+size
-        res = self._call_opus_api(image_url, 'json', params=params)
-        return res
+        return self._get_images_page(query, startobs, limit, size=size)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS adaptive paging class
+"""
+
+_DEFAULT_MIN_LIMIT = 10
+_DEFAULT_MAX_LIMIT = 5000
+_DEFAULT_TARGET_LATENCY = 2.
+_DEFAULT_GROWTH = 2.
+_DEFAULT_SHRINK = 0.5
+_DEFAULT_MAX_ERRORS = 3
+
+class AdaptivePaging(object):
+    """AdaptivePaging tunes the page size used by hide_paging on the fly.
+
+       After each page the time the call took (and optionally the size of
+       the response) is compared to a target. The next page is made larger
+       if the response was fast or small and smaller if it was slow or
+       large, by at most a factor of growth or shrink per page and always
+       within [min_limit, max_limit]. A failed call shrinks the page and is
+       retried; after max_errors consecutive failures at min_limit the error
+       is raised.
+
+       If the server returns fewer results than asked for while more are
+       available, its page size cap has been reached. The returned count is
+       then used as the page size the call took, and later pages never ask
+       for more than the cap.
+
+       An AdaptivePaging keeps what it has learned between searches, so the
+       same instance can be reused for similar searches. It should not be
+       used by more than one search at a time.
+    """
+    def __init__(self, min_limit=None, max_limit=None, initial_limit=None,
+                 target_latency=None, target_bytes=None, growth=None,
+                 shrink=None, max_errors=None):
+        """Constructor for the AdaptivePaging class.
+
+        :param min_limit: If specified, the smallest page size to use
+            (defaults to 10).
+        :param max_limit: If specified, the largest page size to use
+            (defaults to 5000).
+        :param initial_limit: If specified, the page size to start with
+            (defaults to the paging_limit passed to the paged method).
+        :param target_latency: If specified, the number of seconds each page
+            should take (defaults to 2).
+        :param target_bytes: If specified, the number of bytes each response
+            should be. If both targets are given the stricter one wins.
+        :param growth: If specified, the largest factor to grow the page size
+            by after one page (defaults to 2).
+        :param shrink: If specified, the smallest factor to shrink the page
+            size by after one page (defaults to 0.5).
+        :param max_errors: If specified, the number of consecutive failures
+            at min_limit before giving up (defaults to 3).
+        """
+        self._min_limit = _DEFAULT_MIN_LIMIT if min_limit is None else min_limit
+        self._max_limit = _DEFAULT_MAX_LIMIT if max_limit is None else max_limit
+        if self._min_limit < 1 or self._max_limit < self._min_limit:
+            raise ValueError
+        self._target_latency = (_DEFAULT_TARGET_LATENCY
+                                if target_latency is None else target_latency)
+        self._target_bytes = target_bytes
+        self._growth = _DEFAULT_GROWTH if growth is None else growth
+        self._shrink = _DEFAULT_SHRINK if shrink is None else shrink
+        if self._growth < 1 or not 0 < self._shrink <= 1:
+            raise ValueError
+        self._max_errors = (_DEFAULT_MAX_ERRORS if max_errors is None
+                                                else max_errors)
+        self._server_cap = None
+        self._limit = None
+        if initial_limit is not None:
+            self._limit = self._clamp(initial_limit)
+        self._errors = 0
+
+    def __repr__(self):
+        return (f'AdaptivePaging(limit={self._limit},'
+                f'min_limit={self._min_limit},max_limit={self._max_limit},'
+                f'server_cap={self._server_cap})')
+
+    def _clamp(self, limit):
+        limit = max(self._min_limit, min(self._max_limit, limit))
+        if self._server_cap is not None:
+            limit = min(limit, self._server_cap)
+        return int(limit)
+
+    @property
+    def limit(self):
+        """Return the page size to use for the next page."""
+        return self._limit
+
+    def start(self, paging_limit):
+        """Set the initial page size if one hasn't been learned yet."""
+        if self._limit is None:
+            self._limit = self._clamp(paging_limit)
+
+    @property
+    def server_cap(self):
+        """Return the server's page size cap if one was seen or None."""
+        return self._server_cap
+
+    def record(self, limit, returned_count, elapsed, num_bytes=None,
+               capped=False):
+        """Record the result of a successful page and pick the next size.
+
+        capped should be True if fewer than limit results were returned
+        although more were available.
+        """
+        self._errors = 0
+        if capped and returned_count > 0:
+            self._server_cap = returned_count
+            limit = returned_count
+        elif returned_count < limit or returned_count == 0:
+            # A short page (the end of the results) says nothing about how
+            # long a full page would take
+            return
+        ratio = self._growth
+        if elapsed > 0:
+            ratio = min(ratio, self._target_latency / elapsed)
+        if self._target_bytes is not None and num_bytes:
+            ratio = min(ratio, self._target_bytes / num_bytes)
+        ratio = max(ratio, self._shrink)
+        self._limit = self._clamp(limit * ratio)
+
+    def record_error(self):
+        """Record a failed page. Return True if it should be retried with
+        the new (smaller) page size."""
+        if self._limit <= self._min_limit:
+            self._errors += 1
+            return self._errors < self._max_errors
+        self._limit = self._clamp(self._limit * self._shrink)
+        return True
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS query planning functions
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import math
+from urllib.parse import quote_plus, urlencode
+
+from .query import OR, MultQuery, Query, RangeQuery, StringQuery
+from .shard import harvest_shards
+
+_DEFAULT_PLAN_MAX_URL_LENGTH = 8000
+_DEFAULT_PLAN_WORKERS = 4
+_DEFAULT_PLAN_PAGE_SIZE = 100
+# qtypes for which OR of overlapping ranges equals their union
+_MERGEABLE_RANGE_QTYPES = (None, 'any')
+
+class PlannedQuery(object):
+    """One of the sub-queries of a QueryPlan."""
+    def __init__(self, query, estimated_count=None):
+        self.query = query
+        self.estimated_count = estimated_count
+
+    def __repr__(self):
+        return (f'PlannedQuery({repr(self.query)},'
+                f'estimated_count={self.estimated_count})')
+
+class QueryPlan(object):
+    """The sub-queries that together return the results of a query.
+
+       Made by plan_query. The union of the sub-queries' results is the
+       query's results; the same observation may match more than one
+       sub-query.
+    """
+    def __init__(self, opusapi, query, pieces, fields):
+        self._opusapi = opusapi
+        self.query = query
+        self.pieces = pieces
+        self.fields = fields
+
+    def __repr__(self):
+        return f'QueryPlan({repr(self.query)},{len(self.pieces)} queries)'
+
+    def __len__(self):
+        return len(self.pieces)
+
+    def estimate(self, paging_limit=None, max_workers=None):
+        """Retrieve the result count of every sub-query, concurrently.
+
+        Each PlannedQuery's estimated_count is filled in. Returns a dict with
+        the number of queries, the total count (an upper bound because the
+        sub-queries may overlap) and the number of data.json requests needed
+        at paging_limit rows per page.
+        """
+        if paging_limit is None:
+            paging_limit = _DEFAULT_PLAN_PAGE_SIZE
+        if max_workers is None:
+            max_workers = _DEFAULT_PLAN_WORKERS
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            counts = list(executor.map(
+                            lambda piece: self._opusapi.get_count(piece.query),
+                            self.pieces))
+        for piece, count in zip(self.pieces, counts):
+            piece.estimated_count = count
+        return {'queries': len(self.pieces),
+                'total': sum(counts),
+                'requests': sum(max(1, math.ceil(count/paging_limit))
+                                for count in counts)}
+
+    def get_metadata(self, max_workers=None, prefetch_pages=None,
+                     paging_limit=None):
+        """Run the sub-queries concurrently and yield the metadata rows with
+        duplicates (by OPUS ID) removed."""
+        if max_workers is None:
+            max_workers = _DEFAULT_PLAN_WORKERS
+        return harvest_shards(self._opusapi, self.pieces, fields=self.fields,
+                              max_workers=max_workers,
+                              prefetch_pages=prefetch_pages,
+                              paging_limit=paging_limit)
+
+def _merge_ranges(ranges):
+    """Merge overlapping RangeQuerys ORed together on the same field."""
+    groups = {}
+    ret = []
+    for range_query in ranges:
+        if range_query.qtype not in _MERGEABLE_RANGE_QTYPES:
+            ret.append(range_query)
+            continue
+        groups.setdefault((range_query.qtype, range_query.unit),
+                          []).append(range_query)
+    for (qtype, unit), group in groups.items():
+        group.sort(key=lambda r: -math.inf if r.minimum is None
+                                            else r.minimum)
+        lo, hi = group[0].minimum, group[0].maximum
+        for range_query in group[1:]:
+            if (hi is None or range_query.minimum is None or
+                range_query.minimum <= hi):
+                if hi is not None and (range_query.maximum is None or
+                                       range_query.maximum > hi):
+                    hi = range_query.maximum
+                continue
+            ret.append(RangeQuery(group[0].fieldid, minimum=lo, maximum=hi,
+                                  qtype=qtype, unit=unit))
+            lo, hi = range_query.minimum, range_query.maximum
+        ret.append(RangeQuery(group[0].fieldid, minimum=lo, maximum=hi,
+                              qtype=qtype, unit=unit))
+    return ret
+
+def _canonical_term(term):
+    if isinstance(term, MultQuery):
+        return MultQuery(term.fieldid, sorted(set(term.vals)))
+    if isinstance(term, OR):
+        disjs = {}
+        for disj in term.terms:
+            disjs.setdefault(repr(disj), disj)
+        strings = [disj for disj in disjs.values()
+                   if isinstance(disj, StringQuery)]
+        ranges = _merge_ranges([disj for disj in disjs.values()
+                                if isinstance(disj, RangeQuery)])
+        disjs = sorted(strings + ranges, key=repr)
+        if len(disjs) == 1:
+            return disjs[0]
+        return OR(*disjs)
+    return term
+
+def canonicalize_query(query):
+    """Return an equivalent Query in a canonical form.
+
+    Nested Querys are flattened, identical terms are dropped, MultQuery
+    values and OR terms are deduplicated and sorted, overlapping ranges in
+    an OR are merged and an OR of one term is replaced by the term. Terms are
+    sorted so equivalent queries have the same repr.
+    """
+    if query is None:
+        return None
+    terms = {}
+    pending = [query]
+    while pending:
+        term = pending.pop()
+        if type(term) is Query:
+            pending.extend(term.terms)
+            continue
+        term = _canonical_term(term)
+        terms.setdefault(repr(term), term)
+    return Query(*[terms[key] for key in sorted(terms)])
+
+def _url_length(params, base_length):
+    return base_length + len(urlencode(params))
+
+def _split_term(term, budget, max_values):
+    """Split a MultQuery or OR into the fewest pieces each adding at most
+    budget characters of parameters and max_values values."""
+    if isinstance(term, MultQuery):
+        vals = term.vals
+        sizes = [len(quote_plus(val))+3 for val in vals]
+        overhead = len(urlencode({term.fieldid: ''}))+1
+        make = lambda chunk: MultQuery(term.fieldid, chunk)
+    else:
+        vals = list(term.terms)
+        suffix = len(vals)
+        sizes = [len(urlencode(disj.get_api_params(suffix=suffix)))+1
+                 for disj in vals]
+        overhead = 0
+        make = lambda chunk: chunk[0] if len(chunk) == 1 else OR(*chunk)
+    chunks = []
+    chunk = []
+    length = overhead
+    for val, size in zip(vals, sizes):
+        if chunk and (length+size > budget or
+                      (max_values is not None and len(chunk) >= max_values)):
+            chunks.append(chunk)
+            chunk = []
+            length = overhead
+        chunk.append(val)
+        length += size
+    if chunk:
+        chunks.append(chunk)
+    return [make(chunk) for chunk in chunks]
+
+def _term_size(term):
+    if isinstance(term, MultQuery):
+        return len(term.vals)
+    if isinstance(term, OR):
+        return len(term.terms)
+    return 0
+
+def _split_query(opusapi, query, base_length, max_url_length, max_values):
+    """Split a canonical, validated Query until every piece fits the
+    limits."""
+    params = query.get_api_params()
+    terms = list(query.terms)
+    oversized = [term for term in terms
+                 if max_values is not None and _term_size(term) > max_values]
+    if (_url_length(params, base_length) <= max_url_length and
+        not oversized):
+        return [query]
+    splittable = [term for term in terms if _term_size(term) > 1]
+    if not splittable:
+        raise RuntimeError(f'Query can not be split to fit in '
+                           f'{max_url_length} characters: {repr(query)}')
+    # Split a term with too many values first, otherwise the largest term;
+    # AND distributes over the union of its pieces
+    split_term = max(oversized or splittable,
+                     key=lambda term: len(urlencode(term.get_api_params())))
+    other_terms = [term for term in terms if term is not split_term]
+    other_params = Query(*other_terms).get_api_params()
+    budget = max_url_length - _url_length(other_params, base_length) - 1
+    pieces = _split_term(split_term, max(budget, 1), max_values)
+    if len(pieces) < 2:
+        raise RuntimeError(f'Query can not be split to fit in '
+                           f'{max_url_length} characters: {repr(query)}')
+    ret = []
+    for piece in pieces:
+        ret += _split_query(opusapi, Query(*(other_terms + [piece])),
+                            base_length, max_url_length, max_values)
+    return ret
+
+def plan_query(opusapi, query, fields=None, max_url_length=None,
+               max_values_per_term=None):
+    """Rewrite a query into the fewest sub-queries that fit server limits.
+
+    The query is canonicalized (see canonicalize_query) and validated once.
+    If its data.json URL (with fields and paging parameters) is longer than
+    max_url_length (defaults to 8000) or a MultQuery or OR has more than
+    max_values_per_term values, that MultQuery or OR (otherwise the
+    largest one) is split into as few pieces as fit, repeating for other
+    terms if needed. Raises RuntimeError if the query can't be split to fit.
+
+    Returns a QueryPlan.
+    """
+    if max_url_length is None:
+        max_url_length = _DEFAULT_PLAN_MAX_URL_LENGTH
+    if max_values_per_term is not None and max_values_per_term < 1:
+        raise ValueError
+    query = canonicalize_query(query)
+    cols = opusapi._normalize_fields(fields)
+    if query is None:
+        return QueryPlan(opusapi, None, [PlannedQuery(None)], cols)
+    # Validates every term against the field registry
+    query.get_api_params(opusapi=opusapi)
+    base_length = (len(opusapi._server+'/api/data.json?') +
+                   len(urlencode({'startobs': 999999999,
+                                  'limit': 999999,
+                                  'cols': cols})) + 1)
+    pieces = _split_query(opusapi, query, base_length, max_url_length,
+                          max_values_per_term)
+    return QueryPlan(opusapi, query,
+                     [PlannedQuery(piece) for piece in pieces], cols)
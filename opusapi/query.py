@@ -3,6 +3,61 @@
 OPUS Query class
 """
 
+class CompiledQuery(object):
+    """An immutable, validated set of OPUS API search parameters.
+
+    A CompiledQuery is made by Query.compile, which walks the query tree
+    and validates its fieldids only once. It can be used anywhere a Query
+    can and is hashable, with equal parameters giving equal
+    CompiledQuerys.
+    """
+    __slots__ = ('_items', '_hash', '_source')
+
+    def __init__(self, params, source=None):
+        object.__setattr__(self, '_items', tuple(sorted(params.items())))
+        object.__setattr__(self, '_hash', hash(self._items))
+        object.__setattr__(self, '_source', source)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledQuery is immutable')
+
+    def __str__(self):
+        return 'Compiled ' + str(self._source)
+
+    def __repr__(self):
+        return 'CompiledQuery(' + repr(dict(self._items)) + ')'
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, CompiledQuery):
+            return NotImplemented
+        return self._items == other._items
+
+    def __ne__(self, other):
+        if not isinstance(other, CompiledQuery):
+            return NotImplemented
+        return self._items != other._items
+
+    @property
+    def items(self):
+        """Return the search parameters as a sorted tuple of (key, value)."""
+        return self._items
+
+    @property
+    def source(self):
+        """Return the Query this was compiled from."""
+        return self._source
+
+    def compile(self, opusapi=None):
+        """Return self; a CompiledQuery is already compiled."""
+        return self
+
+    def get_api_params(self, opusapi=None):
+        """Get a copy of the OPUS API parameters required for a search."""
+        return dict(self._items)
+
 class Query(object):
     """Construct a conjunctive (AND) series of queries."""
     def __init__(self, *args):
@@ -23,6 +78,11 @@ class Query(object):
             conj_repr.append(repr(conj))
         return 'Query(' + ','.join(conj_repr) + ')'
 
+    @property
+    def terms(self):
+        """Return the queries that are ANDed together."""
+        return tuple(self._conj_list)
+
     def get_api_params(self, opusapi=None):
         """Get the OPUS API parameters required for a search."""
         params = {}
@@ -32,6 +92,15 @@ class Query(object):
             params = dict(**params, **conj.get_api_params(opusapi=opusapi))
         return params
 
+    def compile(self, opusapi=None):
+        """Validate the query and return it as a CompiledQuery.
+
+        The result can be reused for every page of a search without
+        repeating the validation.
+        """
+        return CompiledQuery(self.get_api_params(opusapi=opusapi),
+                             source=self)
+
 class OR(object):
     """Construct a disjunctive (OR) series of queries."""
     def __init__(self, *args):
@@ -61,6 +130,11 @@ class OR(object):
             disj_repr.append(repr(disj))
         return 'OR(' + ','.join(disj_repr) + ')'
 
+    @property
+    def terms(self):
+        """Return the queries that are ORed together."""
+        return tuple(self._disj_list)
+
     def get_api_params(self, opusapi=None):
         """Get the OPUS API parameters required for a search."""
         params = {}
@@ -71,6 +145,11 @@ class OR(object):
                                                           suffix=idx+1))
         return params
 
+    def compile(self, opusapi=None):
+        """Validate the query and return it as a CompiledQuery."""
+        return CompiledQuery(self.get_api_params(opusapi=opusapi),
+                             source=self)
+
 class MultQuery(Query):
     def __init__(self, fieldid, vals):
         super(MultQuery, self).__init__()
@@ -97,6 +176,10 @@ class MultQuery(Query):
     def fieldid(self):
         return self._fieldid
 
+    @property
+    def vals(self):
+        return tuple(self._vals)
+
     def get_api_params(self, opusapi=None):
         """Get the OPUS API parameters required for a search."""
         if opusapi is not None:
@@ -201,6 +284,22 @@ class RangeQuery(Query):
     def fieldid(self):
         return self._fieldid
 
+    @property
+    def minimum(self):
+        return self._min
+
+    @property
+    def maximum(self):
+        return self._max
+
+    @property
+    def qtype(self):
+        return self._qtype
+
+    @property
+    def unit(self):
+        return self._unit
+
     def get_api_params(self, opusapi=None, suffix=None):
         """Get the OPUS API parameters required for a search."""
         if opusapi is not None:
@@ -232,9 +331,9 @@ class RangeQuery(Query):
         if suffix is not None:
             suffix_str = '_' + str(suffix)
         params = {}
-        if self._min:
+        if self._min is not None:
             params[self._fieldid+'1'+suffix_str] = self._min
-        if self._max:
+        if self._max is not None:
             params[self._fieldid+'2'+suffix_str] = self._max
         if self._min is not None or self._max is not None:
             if self._qtype is not None:
@@ -242,3 +341,44 @@ class RangeQuery(Query):
             if self._unit is not None:
                 params['unit-'+self._fieldid+suffix_str] = self._unit
         return params
+
+class OPUSIDQuery(Query):
+    """Search for a list of observations by OPUS ID."""
+    def __init__(self, opusids):
+        super(OPUSIDQuery, self).__init__()
+        opusids = [opusid.strip() for opusid in opusids]
+        for opusid in opusids:
+            if not opusid or ',' in opusid:
+                raise ValueError(f'Invalid OPUS ID "{opusid}"')
+        if not opusids:
+            raise ValueError('No OPUS IDs')
+        self._opusids = opusids
+
+    def __str__(self):
+        return 'OPUSIDQuery opusid=' + ','.join(self._opusids)
+
+    def __repr__(self):
+        return f'OPUSIDQuery({repr(self._opusids)})'
+
+    @property
+    def fieldid(self):
+        return 'opusid'
+
+    @property
+    def opusids(self):
+        return tuple(self._opusids)
+
+    def get_api_params(self, opusapi=None):
+        """Get the OPUS API parameters required for a search."""
+        if opusapi is not None:
+            try:
+                fields = opusapi.fields
+            except AttributeError:
+                # OPUSAPIRaw doesn't support "fields" so we don't validate
+                pass
+            else:
+                if 'opusid' not in fields:
+                    raise RuntimeError('Unknown field id "opusid"')
+
+        # OPUS searches for any of a comma-separated list of OPUS IDs
+        return {'opusid': ','.join(self._opusids)}
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS lazy search result class
+"""
+
+from collections import OrderedDict
+import threading
+
+_DEFAULT_RESULT_PAGE_SIZE = 100
+_DEFAULT_RESULT_MAX_PAGES = 32
+
+class ResultSet(object):
+    """ResultSet is a lazy, random-access view of the data.json results of
+       a search.
+
+       Nothing is retrieved until it is needed. len() is the search's
+       result count from get_count. Indexing and slicing fetch only the
+       fixed-size pages that hold the requested rows (with more than one
+       API call for a page larger than the server's own page cap), and
+       iteration walks the pages in order. The most recently used pages are
+       kept in an LRU so looking at the same rows again, or iterating again,
+       doesn't repeat the API calls. Rows are lists of strings as returned by
+       get_metadata.
+
+       A ResultSet may be shared by multiple threads. Use refresh() to
+       forget the cached count and pages if the server's results may have
+       changed.
+    """
+    def __init__(self, opusapi, query=None, fields=None, page_size=None,
+                 max_pages=None):
+        """Constructor for the ResultSet class.
+
+        :param opusapi: The OPUSAPI to use to talk to the server.
+        :param query: If specified, the Query to search for.
+        :param fields: If specified, the metadata fields to return (defaults
+            to the OPUSAPI default fields).
+        :param page_size: If specified, the number of rows retrieved per API
+            call (defaults to 100).
+        :param max_pages: If specified, the number of pages to keep (defaults
+            to 32).
+        """
+        self._opusapi = opusapi
+        self._query = None if query is None else query.compile(opusapi=opusapi)
+        self._fields = opusapi._normalize_fields(fields)
+        self._page_size = (_DEFAULT_RESULT_PAGE_SIZE if page_size is None
+                                                     else page_size)
+        self._max_pages = (_DEFAULT_RESULT_MAX_PAGES if max_pages is None
+                                                     else max_pages)
+        if self._page_size < 1 or self._max_pages < 1:
+            raise ValueError
+        self._pages = OrderedDict()
+        self._count = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return (f'ResultSet({repr(self._query)},fields={repr(self._fields)},'
+                f'page_size={self._page_size})')
+
+    @property
+    def fields(self):
+        """Return the metadata fieldids of each row."""
+        return self._fields.split(',')
+
+    def refresh(self):
+        """Forget the cached result count and pages."""
+        with self._lock:
+            self._pages.clear()
+            self._count = None
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._opusapi.get_count(self._query)
+        return self._count
+
+    def _get_page(self, page_num):
+        """Return the rows of one page, from the LRU if possible."""
+        with self._lock:
+            rows = self._pages.get(page_num)
+            if rows is not None:
+                self._pages.move_to_end(page_num)
+                return rows
+        startobs = page_num*self._page_size + 1
+        rows = []
+        # A server that caps its page size returns fewer rows than asked
+        # for; keep asking until the page is full or the results run out
+        while len(rows) < self._page_size:
+            res = self._opusapi._get_metadata_page(
+                                self._query, startobs+len(rows),
+                                self._page_size-len(rows),
+                                fields=self._fields)
+            rows.extend(res['page'])
+            if res['count'] == 0 or startobs+len(rows) > res['available']:
+                break
+        with self._lock:
+            self._pages[page_num] = rows
+            while len(self._pages) > self._max_pages:
+                self._pages.popitem(last=False)
+        return rows
+
+    def _get_row(self, idx):
+        page_num, offset = divmod(idx, self._page_size)
+        rows = self._get_page(page_num)
+        if offset >= len(rows):
+            raise IndexError('ResultSet index out of range')
+        return rows[offset]
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get_row(idx)
+                    for idx in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if key < 0:
+            raise IndexError('ResultSet index out of range')
+        return self._get_row(key)
+
+    def __iter__(self):
+        page_num = 0
+        while True:
+            rows = self._get_page(page_num)
+            yield from rows
+            page_num += 1
+            if (len(rows) < self._page_size or
+                (self._count is not None and
+                 page_num*self._page_size >= self._count)):
+                break
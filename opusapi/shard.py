@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS query sharding functions
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import warnings
+
+import pandas as pd
+
+from .query import Query, RangeQuery
+
+_DEFAULT_SHARD_WORKERS = 4
+_DEFAULT_SHARD_PREFETCH_PAGES = 4
+# Number of cumulative counts to sample per shard when planning
+_DEFAULT_SHARD_RESOLUTION = 8
+# The unit used for range endpoints that are times instead of numbers
+_TIME_SHARD_UNIT = 'jd'
+_JD_EPOCH = pd.Timestamp('2000-01-01T12:00:00')
+_JD_AT_EPOCH = 2451545.
+
+class RangeShard(object):
+    """One piece of a query restricted to part of a range field.
+
+    base_query is the query that was sharded, available its result count
+    and nulls the number of its results with no value for fieldid when the
+    shards were planned (None if unknown). unit is the unit of minimum and
+    maximum.
+    """
+    def __init__(self, query, fieldid, minimum, maximum, estimated_count,
+                 base_query=None, available=None, nulls=None, qtype=None,
+                 unit=None):
+        self.query = query
+        self.fieldid = fieldid
+        self.minimum = minimum
+        self.maximum = maximum
+        self.estimated_count = estimated_count
+        self.base_query = base_query
+        self.available = available
+        self.nulls = nulls
+        self.qtype = qtype
+        self.unit = unit
+
+    def __repr__(self):
+        return (f'RangeShard({repr(self.fieldid)},minimum={self.minimum},'
+                f'maximum={self.maximum},'
+                f'estimated_count={self.estimated_count})')
+
+def _shard_query(query, fieldid, minimum, maximum, qtype, unit):
+    range_query = RangeQuery(fieldid, minimum=minimum, maximum=maximum,
+                             qtype=qtype, unit=unit)
+    if query is None:
+        return Query(range_query)
+    return Query(query, range_query)
+
+def _time_to_jd(value):
+    """Convert a time string such as '2004-02-08T13:25:41.089' to a UTC
+    Julian date."""
+    return ((pd.Timestamp(value) - _JD_EPOCH).total_seconds() / 86400. +
+            _JD_AT_EPOCH)
+
+def _endpoint_in_unit(opusapi, fieldid, value, unit):
+    """Convert a range endpoint from the server, which is in the field's
+    default unit, to a number in unit (or the default unit if None)."""
+    from_unit = None
+    try:
+        number = float(value)
+    except ValueError:
+        try:
+            number = _time_to_jd(value)
+        except ValueError:
+            raise RuntimeError(f'Range endpoint "{value}" for field id '
+                               f'"{fieldid}" is not numeric; specify '
+                               'minimum, maximum and unit')
+        from_unit = _TIME_SHARD_UNIT
+        if unit is None:
+            # A Julian date sent without its unit would be read in the
+            # field's default time format
+            raise RuntimeError(f'Range endpoint "{value}" for field id '
+                               f'"{fieldid}" is a time; specify a unit')
+    if unit is None or unit == from_unit:
+        return number
+    return opusapi.unit_converter.convert(number, fieldid, unit,
+                                          from_unit=from_unit)
+
+def plan_range_shards(opusapi, query, fieldid, num_shards, minimum=None,
+                      maximum=None, qtype=None, unit=None, resolution=None,
+                      max_workers=None, closed_minimum=False):
+    """Split a query into shards of roughly equal size along a range field.
+
+    The range of fieldid covered by the query (from get_range_endpoints
+    unless minimum and maximum are given) is sampled at evenly spaced points
+    and the cumulative result count at each point is retrieved with
+    get_count, concurrently. Shard boundaries are then interpolated from
+    these counts so each shard holds about the same number of results. The
+    first shard has no minimum and the last has no maximum so every result
+    with a value for fieldid falls in at least one shard.
+
+    Shards share their boundary values, and results whose range spans a
+    boundary match more than one shard, so harvest_shards removes duplicates
+    by OPUS ID. Results with no value for fieldid are in no shard; their
+    number is recorded in each RangeShard's nulls.
+
+    :param minimum: If specified, the lower end of the range to sample, in
+        unit.
+    :param maximum: If specified, the upper end of the range to sample, in
+        unit.
+    :param unit: If specified, the unit for the boundaries. Endpoints from
+        the server are converted to it. If not specified, times (such as
+        observation time) are sharded in Julian dates and other fields in
+        their default unit. A time field that doesn't accept Julian dates
+        needs minimum, maximum and unit.
+    :param resolution: If specified, the number of counts to sample per
+        shard (defaults to 8). Higher is more even but costs more requests.
+    :param closed_minimum: If True, only the results at or above minimum
+        (which is required) are sharded and the first shard starts there
+        instead of having no minimum. This is used to split the open-ended
+        last shard of an earlier plan.
+
+    Returns a list of RangeShard.
+    """
+    if num_shards < 1:
+        raise ValueError
+    if closed_minimum and minimum is None:
+        raise ValueError
+    if fieldid not in opusapi.fields:
+        raise RuntimeError(f'Field id "{fieldid}" unknown')
+    if not opusapi.fields[fieldid]['type'].startswith('range'):
+        raise RuntimeError(f'Field id "{fieldid}" is not type "range"')
+    if query is not None:
+        # Compile the query once for the many counts and shards built on it
+        query = query.compile(opusapi=opusapi)
+        params = query.get_api_params()
+        for key in params:
+            if (key.startswith(fieldid+'1') or key.startswith(fieldid+'2') or
+                key == fieldid):
+                raise RuntimeError(f'Query already constrains field id '
+                                   f'"{fieldid}"')
+    if resolution is None:
+        resolution = _DEFAULT_SHARD_RESOLUTION
+    if max_workers is None:
+        max_workers = _DEFAULT_SHARD_WORKERS
+    if unit is not None:
+        unit = unit.lower()
+
+    if unit is None and opusapi.fields[fieldid]['type'] == 'range_time':
+        if _TIME_SHARD_UNIT in (opusapi.fields[fieldid]['available_units']
+                                or []):
+            unit = _TIME_SHARD_UNIT
+        elif minimum is None or maximum is None:
+            # The endpoints from the server are times, which can only be
+            # interpolated as Julian dates
+            raise RuntimeError(f'Field id "{fieldid}" can not be sharded in '
+                               f'"{_TIME_SHARD_UNIT}"; specify minimum, '
+                               'maximum and unit')
+    ep_min, ep_max, nulls, _ = opusapi.get_range_endpoints(fieldid,
+                                                           query=query)
+    nulls = None if nulls is None else int(nulls)
+    # The lower end of the first shard and the query all the shards cover
+    lower = None
+    covered_query = query
+    if closed_minimum:
+        lower = float(minimum)
+        covered_query = _shard_query(query, fieldid, lower, None, qtype,
+                                     unit).compile(opusapi=opusapi)
+        # Results with no value are never at or above the minimum
+        nulls = 0
+    total = opusapi.get_count(covered_query)
+    def _single_shard():
+        return [RangeShard(_shard_query(query, fieldid, lower, None,
+                                        qtype, unit),
+                           fieldid, lower, None, total,
+                           base_query=covered_query, available=total,
+                           nulls=nulls, qtype=qtype, unit=unit)]
+    if num_shards == 1 or total == 0:
+        return _single_shard()
+    if minimum is None:
+        if ep_min is None:
+            return _single_shard()
+        minimum = _endpoint_in_unit(opusapi, fieldid, ep_min, unit)
+    if maximum is None:
+        if ep_max is None:
+            return _single_shard()
+        maximum = _endpoint_in_unit(opusapi, fieldid, ep_max, unit)
+    minimum = float(minimum)
+    maximum = float(maximum)
+    if maximum <= minimum:
+        return _single_shard()
+
+    # Sample the cumulative count at evenly spaced points. The count at the
+    # minimum is treated as 0 and at the maximum as the total.
+    num_points = num_shards * resolution
+    points = [minimum + (maximum-minimum) * i / num_points
+              for i in range(1, num_points)]
+    def _count_below(point):
+        return opusapi.get_count(_shard_query(query, fieldid, lower, point,
+                                              qtype, unit))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        counts = list(executor.map(_count_below, points))
+    points = [minimum] + points + [maximum]
+    counts = [0] + counts + [total]
+
+    boundaries = []
+    idx = 0
+    for shard_num in range(1, num_shards):
+        target = total * shard_num / num_shards
+        while idx < len(counts)-1 and counts[idx+1] < target:
+            idx += 1
+        if idx >= len(counts)-1:
+            break
+        lo_count = counts[idx]
+        hi_count = counts[idx+1]
+        frac = 0. if hi_count == lo_count else ((target-lo_count) /
+                                                (hi_count-lo_count))
+        boundary = points[idx] + (points[idx+1]-points[idx]) * frac
+        if not boundaries or boundary > boundaries[-1]:
+            boundaries.append(boundary)
+
+    edges = [lower] + boundaries + [None]
+    shards = []
+    for shard_min, shard_max in zip(edges[:-1], edges[1:]):
+        shard_query = _shard_query(query, fieldid, shard_min, shard_max,
+                                   qtype, unit)
+        shards.append(RangeShard(shard_query, fieldid, shard_min, shard_max,
+                                 round(total / (len(edges)-1)),
+                                 base_query=covered_query, available=total,
+                                 nulls=nulls, qtype=qtype, unit=unit))
+    return shards
+
+def harvest_shards(opusapi, shards, fields=None, max_workers=None,
+                   prefetch_pages=None, paging_limit=None,
+                   expected_count=None, allow_missing=False):
+    """Retrieve the metadata for a list of shards in parallel.
+
+    A shard is anything with a query attribute, such as a RangeShard or a
+    PlannedQuery. Up to max_workers shards are paged at once. Rows are
+    yielded in shard order, with each shard holding at most prefetch_pages
+    pages ahead of the consumer, and duplicates (by OPUS ID) are dropped.
+
+    The harvest must be complete. RangeShards from plan_range_shards know
+    the query they split, and by default its current count is used as
+    expected_count; if the shards reported results with no value for the
+    shard field, RuntimeError is raised before anything is harvested. If
+    fewer unique rows than expected_count are found, RuntimeError is raised
+    after the last row. With allow_missing True, a warning is issued
+    instead in both cases.
+    """
+    if shards and all(getattr(shard, 'available', None) is not None
+                      for shard in shards):
+        nulls = shards[0].nulls
+        if nulls:
+            message = (f'{nulls} results have no value for field id '
+                       f'"{shards[0].fieldid}" and are in no shard')
+            if not allow_missing:
+                raise RuntimeError(message)
+            warnings.warn(message)
+        if expected_count is None:
+            expected_count = opusapi.get_count(shards[0].base_query)
+    if max_workers is None:
+        max_workers = _DEFAULT_SHARD_WORKERS
+    if prefetch_pages is None:
+        prefetch_pages = _DEFAULT_SHARD_PREFETCH_PAGES
+    fieldids = opusapi._normalize_fields(fields).split(',')
+    strip_opusid = 'opusid' not in fieldids
+    if strip_opusid:
+        fieldids = ['opusid'] + fieldids
+    opusid_idx = fieldids.index('opusid')
+
+    queues = [queue.Queue(maxsize=prefetch_pages) for _ in shards]
+    stop = threading.Event()
+    _done = object()
+
+    def _put(shard_queue, item):
+        while not stop.is_set():
+            try:
+                shard_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _harvest(shard, shard_queue):
+        try:
+            for page in opusapi.get_metadata_raw(query=shard.query,
+                                                 paging_limit=paging_limit,
+                                                 by_page=True,
+                                                 fields=fieldids):
+                if not _put(shard_queue, page):
+                    return
+        except BaseException as e:
+            _put(shard_queue, e)
+            return
+        _put(shard_queue, _done)
+
+    seen = set()
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for shard, shard_queue in zip(shards, queues):
+            executor.submit(_harvest, shard, shard_queue)
+        for shard_queue in queues:
+            while True:
+                page = shard_queue.get()
+                if page is _done:
+                    break
+                if isinstance(page, BaseException):
+                    raise page
+                for row in page:
+                    opusid = row[opusid_idx]
+                    if opusid in seen:
+                        continue
+                    seen.add(opusid)
+                    yield row[1:] if strip_opusid else row
+    finally:
+        stop.set()
+        executor.shutdown(wait=True)
+
+    if expected_count is not None and len(seen) < expected_count:
+        message = (f'Sharded harvest found {len(seen)} of {expected_count} '
+                   'results')
+        if not allow_missing:
+            raise RuntimeError(message)
+        warnings.warn(message)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS HTTP transport classes
+"""
+
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+_DEFAULT_POOL_CONNECTIONS = 10
+_DEFAULT_POOL_MAXSIZE = 10
+_DEFAULT_CONNECT_TIMEOUT = 10.
+_DEFAULT_READ_TIMEOUT = 120.
+_DEFAULT_ACCEPT_ENCODING = 'gzip, deflate'
+
+# Time spent opening new connections (including the TLS handshake) by the
+# current thread since the last reset
+_connect_timing = threading.local()
+
+def _add_connect_time(elapsed):
+    _connect_timing.elapsed = getattr(_connect_timing, 'elapsed', 0.) + elapsed
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start_time = time.perf_counter()
+        try:
+            super(_TimedHTTPConnection, self).connect()
+        finally:
+            _add_connect_time(time.perf_counter() - start_time)
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start_time = time.perf_counter()
+        try:
+            super(_TimedHTTPSConnection, self).connect()
+        finally:
+            _add_connect_time(time.perf_counter() - start_time)
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedHTTPAdapter(HTTPAdapter):
+    """An HTTPAdapter whose connections record how long they take to open."""
+    def init_poolmanager(self, *args, **kwargs):
+        super(_TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _TimedHTTPConnectionPool,
+            'https': _TimedHTTPSConnectionPool}
+
+class Transport(object):
+    """Transport is the HTTP layer used by OPUSAPIRaw to talk to the server.
+
+       It keeps a pooled requests.Session with keep-alive so that successive
+       API calls (e.g. the pages of a long search) reuse the same TCP and TLS
+       connections. A single Transport may be shared by multiple OPUSAPIRaw
+       instances and used from multiple threads at the same time.
+    """
+    def __init__(self, pool_connections=None, pool_maxsize=None,
+                 connect_timeout=None, read_timeout=None,
+                 accept_encoding=None, pool_block=False, headers=None):
+        """Constructor for the Transport class.
+
+        :param pool_connections: If specified, the number of distinct hosts to
+            keep connection pools for (defaults to 10).
+        :param pool_maxsize: If specified, the maximum number of connections
+            kept alive per host. This should be at least as large as the
+            number of threads that will use the transport at once
+            (defaults to 10).
+        :param connect_timeout: If specified, the timeout in seconds to
+            establish a connection (defaults to 10). Use 0 for no timeout.
+        :param read_timeout: If specified, the timeout in seconds to wait for
+            data from the server (defaults to 120). Use 0 for no timeout.
+        :param accept_encoding: If specified, the compression methods to
+            negotiate with the server (defaults to 'gzip, deflate').
+        :param pool_block: If True, callers wait for a free connection when
+            the pool is exhausted instead of opening a throwaway one.
+        :param headers: If specified, a dict of extra headers to send with
+            every request.
+        """
+        if pool_connections is None:
+            pool_connections = _DEFAULT_POOL_CONNECTIONS
+        if pool_maxsize is None:
+            pool_maxsize = _DEFAULT_POOL_MAXSIZE
+        if pool_connections < 1 or pool_maxsize < 1:
+            raise ValueError
+        if connect_timeout is None:
+            connect_timeout = _DEFAULT_CONNECT_TIMEOUT
+        if read_timeout is None:
+            read_timeout = _DEFAULT_READ_TIMEOUT
+        if accept_encoding is None:
+            accept_encoding = _DEFAULT_ACCEPT_ENCODING
+
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._timeout = (connect_timeout or None, read_timeout or None)
+
+        session = requests.Session()
+        adapter = _TimedHTTPAdapter(pool_connections=pool_connections,
+                                    pool_maxsize=pool_maxsize,
+                                    pool_block=pool_block)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers['Accept-Encoding'] = accept_encoding
+        session.headers['Connection'] = 'keep-alive'
+        if headers is not None:
+            session.headers.update(headers)
+        self._session = session
+
+    def __repr__(self):
+        return (f'Transport(pool_connections={self._pool_connections},'
+                f'pool_maxsize={self._pool_maxsize},'
+                f'timeout={self._timeout})')
+
+    @property
+    def session(self):
+        """Return the underlying requests.Session."""
+        return self._session
+
+    @property
+    def timeout(self):
+        """Return the (connect, read) timeout tuple."""
+        return self._timeout
+
+    def get(self, url, params=None, headers=None, stream=False):
+        """Perform a GET request and return the requests.Response.
+
+        The response has an extra attribute, connect_time, with the number
+        of seconds spent opening a new connection for the request (0 if a
+        pooled connection was reused).
+        """
+        _connect_timing.elapsed = 0.
+        r = self._session.get(url, params=params, headers=headers,
+                              stream=stream, timeout=self._timeout)
+        r.connect_time = _connect_timing.elapsed
+        return r
+
+    def head(self, url, headers=None):
+        """Perform a HEAD request and return the requests.Response."""
+        return self._session.head(url, headers=headers, allow_redirects=True,
+                                  timeout=self._timeout)
+
+    def close(self):
+        """Close all pooled connections."""
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
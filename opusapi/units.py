@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+OPUS unit conversion class
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from .query import OR, Query, RangeQuery
+
+# Units that are related by a linear (or affine) conversion, by family. Each
+# unit maps to (scale, offset) such that value_in_first_unit =
+# value * scale + offset.
+_UNIT_FAMILIES = {
+    'distance': {'km': (1., 0.),
+                 'm': (0.001, 0.),
+                 'jupiterradii': (71492., 0.),
+                 'saturnradii': (60330., 0.),
+                 'uranusradii': (25559., 0.),
+                 'neptuneradii': (24764., 0.)},
+    'resolution': {'km_pixel': (1., 0.),
+                   'm_pixel': (0.001, 0.)},
+    'duration': {'seconds': (1., 0.),
+                 'milliseconds': (0.001, 0.)},
+    'angle': {'degrees': (1., 0.),
+              'hourangle': (15., 0.),
+              'hourangles': (15., 0.),
+              'radians': (180./math.pi, 0.)},
+    'wavelength': {'microns': (1., 0.),
+                   'angstroms': (1e-4, 0.),
+                   'nm': (1e-3, 0.),
+                   'cm': (1e4, 0.)},
+    # Julian dates in UTC; ET and the ephemeris dates differ from these by
+    # leap seconds, which isn't a linear conversion
+    'utc_date': {'jd': (1., 0.),
+                 'mjd': (1., 2400000.5)},
+    'ephemeris_date': {'jed': (1., 0.),
+                       'mjed': (1., 2400000.5)}
+}
+
+_UNIT_FAMILY_BY_UNIT = {unit: family
+                        for family, units in _UNIT_FAMILIES.items()
+                        for unit in units}
+
+class UnitConverter(object):
+    """UnitConverter converts range field values between units locally, so a
+       single retrieval can be viewed in any unit.
+
+       The units of each field come from the OPUS field registry. Only
+       conversions that are a scale and offset (e.g. km to Saturn radii,
+       degrees to radians or JD to MJD) are supported; anything else, such as
+       wavenumbers or formatted dates, raises RuntimeError. Values returned
+       by data.json are in each field's default unit.
+    """
+    def __init__(self, opusapi):
+        """Constructor for the UnitConverter class.
+
+        :param opusapi: The OPUSAPI whose field registry describes the units.
+        """
+        self._opusapi = opusapi
+
+    def field_units(self, fieldid):
+        """Return (default unit, available units) for a fieldid.
+
+        The fieldid may be a data.json column (e.g. 'time1') or a search
+        field (e.g. 'time').
+        """
+        field = self._opusapi.raw_fields.get(fieldid)
+        if field is None:
+            field = self._opusapi.fields.get(fieldid)
+        if field is None:
+            raise RuntimeError(f'Unknown field id "{fieldid}"')
+        return field['default_units'], field['available_units']
+
+    def factors(self, fieldid, to_unit, from_unit=None):
+        """Return (scale, offset) such that a fieldid value in from_unit
+        (defaults to the field's default unit) times scale plus offset is in
+        to_unit."""
+        default_unit, _ = self.field_units(fieldid)
+        if from_unit is None:
+            from_unit = default_unit
+        if from_unit is None:
+            raise RuntimeError(f'Field id "{fieldid}" has no units')
+        from_unit = from_unit.lower()
+        to_unit = to_unit.lower()
+        if from_unit == to_unit:
+            return 1., 0.
+        family = _UNIT_FAMILY_BY_UNIT.get(from_unit)
+        if family is None or _UNIT_FAMILY_BY_UNIT.get(to_unit) != family:
+            raise RuntimeError(f'Field id "{fieldid}" can not be converted '
+                               f'from unit "{from_unit}" to "{to_unit}"')
+        from_scale, from_offset = _UNIT_FAMILIES[family][from_unit]
+        to_scale, to_offset = _UNIT_FAMILIES[family][to_unit]
+        return from_scale / to_scale, (from_offset-to_offset) / to_scale
+
+    def can_convert(self, fieldid, to_unit, from_unit=None):
+        """Return True if fieldid values can be converted to to_unit."""
+        try:
+            self.factors(fieldid, to_unit, from_unit=from_unit)
+        except RuntimeError:
+            return False
+        return True
+
+    def convert(self, values, fieldid, to_unit, from_unit=None):
+        """Convert fieldid values from from_unit (defaults to the field's
+        default unit) to to_unit in one vectorized operation.
+
+        values may be a scalar, a sequence, a NumPy array or a pandas Series.
+        Series keep their index; other inputs return a float64 array (or a
+        float for a scalar). Missing values become NaN.
+        """
+        scale, offset = self.factors(fieldid, to_unit, from_unit=from_unit)
+        if isinstance(values, pd.Series):
+            return values.astype(np.float64) * scale + offset
+        ret = np.asarray(values, dtype=np.float64) * scale + offset
+        if ret.ndim == 0:
+            return float(ret)
+        return ret
+
+    def convert_df(self, frame, units, from_units=None):
+        """Return a copy of a metadata DataFrame with columns converted.
+
+        :param units: A dict {column fieldid: unit} of the units wanted.
+        :param from_units: If specified, a dict {column fieldid: unit} of the
+            current units of the columns (defaults to the fields' default
+            units).
+        """
+        frame = frame.copy()
+        for fieldid, to_unit in units.items():
+            from_unit = None if from_units is None else from_units.get(fieldid)
+            frame[fieldid] = self.convert(frame[fieldid], fieldid, to_unit,
+                                          from_unit=from_unit)
+        return frame
+
+    def convert_range_query(self, range_query, to_unit=None):
+        """Return a RangeQuery with its bounds converted to to_unit (defaults
+        to the field's default unit).
+
+        The original RangeQuery's unit may be any unit this converter knows
+        how to convert from, even one the server doesn't support.
+        """
+        fieldid = range_query.fieldid
+        default_unit, _ = self.field_units(fieldid)
+        if to_unit is None:
+            to_unit = default_unit
+        from_unit = (default_unit if range_query.unit is None
+                                  else range_query.unit)
+        if to_unit is None or from_unit == to_unit.lower():
+            return range_query
+        scale, offset = self.factors(fieldid, to_unit, from_unit=from_unit)
+        minimum = range_query.minimum
+        maximum = range_query.maximum
+        if minimum is not None:
+            minimum = minimum * scale + offset
+        if maximum is not None:
+            maximum = maximum * scale + offset
+        unit = None if to_unit == default_unit else to_unit
+        return RangeQuery(fieldid, minimum=minimum, maximum=maximum,
+                          qtype=range_query.qtype, unit=unit)
+
+    def convert_query(self, query, units=None):
+        """Return a copy of a Query with the bounds of every RangeQuery
+        converted before it is sent.
+
+        :param units: If specified, a dict {fieldid: unit} of the units to
+            send for each range field (defaults to the fields' default
+            units).
+        """
+        if isinstance(query, RangeQuery):
+            to_unit = None if units is None else units.get(query.fieldid)
+            return self.convert_range_query(query, to_unit=to_unit)
+        if isinstance(query, OR):
+            return OR(*[self.convert_query(term, units=units)
+                        for term in query.terms])
+        if type(query) is Query:
+            return Query(*[self.convert_query(term, units=units)
+                           for term in query.terms])
+        # MultQuery and StringQuery have no units, and a CompiledQuery's
+        # parameters are already fixed
+        return query
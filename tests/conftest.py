@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures shared by the tests: the fake OPUS server from the benchmarks
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..',
+                                'benchmarks'))
+from fake_opus_server import FakeOPUSServer
+
+from opusapi import OPUSAPI
+
+@pytest.fixture
+def server():
+    with FakeOPUSServer(num_rows=2000, num_surfacegeo_targets=2) as server:
+        yield server
+
+@pytest.fixture
+def api(server):
+    return OPUSAPI(server=server.url)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive paging tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import AdaptivePaging
+
+def _ids(first, last):
+    return [[f'co-iss-n{1454725799+idx}'] for idx in range(first, last)]
+
+def test_adaptive_learns_server_cap(server, api):
+    server.max_page_size = 150
+    pager = AdaptivePaging(initial_limit=100, max_limit=1000)
+    assert list(api.get_metadata(adaptive=pager, paging_limit=100)) == \
+           _ids(0, 2000)
+    assert pager.server_cap == 150
+    assert pager.limit <= 150
+
+def test_adaptive_rejects_workers(api):
+    with pytest.raises(RuntimeError):
+        list(api.get_metadata(adaptive=True, max_workers=2))
+
+def test_adaptive_shrinks_to_target_bytes(api):
+    pager = AdaptivePaging(initial_limit=400, min_limit=10,
+                           target_bytes=2000)
+    assert list(api.get_metadata(adaptive=pager)) == _ids(0, 2000)
+    # Each row is about 25 bytes of JSON
+    assert pager.limit < 200
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+AsyncOPUSAPI tests against the fake OPUS server
+"""
+
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+from opusapi import AsyncOPUSAPI, MultQuery, Query
+
+def test_paged_calls_match_sync_client(server, api):
+    query = Query(MultQuery('target', ['TITAN']))
+
+    async def _run():
+        async with AsyncOPUSAPI(server=server.url) as client:
+            with pytest.raises(RuntimeError):
+                client.fields
+            count = await client.get_count(query)
+            rows = [row async for row in client.get_metadata(
+                                query=query, fields=['opusid', 'target'],
+                                paging_limit=60, prefetch_pages=3)]
+            return count, rows
+
+    count, rows = asyncio.run(_run())
+    assert count == 250
+    assert rows == list(api.get_metadata(query=query,
+                                         fields=['opusid', 'target'],
+                                         paging_limit=60))
+
+def test_import_without_aiohttp():
+    code = ('import sys; sys.modules["aiohttp"] = None; import opusapi; '
+            'opusapi.OPUSAPI')
+    subprocess.run([sys.executable, '-c', code], check=True)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the benchmark suite and its fake OPUS server
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+from fake_opus_server import FakeOPUSServerProcess
+
+from opusapi import OPUSAPI
+
+_BENCHMARKS = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                           'run_benchmarks.py')
+
+def test_server_process():
+    with FakeOPUSServerProcess(num_rows=150, max_page_size=40) as server:
+        api = OPUSAPI(server=server.url)
+        assert api.get_count() == 150
+        assert len(list(api.get_metadata(paging_limit=100))) == 150
+        # fields.json, the count and four capped pages
+        assert server.num_requests == 6
+
+def test_run_benchmarks():
+    out = subprocess.run([sys.executable, _BENCHMARKS, '--rows', '300',
+                          '--latency', '0', '--page-size', '100', '--json'],
+                         check=True, stdout=subprocess.PIPE, text=True).stdout
+    results = json.loads(out)
+    names = [result['name'] for result in results]
+    assert 'paging serial' in names
+    for result in results:
+        assert result['seconds'] >= 0
+        assert result['peak_mb'] >= 0
+    serial = results[names.index('paging serial')]
+    assert serial['rows_per_sec'] > 0
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Column-split metadata fetching tests against the fake OPUS server
+"""
+
+from opusapi import OPUSAPI
+
+_FIELDS = ['opusid', 'target', 'time1', 'target', 'levels', 'opusid',
+           'planet']
+
+def test_split_matches_single_request(api):
+    split = list(api.get_metadata(fields=_FIELDS, max_columns=2, limit=250,
+                                  paging_limit=100))
+    assert split == list(api.get_metadata(fields=_FIELDS, limit=250,
+                                          paging_limit=100))
+    assert len(split) == 250
+    # Only opusid, repeated, is never split
+    assert (list(api.get_metadata(fields=['opusid', 'opusid'],
+                                  max_columns=2, limit=2)) ==
+            [['co-iss-n1454725799'] * 2, ['co-iss-n1454725800'] * 2])
+
+def test_split_page_bytes(api):
+    groups = [['opusid', 'target'], ['opusid', 'time1'],
+              ['opusid', 'levels'], ['opusid', 'planet']]
+    expected = 0
+    for group in groups:
+        api._get_metadata_page(None, 1, 50, fields=group)
+        expected += api._call_stats.num_bytes
+    api._get_metadata_page(None, 1, 50, fields=_FIELDS, max_columns=2)
+    assert api._call_stats.num_bytes == expected
+
+def test_close_releases_pool(server):
+    with OPUSAPI(server=server.url) as api:
+        list(api.get_metadata(fields=_FIELDS, max_columns=3, limit=10))
+        executor = api._column_executor
+        assert executor is not None
+    assert api._column_executor is None
+    assert executor._shutdown
+    # The instance can still be used after it is closed
+    assert api.get_count() == 2000
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+ProductDownloader tests against the product files of the fake OPUS server
+"""
+
+import os
+
+from fake_opus_server import FakeOPUSHandler
+
+from opusapi import OPUSAPI, ProductDownloader
+
+def _product(server, filename='N1_1.IMG'):
+    path = f'/volumes/COISS_2xxx/{filename}'
+    return server.url + path, FakeOPUSHandler.product_body(path)
+
+def test_resume_with_range(server, tmp_path):
+    url, body = _product(server)
+    dest = str(tmp_path / 'N1_1.IMG')
+    with open(dest + '.part', 'wb') as fp:
+        fp.write(body[:500])
+
+    assert ProductDownloader().download_one(url, dest) == 'resumed'
+    with open(dest, 'rb') as fp:
+        assert fp.read() == body
+    assert not os.path.exists(dest + '.part')
+
+def test_skip_existing(server, tmp_path):
+    url, body = _product(server)
+    dest = str(tmp_path / 'N1_1.IMG')
+    with open(dest, 'wb') as fp:
+        fp.write(body)
+    num_requests = server.num_requests
+
+    assert ProductDownloader().download_one(url, dest) == 'skipped'
+    # Only the HEAD request was made
+    assert server.num_requests == num_requests
+
+def test_download_products_twice(server, tmp_path):
+    api = OPUSAPI(server=server.url)
+    progress = api.download_products(product_types=['coiss_raw'],
+                                     dest=str(tmp_path), limit=5)
+    assert progress.files_done == 10
+    assert progress.files_failed == 0
+
+    progress = api.download_products(product_types=['coiss_raw'],
+                                     dest=str(tmp_path), limit=5)
+    assert progress.files_done == 0
+    assert progress.files_skipped == 10
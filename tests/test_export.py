@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Metadata export tests against the fake OPUS server
+"""
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+import pyarrow.feather
+import pyarrow.parquet as pq
+
+_FIELDS = ['opusid', 'target', 'time1', 'observationduration', 'levels']
+
+def test_export_parquet(api, tmp_path):
+    path = str(tmp_path / 'out.parquet')
+    assert api.export_metadata(fields=_FIELDS, path=path, limit=1500,
+                               paging_limit=200, row_group_size=500) == 1500
+    parquet_file = pq.ParquetFile(path)
+    assert parquet_file.metadata.num_rows == 1500
+    # Pages are collected into row groups of at least row_group_size
+    assert parquet_file.metadata.num_row_groups == 3
+    table = parquet_file.read()
+    assert table.schema.field('target').type == pa.string()
+    assert table.schema.field('levels').type == pa.int64()
+
+    frame = table.to_pandas()
+    expected = api.get_metadata_df(fields=_FIELDS, limit=1500)
+    assert frame['opusid'].tolist() == expected['opusid'].tolist()
+    assert frame['target'].tolist() == expected['target'].astype(str).tolist()
+    assert (frame['observationduration'].isna().tolist() ==
+            expected['observationduration'].isna().tolist())
+
+def test_export_feather(api, tmp_path):
+    path = str(tmp_path / 'out.feather')
+    assert api.export_metadata(fields=_FIELDS, path=path, format='feather',
+                               limit=300, paging_limit=100,
+                               max_workers=2) == 300
+    table = pyarrow.feather.read_table(path)
+    assert table.num_rows == 300
+    assert table.column_names == _FIELDS
+
+def test_export_unknown_format(api, tmp_path):
+    with pytest.raises(RuntimeError):
+        api.export_metadata(path=str(tmp_path / 'out.csv'), format='csv')
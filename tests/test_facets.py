@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk faceting tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import MultQuery, Query
+
+def test_facets_match_single_calls(server, api):
+    query = Query(MultQuery('target', ['TITAN', 'RHEA']))
+    api.fields
+    num_requests = server.num_requests
+    facets = api.get_facets(query=query, mult_fields=['target', 'planet'],
+                            range_fields=['observationduration', 'time'],
+                            max_workers=4)
+    # One call per facet plus the count
+    assert server.num_requests - num_requests == 5
+
+    assert facets['count'] == 500
+    assert facets['mults'] == {'target': {'TITAN': 250, 'RHEA': 250},
+                               'planet': {'SATURN': 500}}
+    assert facets['mults']['target'] == api.get_mults('target', query=query)
+    duration = facets['ranges']['observationduration']
+    assert duration['min'] == 0.25
+    assert isinstance(duration['max'], float)
+    assert duration['nulls'] == 6
+    assert isinstance(facets['ranges']['time']['min'], str)
+
+def test_facets_check_field_types(api):
+    with pytest.raises(RuntimeError):
+        api.get_facets(mult_fields=['levels'])
+    with pytest.raises(RuntimeError):
+        api.get_facets(range_fields=['target'])
+    with pytest.raises(RuntimeError):
+        api.get_facets(mult_fields=['nosuchfield'])
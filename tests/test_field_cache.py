@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+FieldCache tests against the fake OPUS server
+"""
+
+import time
+
+from opusapi import OPUSAPI, FieldCache
+
+def test_fresh_cache_skips_fields_json(server, tmp_path):
+    cache = FieldCache(directory=str(tmp_path))
+    fields = OPUSAPI(server=server.url, field_cache=cache).fields
+    num_requests = server.num_requests
+
+    api = OPUSAPI(server=server.url, field_cache=cache)
+    assert api.fields.keys() == fields.keys()
+    assert server.num_requests == num_requests
+    # The analyzed fields were stored beside the raw entry
+    entry = cache.load(server.url)
+    assert entry is not None
+    assert api._get_derived_field_cache('fields') is not None
+
+def test_stale_cache_revalidates(server, tmp_path):
+    cache = FieldCache(directory=str(tmp_path), ttl=0)
+    OPUSAPI(server=server.url, field_cache=cache).fields
+    fetched = cache.load(server.url)['fetched']
+    time.sleep(0.01)
+
+    num_requests = server.num_requests
+    api = OPUSAPI(server=server.url, field_cache=cache)
+    assert 'levels' in api.fields
+    # One conditional request, answered with 304
+    assert server.num_requests == num_requests + 1
+    assert cache.load(server.url)['fetched'] > fetched
+
+def test_changed_fields_invalidate_derived(server, tmp_path):
+    cache = FieldCache(directory=str(tmp_path), ttl=0)
+    OPUSAPI(server=server.url, field_cache=cache).fields
+    old_digest = cache.load(server.url)['digest']
+
+    server.data.fields['newfield'] = dict(server.data.fields['levels'],
+                                          slug='newfield')
+    api = OPUSAPI(server=server.url, field_cache=cache)
+    assert 'newfield' in api.fields
+    entry = cache.load(server.url)
+    assert entry['digest'] != old_digest
+    assert 'newfield' in cache.load_derived(entry, 'fields')
+
+def test_clear(server, tmp_path):
+    cache = FieldCache(directory=str(tmp_path))
+    OPUSAPI(server=server.url, field_cache=cache).fields
+    cache.clear(server.url)
+    assert cache.load(server.url) is None
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Governor rate limiting and retry tests against the fake OPUS server
+"""
+
+from email.utils import formatdate
+import time
+
+import pytest
+
+from opusapi import OPUSAPI, Governor, Metrics
+
+def _api(server, governor, metrics=None):
+    api = OPUSAPI(server=server.url, governor=governor, metrics=metrics)
+    api.fields
+    return api
+
+def test_transient_failures_are_retried(server):
+    metrics = Metrics()
+    api = _api(server, Governor(backoff_base=0.01), metrics=metrics)
+    server.fail_requests(2, status=503)
+    assert api.get_count() == 2000
+    assert metrics.snapshot()['counters']['retries'] == 2
+
+def test_retry_after_holds_requests(server):
+    api = _api(server, Governor(backoff_base=0.01))
+    server.fail_requests(1, status=429, retry_after='0.3')
+    start_time = time.monotonic()
+    assert api.get_count() == 2000
+    assert time.monotonic() - start_time >= 0.3
+
+def test_give_up_after_max_retries(server):
+    api = _api(server, Governor(max_retries=2, backoff_base=0.01))
+    server.fail_requests(3, status=502)
+    with pytest.raises(RuntimeError):
+        api.get_count()
+    assert server.failures == []
+
+def test_no_retries_without_governor_or_for_client_errors(server):
+    api = _api(server, None)
+    server.fail_requests(1, status=503)
+    with pytest.raises(RuntimeError):
+        api.get_count()
+
+    api = _api(server, Governor(backoff_base=0.01))
+    server.fail_requests(2, status=400)
+    with pytest.raises(RuntimeError):
+        api.get_count()
+    # The second failure was never requested
+    assert len(server.failures) == 1
+
+def test_rate_limit(server):
+    api = _api(server, Governor(rate=20, burst=1))
+    start_time = time.monotonic()
+    for _ in range(6):
+        api.get_count()
+    # The first request uses the burst, the other five wait 0.05s each
+    assert time.monotonic() - start_time >= 0.2
+
+def test_parse_retry_after():
+    assert Governor.parse_retry_after('2.5') == 2.5
+    assert Governor.parse_retry_after(None) is None
+    assert Governor.parse_retry_after('soon') is None
+    delay = Governor.parse_retry_after(formatdate(time.time()+10,
+                                                  usegmt=True))
+    assert 8 < delay <= 10
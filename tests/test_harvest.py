@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Resumable harvest job tests
+"""
+
+import json
+
+import pytest
+
+from opusapi import MultQuery, Query
+from opusapi.harvest import HarvestJob
+
+class _Crash(Exception):
+    pass
+
+def _crash_after(pages, num_pages):
+    for page_num, page in enumerate(pages):
+        if page_num == num_pages:
+            raise _Crash
+        yield page
+
+def test_harvest_resumes_after_crash(api, tmp_path):
+    state_path = str(tmp_path / 'state.json')
+    sink_path = str(tmp_path / 'sink.jsonl')
+    query = Query(MultQuery('target', ['TITAN']))
+    fields = ['opusid', 'target']
+    job = HarvestJob(api, state_path, sink_path, query=query, fields=fields,
+                     paging_limit=20, checkpoint_interval=0)
+    pages = job._pages
+    job._pages = lambda startobs: _crash_after(pages(startobs), 3)
+    with pytest.raises(_Crash):
+        job.run()
+    assert job.rows == 60
+    assert not job.done
+    # A partial write after the last checkpoint is discarded on resume
+    with open(sink_path, 'ab') as sink:
+        sink.write(b'["co-iss-partial"')
+
+    resumed = HarvestJob.resume(api, state_path, sink_path,
+                                paging_limit=20)
+    assert resumed.rows == 60
+    assert resumed.run() == 250
+    assert resumed.done
+    expected = list(api.get_metadata(query=query, fields=fields))
+    assert list(resumed.read_rows()) == expected
+    assert resumed.run() == 250
+
+def test_harvest_files_definition(api, tmp_path):
+    state_path = str(tmp_path / 'state.json')
+    sink_path = str(tmp_path / 'sink.jsonl')
+    query = Query(MultQuery('target', ['RHEA']))
+    job = HarvestJob(api, state_path, sink_path, query=query, kind='files',
+                     product_types=('browse-thumb',))
+    assert job.run() == 250
+    with open(state_path, 'r') as fp:
+        definition = json.load(fp)['definition']
+    assert definition['product_types'] == ['browse-thumb']
+    resumed = HarvestJob.resume(api, state_path, sink_path)
+    assert resumed.done
+    with pytest.raises(RuntimeError):
+        HarvestJob(api, state_path, sink_path, query=query, kind='files')
+    with pytest.raises(ValueError):
+        HarvestJob(api, state_path, sink_path, kind='nosuchkind')
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk OPUS ID lookup tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import OPUSIDQuery, Query
+
+def test_lookup_in_order_with_missing(server, api):
+    opusids = [f'co-iss-n{1454725799+idx}' for idx in (1500, 3, 999, 3)]
+    opusids.insert(2, 'co-iss-nope')
+    api.fields
+    num_requests = server.num_requests
+    rows, missing = api.get_metadata_for_ids(opusids,
+                                             fields=['target', 'levels'],
+                                             max_ids_per_request=2)
+    assert rows == [['TETHYS', '1500'], ['DIONE', '3'], None,
+                    ['IAPETUS', '999'], ['DIONE', '3']]
+    assert missing == ['co-iss-nope']
+    # Four unique IDs, two per request
+    assert server.num_requests - num_requests == 2
+
+def test_lookup_splits_long_urls(api):
+    opusids = [f'co-iss-n{1454725799+idx}' for idx in range(300)]
+    rows, missing = api.get_metadata_for_ids(opusids, max_url_length=1000)
+    assert missing == []
+    assert [row[0] for row in rows] == opusids
+
+def test_opusid_query():
+    query = Query(OPUSIDQuery([' co-iss-n1 ', 'co-iss-n2']))
+    assert query.compile().get_api_params() == {
+                                        'opusid': 'co-iss-n1,co-iss-n2'}
+    with pytest.raises(ValueError):
+        OPUSIDQuery(['co-iss-n1,co-iss-n2'])
+    with pytest.raises(ValueError):
+        OPUSIDQuery([])
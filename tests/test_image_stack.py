@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Browse image stack tests against the fake OPUS server
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip('PIL')
+
+from opusapi import ImageStackFetcher, load_image_stack
+
+def test_get_image_stack(api, tmp_path):
+    path = str(tmp_path / 'stack.npy')
+    stack, opusids, failures = api.get_image_stack(path, limit=12,
+                                                   paging_limit=5,
+                                                   max_workers=3,
+                                                   decode_workers=2)
+    assert failures == []
+    assert stack.shape == (12, 100, 100)
+    assert stack.dtype == np.uint8
+    assert opusids == [f'co-iss-n{1454725799+idx}' for idx in range(12)]
+
+    # The fake server's images are a ramp starting at a seed from the path
+    seed = sum(b'/browse/COISS_2xxx/N0_1_thumb.jpg') % 256
+    expected = ((seed + np.arange(100*100)) % 256).reshape(100, 100)
+    assert (stack[0] == expected).all()
+
+    mapped, mapped_opusids = load_image_stack(path)
+    assert mapped_opusids == opusids
+    assert (mapped == stack).all()
+
+def test_resize_and_failures(server, tmp_path):
+    path = str(tmp_path / 'stack.npy')
+    images = [('good', server.url + '/browse/COISS_2xxx/N1_1_thumb.jpg'),
+              ('bad', server.url + '/api/nosuchimage.jpg')]
+    fetcher = ImageStackFetcher(max_workers=2, decode_workers=1, mode='RGB')
+    stack, opusids, failures = fetcher.fetch(images, path, 2, 50, 40)
+    assert stack.shape == (2, 50, 40, 3)
+    assert opusids == ['good', None]
+    assert [failure[0] for failure in failures] == ['bad']
+    assert stack[0].any()
+    assert not stack[1].any()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Typed metadata DataFrame tests
+"""
+
+import pandas as pd
+import pytest
+
+from opusapi import MultQuery, Query
+from opusapi.opusapi import (_KIND_CATEGORY, _KIND_FLOAT, _KIND_INT,
+                             _KIND_STRING, _KIND_TIME, _MetadataColumns)
+
+_FIELDS = ['opusid', 'target', 'time1', 'observationduration', 'levels']
+
+def test_columns_grow_past_capacity():
+    kinds = [_KIND_STRING, _KIND_TIME, _KIND_INT, _KIND_FLOAT,
+             _KIND_CATEGORY]
+    columns = _MetadataColumns(kinds, capacity=1)
+    columns.append_page([['a', '2004-02-08T13:25:41.089', '18', '1.5', 'X'],
+                         [None, 'N/A', 'NULL', '', 'Y']])
+    columns.append_page([['b', '2004-02-09', '3e2', None, 'X']])
+    frame = columns.to_frame(['s', 't', 'i', 'f', 'c'])
+    assert len(frame) == 3
+    assert frame['i'].tolist()[::2] == [18, 300]
+    assert frame['i'].isna().tolist() == [False, True, False]
+    assert frame['f'].isna().tolist() == [False, True, True]
+    assert frame['t'].isna().tolist() == [False, True, False]
+    assert frame['s'][1] is None
+    assert list(frame['c'].cat.categories) == ['X', 'Y']
+
+@pytest.mark.parametrize('kind, value', [(_KIND_INT, '2.6'),
+                                         (_KIND_INT, 'abc'),
+                                         (_KIND_FLOAT, 'abc'),
+                                         (_KIND_TIME, 'not a time')])
+def test_malformed_values_raise(kind, value):
+    columns = _MetadataColumns([kind])
+    with pytest.raises(ValueError, match='Malformed'):
+        columns.append_page([[value]])
+
+def test_get_metadata_df_matches_batches(api):
+    frame = api.get_metadata_df(fields=_FIELDS, limit=1500,
+                                paging_limit=400)
+    batches = list(api.get_metadata_df_batches(fields=_FIELDS, limit=1500,
+                                               paging_limit=400))
+    assert [len(batch) for batch in batches] == [400, 400, 400, 300]
+    assert len(frame) == 1500
+    for fieldid in _FIELDS:
+        combined = pd.concat([batch[fieldid].astype(object)
+                              for batch in batches], ignore_index=True)
+        assert frame[fieldid].astype(object).equals(combined)
+
+def test_column_types(api):
+    frame = api.get_metadata_df(fields=_FIELDS, limit=200, paging_limit=50)
+    assert list(frame.columns) == _FIELDS
+    assert frame['opusid'].dtype == object
+    assert frame['target'].dtype == 'category'
+    assert str(frame['time1'].dtype) == 'datetime64[ns]'
+    assert frame['observationduration'].dtype == 'float64'
+    assert str(frame['levels'].dtype) == 'Int64'
+    # Every 97th observation has no duration
+    assert frame['observationduration'].isna().sum() == 3
+    assert frame['levels'].tolist() == list(range(200))
+    # All the pages share one set of categories
+    assert sorted(frame['target'].cat.categories) == sorted(
+                                                frame['target'].unique())
+
+def test_batches_without_categoricals(api):
+    batches = list(api.get_metadata_df_batches(fields=_FIELDS, limit=120,
+                                               paging_limit=50,
+                                               categorical=False))
+    assert [len(batch) for batch in batches] == [50, 50, 20]
+    assert all(batch['target'].dtype == object for batch in batches)
+
+def test_empty_result(api):
+    frame = api.get_metadata_df(
+                query=Query(MultQuery('target', ['PAN'])), fields=_FIELDS)
+    assert len(frame) == 0
+    assert list(frame.columns) == _FIELDS
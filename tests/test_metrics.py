@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Request metrics tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import OPUSAPI, Metrics, ResponseCache
+
+def test_events_and_aggregates(server):
+    events = []
+    metrics = Metrics(exporters=[events.append])
+    api = OPUSAPI(server=server.url, metrics=metrics,
+                  cache=ResponseCache())
+    rows = list(api.get_metadata(limit=250, paging_limit=100))
+    assert len(rows) == 250
+    list(api.get_metadata(limit=250, paging_limit=100))
+
+    data_events = [event for event in events
+                   if event.endpoint == 'data.json']
+    assert len(data_events) == 6
+    assert [event.cached for event in data_events] == [False]*3 + [True]*3
+    for event in data_events[:3]:
+        assert event.status == 200
+        assert event.num_bytes > 0
+        assert event.total_time >= event.first_byte_time >= 0
+        assert event.decode_time >= 0
+
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['requests'] == len(events)
+    assert snapshot['counters']['cached'] == 3
+    assert snapshot['endpoints']['data.json']['requests'] == 6
+    assert snapshot['histograms']['response_bytes']['count'] == \
+           len(events) - 3
+
+    text = metrics.prometheus_text()
+    assert 'opusapi_requests_total %d' % len(events) in text
+    assert 'opusapi_endpoint_requests_total{endpoint="data.json"} 6' in text
+
+def test_errors_are_recorded(server):
+    metrics = Metrics()
+    api = OPUSAPI(server=server.url, metrics=metrics)
+    with pytest.raises(RuntimeError):
+        api._call_opus_api('nosuchendpoint', 'json')
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['errors'] == 1
+    assert snapshot['endpoints']['nosuchendpoint.json']['errors'] == 1
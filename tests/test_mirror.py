@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Mirror tests against the fake OPUS server
+"""
+
+from opusapi import Mirror, MultQuery, Query
+
+def _opusids(rows):
+    return sorted(row[0] for row in rows)
+
+def test_sync_and_resync(server, api, tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    with Mirror(api, path, None, 'time', fields=['opusid', 'target'],
+                num_shards=4) as mirror:
+        result = mirror.sync()
+        assert result['observations'] == result['available'] == 2000
+        assert result['shards_synced'] == result['shards']
+
+        # Nothing changed on the server, so nothing is re-harvested
+        assert mirror.sync()['shards_synced'] == 0
+
+        server.data.set_num_rows(2500)
+        result = mirror.sync()
+        assert result['observations'] == 2500
+        assert 0 < result['shards_synced'] < result['shards']
+        assert (_opusids(mirror.get_metadata()) ==
+                _opusids(api.get_metadata(paging_limit=1000)))
+
+def test_reopen_with_tuple_product_types(api, tmp_path):
+    path = str(tmp_path / 'mirror.db')
+    query = Query(MultQuery('target', ['SATURN']))
+    with Mirror(api, path, query, 'time', product_types=('coiss_raw',),
+                num_shards=2) as mirror:
+        mirror.sync()
+    with Mirror(api, path, query, 'time', product_types=('coiss_raw',),
+                num_shards=2) as mirror:
+        assert mirror.sync()['shards_synced'] == 0
+        files = list(mirror.get_files())
+        assert len(files) == len(mirror) == 250
+        assert set(next(iter(files[0].values()))) == {'coiss_raw'}
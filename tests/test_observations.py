@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+Joined observation fetching tests against the fake OPUS server
+"""
+
+from opusapi import MultQuery, Query
+
+def test_joined_by_opusid(server, api):
+    query = Query(MultQuery('target', ['RHEA']))
+    api.fields
+    num_requests = server.num_requests
+    observations = list(api.get_observations(query=query,
+                                             fields=['target'],
+                                             product_types=['coiss_raw'],
+                                             image_size='thumb',
+                                             paging_limit=100))
+    assert len(observations) == 250
+    # One data.json, files.json and images.json call per page window
+    assert server.num_requests - num_requests == 3 * 3
+
+    first = observations[0]
+    assert first['opusid'] == 'co-iss-n1454725801'
+    assert first['metadata'] == {'opusid': 'co-iss-n1454725801',
+                                 'target': 'RHEA'}
+    assert list(first['files']) == ['coiss_raw']
+    assert first['images']['url'].endswith('N2_1_thumb.jpg')
+    assert ([obs['opusid'] for obs in observations] ==
+            [row[0] for row in api.get_metadata(query=query)])
+
+def test_prefetched_matches_serial(api):
+    serial = list(api.get_observations(limit=230, paging_limit=50))
+    assert list(api.get_observations(limit=230, paging_limit=50,
+                                     max_workers=3)) == serial
+    assert len(serial) == 230
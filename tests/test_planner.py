@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Query planner tests
+"""
+
+import pytest
+
+from opusapi import MultQuery, OR, Query, RangeQuery
+from opusapi.planner import canonicalize_query
+
+_TARGETS = ['SATURN', 'TITAN', 'RHEA', 'DIONE', 'TETHYS', 'ENCELADUS',
+            'MIMAS', 'IAPETUS']
+
+def test_canonicalize_query():
+    query = Query(Query(MultQuery('target', ['TITAN', 'RHEA', 'TITAN'])),
+                  OR(RangeQuery('observationduration', 1, 5),
+                     RangeQuery('observationduration', 3, 8)),
+                  MultQuery('target', ['RHEA', 'TITAN']))
+    canonical = canonicalize_query(query)
+    assert repr(canonical) == repr(
+                Query(MultQuery('target', ['RHEA', 'TITAN']),
+                      RangeQuery('observationduration', 1, 8)))
+
+def test_split_on_values_per_term(api):
+    # Splitting the larger term first used to recurse without end
+    query = Query(MultQuery('target', [f'T{i}' for i in range(50)]),
+                  MultQuery('instrument', [f'INSTRUMENT{i:040d}'
+                                           for i in range(10)]))
+    plan = api.plan_query(query, max_values_per_term=40)
+    assert len(plan) == 2
+    assert all(len(piece.query.terms[1].vals) <= 40
+               for piece in plan.pieces)
+
+def test_split_on_url_length(api):
+    query = Query(MultQuery('target', _TARGETS * 3),
+                  RangeQuery('observationduration', 10, 200))
+    plan = api.plan_query(query, fields=['opusid'], max_url_length=190)
+    assert len(plan) > 1
+    assert plan.estimate()['total'] == api.get_count(query)
+    with pytest.raises(RuntimeError):
+        api.plan_query(Query(MultQuery('target', ['TITAN'])),
+                       max_url_length=50)
+
+def test_planned_results_match(api):
+    query = Query(MultQuery('target', ['TITAN', 'RHEA', 'MIMAS']),
+                  RangeQuery('observationduration', 10, 100))
+    fields = ['opusid', 'target']
+    direct = list(api.get_metadata(query=query, fields=fields))
+    planned = list(api.get_metadata_planned(query=query, fields=fields,
+                                            max_values_per_term=1,
+                                            paging_limit=50))
+    assert len(direct) > 0
+    assert (sorted(row[0] for row in planned) ==
+            sorted(row[0] for row in direct))
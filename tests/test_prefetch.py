@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent page prefetching tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import MultQuery, Query
+
+def _ids(first, last):
+    return [[f'co-iss-n{1454725799+idx}'] for idx in range(first, last)]
+
+@pytest.mark.parametrize('limit', [None, 1, 250, 1999])
+def test_prefetch_matches_serial(api, limit):
+    serial = list(api.get_metadata(limit=limit, paging_limit=100))
+    assert serial == _ids(0, 2000 if limit is None else limit)
+    assert list(api.get_metadata(limit=limit, paging_limit=100,
+                                 max_workers=4, prefetch_pages=3)) == serial
+
+def test_prefetch_with_server_cap(server, api):
+    server.max_page_size = 70
+    query = Query(MultQuery('target', ['SATURN', 'TITAN']))
+    rows = list(api.get_metadata(query=query, paging_limit=200,
+                                 max_workers=4))
+    assert len(rows) == 500
+    assert rows == list(api.get_metadata(query=query, paging_limit=70))
+
+def test_prefetch_cap_drops_mid_search(server, api):
+    pages = api.get_metadata_raw(paging_limit=300, max_workers=3,
+                                 by_page=True)
+    rows = list(next(pages))
+    # Later pages are shorter than the window they were asked for
+    server.max_page_size = 120
+    for page in pages:
+        rows += page
+    assert rows == _ids(0, 2000)
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Query compilation tests
+"""
+
+import pytest
+
+from opusapi import (CompiledQuery, MultQuery, OR, Query, RangeQuery,
+                     StringQuery)
+
+def test_compiled_query_is_immutable_and_hashable(api):
+    query = Query(MultQuery('target', ['TITAN', 'RHEA']),
+                  RangeQuery('observationduration', 1, 2))
+    compiled = query.compile(opusapi=api)
+    assert compiled.source is query
+    assert compiled.compile() is compiled
+    assert compiled == Query(RangeQuery('observationduration', 1, 2),
+                             MultQuery('target', ['TITAN', 'RHEA'])).compile()
+    assert len({compiled, query.compile()}) == 1
+    assert compiled.get_api_params() == query.get_api_params()
+    with pytest.raises(AttributeError):
+        compiled.foo = 1
+
+def test_compile_validates(api):
+    with pytest.raises(RuntimeError):
+        Query(MultQuery('nosuchfield', ['A'])).compile(opusapi=api)
+    with pytest.raises(RuntimeError):
+        Query(StringQuery('target', 'TITAN')).compile(opusapi=api)
+    with pytest.raises(RuntimeError):
+        Query(OR(RangeQuery('observationduration', 1, 2),
+                 RangeQuery('observationduration', 5, 6,
+                            unit='km'))).compile(opusapi=api)
+
+def test_search_validates_once(api, monkeypatch):
+    calls = []
+    get_api_params = MultQuery.get_api_params
+    def _counting(self, opusapi=None):
+        calls.append(opusapi)
+        return get_api_params(self, opusapi=opusapi)
+    monkeypatch.setattr(MultQuery, 'get_api_params', _counting)
+
+    query = Query(MultQuery('target', ['TITAN']))
+    rows = list(api.get_metadata(query=query, paging_limit=50))
+    assert len(rows) == 250
+    # Once to compile, not once per page
+    assert len(calls) == 1
+
+def test_normalized_fields_are_memoized(api):
+    assert api._normalize_fields(['opusid', 'target']) == 'opusid,target'
+    assert ('opusid', 'target') in api._normalized_fields_cache
+    with pytest.raises(RuntimeError):
+        api._normalize_fields(['nosuchfield'])
+
+def test_compiled_query_usable_as_query(api):
+    compiled = CompiledQuery({'target': 'TITAN'})
+    assert api.get_count(compiled) == 250
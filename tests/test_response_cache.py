@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+ResponseCache tests against the fake OPUS server
+"""
+
+import time
+
+from opusapi import OPUSAPI, MultQuery, Query, ResponseCache
+
+def test_repeated_search_is_cached(server):
+    cache = ResponseCache()
+    api = OPUSAPI(server=server.url, cache=cache)
+    query = Query(MultQuery('target', ['TITAN']), MultQuery('planet',
+                                                             ['SATURN']))
+    rows = list(api.get_metadata(query=query, fields=['opusid', 'target']))
+    num_requests = server.num_requests
+
+    # The same search with its terms in a different order
+    query = Query(MultQuery('planet', ['SATURN']), MultQuery('target',
+                                                             ['TITAN']))
+    assert list(api.get_metadata(query=query,
+                                 fields=['opusid', 'target'])) == rows
+    assert server.num_requests == num_requests
+    assert cache.stats['hits'] == 3
+
+def test_disk_tier_shared(server, tmp_path):
+    path = str(tmp_path / 'cache.db')
+    api = OPUSAPI(server=server.url, cache=ResponseCache(disk_path=path))
+    count = api.get_count()
+    num_requests = server.num_requests
+
+    cache = ResponseCache(disk_path=path)
+    api = OPUSAPI(server=server.url, cache=cache)
+    assert api.get_count() == count
+    assert server.num_requests == num_requests
+    assert cache.stats['disk_hits'] == 1
+
+def test_entries_expire_and_are_keyed_by_server():
+    cache = ResponseCache(ttl=0.05)
+    cache.put('HTTP://Example.org/', 'data.json', {'a': 1}, b'body')
+    assert cache.get('http://example.org', 'data.json', {'a': '1'}) == b'body'
+    assert cache.get('http://other.org', 'data.json', {'a': 1}) is None
+    time.sleep(0.1)
+    assert cache.get('http://example.org', 'data.json', {'a': 1}) is None
+
+def test_memory_tier_is_bounded():
+    cache = ResponseCache(max_bytes=10)
+    for idx in range(5):
+        cache.put('http://example.org', 'data.json', {'page': idx},
+                  b'12345')
+    assert cache.stats['entries'] == 2
+    assert cache.stats['evictions'] == 3
+    assert cache.get('http://example.org', 'data.json', {'page': 0}) is None
+    assert cache.get('http://example.org', 'data.json',
+                     {'page': 4}) == b'12345'
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+ResultSet tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import MultQuery, Query, ResultSet
+
+def _ids(indexes):
+    return [[f'co-iss-n{1454725799+idx}'] for idx in indexes]
+
+def test_random_access_fetches_only_needed_pages(server, api):
+    results = api.search(page_size=100)
+    api.fields
+    num_requests = server.num_requests
+    assert len(results) == 2000
+    assert results[1234] == _ids([1234])[0]
+    assert results[-1] == _ids([1999])[0]
+    assert results[1250:1260] == _ids(range(1250, 1260))
+    # The count and the two pages holding the rows
+    assert server.num_requests - num_requests == 3
+    results[1200]
+    assert server.num_requests - num_requests == 3
+    with pytest.raises(IndexError):
+        results[2000]
+
+def test_lru_is_bounded(server, api):
+    results = ResultSet(api, page_size=10, max_pages=2)
+    results[0], results[10], results[20]
+    num_requests = server.num_requests
+    # The first page was evicted
+    results[0]
+    assert server.num_requests == num_requests + 1
+    results.refresh()
+    results[0]
+    assert server.num_requests == num_requests + 2
+
+def test_iteration(api):
+    query = Query(MultQuery('target', ['MIMAS']))
+    results = api.search(query, fields=['opusid', 'target'], page_size=60)
+    rows = list(results)
+    assert len(rows) == len(results) == 250
+    assert rows == list(api.get_metadata(query=query,
+                                         fields=['opusid', 'target']))
+
+def test_page_size_above_server_cap(server, api):
+    server.data.set_num_rows(3000)
+    results = ResultSet(api, page_size=2000)
+    server.max_page_size = 1000
+    assert len(results) == 3000
+    assert list(results) == _ids(range(3000))
+    assert results[1500] == _ids([1500])[0]
+    assert results[2999] == _ids([2999])[0]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+"""
+Range sharding tests against the fake OPUS server
+"""
+
+import pytest
+
+from opusapi import OPUSAPI, plan_range_shards
+
+def _opusids(rows):
+    return sorted(row[0] for row in rows)
+
+def test_time_shards_cover_the_query(api):
+    shards = plan_range_shards(api, None, 'time', 4)
+    assert len(shards) == 4
+    assert shards[0].unit == 'jd'
+    assert shards[0].minimum is None and shards[-1].maximum is None
+    assert sum(shard.estimated_count for shard in shards) == 2000
+
+    rows = list(api.get_metadata_sharded(fieldid='time', num_shards=4))
+    assert _opusids(rows) == _opusids(api.get_metadata(paging_limit=1000))
+
+def test_nulls_need_allow_missing(api):
+    with pytest.raises(RuntimeError):
+        list(api.get_metadata_sharded(fieldid='observationduration',
+                                      num_shards=4))
+    with pytest.warns(UserWarning):
+        rows = list(api.get_metadata_sharded(fieldid='observationduration',
+                                             num_shards=4,
+                                             allow_missing=True))
+    # Every 97th observation has no duration
+    assert len(rows) == 2000 - 21
+
+def test_time_field_without_jd(server):
+    for fieldid in ('time1', 'time2'):
+        server.data.fields[fieldid]['available_units'] = ['ymdhms']
+    api = OPUSAPI(server=server.url)
+    with pytest.raises(RuntimeError, match='can not be sharded'):
+        plan_range_shards(api, None, 'time', 4)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+Transport tests against the fake OPUS server
+"""
+
+from opusapi import OPUSAPI, Transport
+
+def test_connections_are_reused(server):
+    with Transport() as transport:
+        url = server.url + '/api/meta/result_count.json'
+        connect_times = [transport.get(url).connect_time for _ in range(5)]
+    assert connect_times[0] > 0
+    assert connect_times[1:] == [0.] * 4
+
+def test_shared_transport(server):
+    with Transport(pool_maxsize=4) as transport:
+        api1 = OPUSAPI(server=server.url, transport=transport)
+        api2 = OPUSAPI(server=server.url, transport=transport)
+        assert api1.transport is api2.transport is transport
+        assert api1.get_count() == api2.get_count() == 2000
+        # Closing an instance leaves a Transport it was given open
+        api1.close()
+        assert (list(api2.get_metadata(limit=3, max_workers=2)) ==
+                [[f'co-iss-n{1454725799+idx}'] for idx in range(3)])
+
+def test_transport_created_lazily(server):
+    api = OPUSAPI(server=server.url)
+    assert api._transport is None
+    api.get_count()
+    assert isinstance(api._transport, Transport)
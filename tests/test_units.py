@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Local unit conversion tests
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from opusapi import MultQuery, Query, RangeQuery
+
+_DISTANCE = 'SURFACEGEOtarget0_centerdistance1'
+
+def test_convert_values(api):
+    converter = api.unit_converter
+    assert converter.convert(2.5, _DISTANCE, 'm') == 2500.
+    assert (converter.convert([1, None, 3], _DISTANCE, 'm', from_unit='km')
+            .tolist()[::2] == [1000., 3000.])
+    assert np.isnan(converter.convert([1, None], _DISTANCE, 'm')[1])
+    series = pd.Series([1., 2.], index=['a', 'b'])
+    converted = converter.convert(series, 'observationduration',
+                                  'milliseconds')
+    assert converted.to_dict() == {'a': 1000., 'b': 2000.}
+    assert not converter.can_convert('observationduration', 'km')
+    with pytest.raises(RuntimeError):
+        converter.convert(1., 'levels', 'km')
+
+def test_convert_df(api):
+    frame = api.get_metadata_df(fields=['opusid', 'observationduration'],
+                                limit=10)
+    converted = api.unit_converter.convert_df(
+                        frame, {'observationduration': 'milliseconds'})
+    expected = frame['observationduration'] * 1000
+    assert converted['observationduration'].equals(expected)
+
+def test_convert_query(api):
+    query = Query(MultQuery('target', ['TITAN']),
+                  RangeQuery('observationduration', 10000, 50000,
+                             unit='milliseconds'))
+    converted = api.unit_converter.convert_query(query)
+    params = converted.get_api_params(opusapi=api)
+    assert params['observationduration1'] == 10.
+    assert params['observationduration2'] == 50.
+    assert 'unit-observationduration' not in params
+    seconds_query = Query(MultQuery('target', ['TITAN']),
+                          RangeQuery('observationduration', 10, 50))
+    assert api.get_count(converted) == api.get_count(seconds_query) > 0